@@ -0,0 +1,190 @@
+"""Activity heatmaps and inter-message latencies for capacity planning.
+
+Messages are read in chunks of ``ACTIVITY_CHUNK_SIZE`` rows, keyset-paginated
+on the primary key, as ``(id, timestamp, sender_id, receiver_id,
+len(content))`` tuples. The timestamp is converted to epoch seconds by the
+database, so every chunk is loaded into a NumPy structured array in one call
+and no model instances are built. Everything after that is vectorized:
+
+- the hour-of-week heatmap is a ``bincount`` of ``weekday * 24 + hour``,
+  accumulated chunk by chunk, weighted by content length for the volume;
+- latencies need the messages of a conversation side by side, so the
+  timestamp, sender and conversation key (the two user ids packed into one
+  integer) of every message are kept, 24 bytes per message, then sorted
+  with ``lexsort``. The differences of consecutive timestamps within a
+  conversation are the gaps between messages; those where the sender
+  changes are reply latencies.
+
+Times are in UTC. Results of a range are cached for
+``ACTIVITY_CACHE_TIMEOUT`` seconds by ``cached_report``.
+"""
+
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import FloatField, Func
+from django.db.models.functions import Length
+
+from chat_app.metrics import metrics
+
+from .models import Message
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+PERCENTILES = (50, 90, 95, 99)
+
+# Edges, in seconds, of the buckets of the latency histograms
+LATENCY_BUCKETS = (0, 1, 5, 15, 60, 300, 900, 3600, 6 * 3600, 24 * 3600, np.inf)
+
+MESSAGE_DTYPE = np.dtype([
+    ('id', np.int64),
+    ('timestamp', np.float64),
+    ('sender', np.int64),
+    ('receiver', np.int64),
+    ('length', np.int64),
+])
+
+
+class EpochSeconds(Func):
+    """
+    Seconds since 1970-01-01 UTC of a datetime column, as a float.
+    """
+    template = 'CAST(EXTRACT(EPOCH FROM %(expressions)s) AS DOUBLE PRECISION)'
+    output_field = FloatField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # julianday() is off by a few microseconds, enough to move a message
+        # sent on the hour into the previous one; milliseconds are exact
+        return self.as_sql(
+            compiler, connection,
+            template='ROUND((julianday(%(expressions)s) - 2440587.5) * 86400.0, 3)', **extra_context
+        )
+
+
+def message_chunks(queryset, chunk_size=None):
+    """
+    Yield the messages of ``queryset`` as structured arrays of ``MESSAGE_DTYPE``.
+
+    Args:
+        chunk_size (int): Rows per chunk; defaults to ``ACTIVITY_CHUNK_SIZE``.
+    """
+    chunk_size = chunk_size or settings.ACTIVITY_CHUNK_SIZE
+    columns = queryset.order_by('id').values_list(
+        'id', EpochSeconds('timestamp'), 'sender_id', 'receiver_id', Length('content')
+    )
+    last_id = 0
+    while True:
+        rows = list(columns.filter(id__gt=last_id)[:chunk_size])
+        if not rows:
+            return
+        yield np.fromiter(rows, dtype=MESSAGE_DTYPE, count=len(rows))
+        last_id = rows[-1][0]
+
+
+def hour_of_week(timestamps):
+    """
+    Return the UTC hour of the week (0 = Monday 00:00) of epoch seconds.
+    """
+    hours = np.floor_divide(timestamps, 3600).astype(np.int64)
+    # 1970-01-01 was a Thursday, three days after a Monday
+    return ((hours // 24 + 3) % 7) * 24 + hours % 24
+
+
+def conversation_keys(senders, receivers):
+    """
+    Pack each pair of user ids into one integer, the same in both directions.
+    """
+    return (np.minimum(senders, receivers) << 32) | np.maximum(senders, receivers)
+
+
+def distribution(seconds):
+    """
+    Summarize durations: count, mean, percentiles and a histogram over ``LATENCY_BUCKETS``.
+    """
+    counts, _ = np.histogram(seconds, bins=LATENCY_BUCKETS)
+    summary = {
+        'count': int(seconds.size),
+        'mean': float(seconds.mean()) if seconds.size else None,
+        'percentiles': {f'p{p}': None for p in PERCENTILES},
+        'histogram': {
+            'edges': [float(edge) for edge in LATENCY_BUCKETS[:-1]] + ['+Inf'],
+            'counts': counts.tolist(),
+        },
+    }
+    if seconds.size:
+        values = np.percentile(seconds, PERCENTILES)
+        summary['percentiles'] = {f'p{p}': float(value) for p, value in zip(PERCENTILES, values)}
+    return summary
+
+
+def latencies(timestamps, senders, keys):
+    """
+    Return the gaps between consecutive messages of each conversation and the reply latencies.
+
+    Returns:
+        tuple: ``(gaps, replies)``, arrays of seconds.
+    """
+    order = np.lexsort((timestamps, keys))
+    timestamps, senders, keys = timestamps[order], senders[order], keys[order]
+    same_conversation = keys[1:] == keys[:-1]
+    gaps = np.diff(timestamps)
+    replies = same_conversation & (senders[1:] != senders[:-1])
+    return gaps[same_conversation], gaps[replies]
+
+
+def activity_report(since, until, chunk_size=None):
+    """
+    Compute the activity heatmap and latency distributions of ``[since, until)``.
+
+    Returns:
+        dict: JSON-serializable report, see ``chat.activity``.
+    """
+    messages = Message.objects.filter(timestamp__gte=since, timestamp__lt=until)
+    counts = np.zeros(7 * 24, dtype=np.int64)
+    volume = np.zeros(7 * 24, dtype=np.int64)
+    timestamps, senders, keys = [], [], []
+
+    with metrics.timer('chat.activity.report'):
+        for chunk in message_chunks(messages, chunk_size):
+            cells = hour_of_week(chunk['timestamp'])
+            counts += np.bincount(cells, minlength=7 * 24)
+            volume += np.bincount(cells, weights=chunk['length'], minlength=7 * 24).astype(np.int64)
+            timestamps.append(chunk['timestamp'])
+            senders.append(chunk['sender'])
+            keys.append(conversation_keys(chunk['sender'], chunk['receiver']))
+
+        if timestamps:
+            gaps, replies = latencies(np.concatenate(timestamps), np.concatenate(senders), np.concatenate(keys))
+        else:
+            gaps = replies = np.empty(0)
+
+    return {
+        'since': since.isoformat(),
+        'until': until.isoformat(),
+        'messages': int(counts.sum()),
+        'heatmap': {
+            'weekdays': list(WEEKDAYS),
+            'messages': counts.reshape(7, 24).tolist(),
+            'characters': volume.reshape(7, 24).tolist(),
+        },
+        'gaps': distribution(gaps),
+        'replies': distribution(replies),
+        'computed_at': datetime.now(dt_timezone.utc).isoformat(),
+    }
+
+
+def cached_report(since, until):
+    """
+    Return ``activity_report(since, until)``, computed at most once per ``ACTIVITY_CACHE_TIMEOUT``.
+    """
+    key = f'chat:activity:{since.timestamp():.0f}:{until.timestamp():.0f}'
+    report = cache.get(key)
+    if report is None:
+        metrics.incr('chat.activity.cache.miss')
+        report = activity_report(since, until)
+        cache.set(key, report, settings.ACTIVITY_CACHE_TIMEOUT)
+    else:
+        metrics.incr('chat.activity.cache.hit')
+    return report
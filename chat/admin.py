@@ -1,4 +1,34 @@
 from django.contrib import admin
-from .models import Message
+from .models import (
+    Attachment, ClientRequest, Message, MessageArchive, MessageImport, MessageRollup, Room, RoomMembership, RoomMessage,
+)
 
 admin.site.register(Message)
+admin.site.register(Attachment)
+admin.site.register(MessageArchive)
+admin.site.register(MessageImport)
+admin.site.register(Room)
+admin.site.register(RoomMembership)
+admin.site.register(RoomMessage)
+admin.site.register(ClientRequest)
+
+
+@admin.register(MessageRollup)
+class MessageRollupAdmin(admin.ModelAdmin):
+    """
+    Read-only listing of the hourly message rollups, maintained by ``chat.rollups``.
+    """
+    list_display = ('hour', 'user', 'peer', 'room', 'messages', 'bytes')
+    list_select_related = ('user', 'peer', 'room')
+    date_hierarchy = 'hour'
+    search_fields = ('user__username',)
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,163 @@
+"""Cold storage for old chat messages.
+
+Messages older than a cutoff can be moved out of ``chat_message`` into one
+gzip-compressed NDJSON file per calendar month (see the ``archive_messages``
+management command). Each archived month is recorded as a ``MessageArchive``
+row, and ``MessageViewSet.archived`` reads the files back so that archived
+history stays available through the API, only slower.
+"""
+
+import gzip
+import json
+import os
+from datetime import date, datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+from .models import Message
+
+
+def month_start(value):
+    """
+    Return the first day of the month containing ``value``.
+    """
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    """
+    Return the first day of the month ``count`` months after ``month``.
+    """
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_range(month):
+    """
+    Return the ``[start, end)`` UTC datetimes covering ``month``.
+    """
+    end = add_months(month, 1)
+    return (
+        datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc),
+        datetime(end.year, end.month, 1, tzinfo=dt_timezone.utc),
+    )
+
+
+def parse_month(value):
+    """
+    Parse a ``YYYY-MM`` string into the first day of that month.
+
+    Raises:
+        ValueError: If ``value`` is not a valid month.
+    """
+    return datetime.strptime(value, '%Y-%m').date()
+
+
+def archive_path(month, directory=None):
+    """
+    Return the file path used for the archive of ``month``.
+    """
+    directory = directory or settings.MESSAGE_ARCHIVE_DIR
+    return os.path.join(directory, f'messages-{month:%Y-%m}.ndjson.gz')
+
+
+def message_to_row(message):
+    """
+    Convert a Message into the dict stored in an archive file.
+    """
+    return {
+        'id': message.id,
+        'sender_id': message.sender_id,
+        'receiver_id': message.receiver_id,
+        'content': message.content,
+        'timestamp': message.timestamp.isoformat(),
+        'deleted_at': message.deleted_at.isoformat() if message.deleted_at else None,
+        'attachment_id': message.attachment_id,
+        'attachment_name': message.attachment_name,
+    }
+
+
+def row_to_message(row):
+    """
+    Rebuild an unsaved Message from an archive row.
+
+    The instance is only meant for serialization; it is never saved.
+    """
+    return Message(
+        id=row['id'],
+        sender_id=row['sender_id'],
+        receiver_id=row['receiver_id'],
+        content=row['content'],
+        timestamp=parse_datetime(row['timestamp']),
+        deleted_at=parse_datetime(row['deleted_at']) if row['deleted_at'] else None,
+        # Archives written before attachments existed have no attachment keys
+        attachment_id=row.get('attachment_id'),
+        attachment_name=row.get('attachment_name', ''),
+    )
+
+
+def write_archive(path, messages):
+    """
+    Write messages to a gzip-compressed NDJSON file.
+
+    The file is written under a temporary name and renamed when complete, so
+    a crash never leaves a truncated archive behind.
+
+    Args:
+        path (str): Destination file.
+        messages: Iterable of Message instances.
+
+    Returns:
+        int: Number of rows written.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    count = 0
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as archive_file:
+        for message in messages:
+            archive_file.write(json.dumps(message_to_row(message), ensure_ascii=False))
+            archive_file.write('\n')
+            count += 1
+    os.replace(tmp_path, path)
+    return count
+
+
+def read_archive(path):
+    """
+    Yield the rows stored in an archive file.
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as archive_file:
+        for line in archive_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def load_archived_messages(archive, user_id, other_user_id=None):
+    """
+    Return the archived messages of one month visible to a user.
+
+    Mirrors the filtering of ``MessageViewSet.get_queryset``: the user must be
+    the sender or receiver, soft-deleted messages are skipped, and
+    ``other_user_id`` narrows the result to one conversation.
+
+    Args:
+        archive (MessageArchive): The archived month to read.
+        user_id (int): The requesting user.
+        other_user_id (int): Optional conversation partner.
+
+    Returns:
+        list: Unsaved Message instances, newest first.
+    """
+    messages = []
+    for row in read_archive(archive.path):
+        if row['deleted_at'] is not None:
+            continue
+        if user_id not in (row['sender_id'], row['receiver_id']):
+            continue
+        if other_user_id is not None and other_user_id not in (row['sender_id'], row['receiver_id']):
+            continue
+        messages.append(row_to_message(row))
+
+    messages.sort(key=lambda message: message.timestamp, reverse=True)
+    return messages
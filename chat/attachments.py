@@ -0,0 +1,257 @@
+"""File attachments of messages.
+
+Uploads never sit in memory: ``AttachmentUploadHandler`` writes each chunk
+of a multipart upload to a temporary file under ``ATTACHMENT_DIR`` while
+hashing it, and ``store_upload`` hard-links the finished file to a path
+derived from its SHA-256. Uploading the same content twice therefore stores
+it once and reuses the ``Attachment`` row.
+
+Downloads are served by ``attachment_response`` with ``Range``, ``If-Range``
+and ``If-None-Match`` support, streaming the file in
+``ATTACHMENT_CHUNK_SIZE`` pieces. Real-time events only carry
+``attachment_metadata``; the file itself is always fetched over HTTP, so it
+never passes through the channel layer.
+"""
+
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.http import content_disposition_header
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .export import iterate_in_thread
+from .models import Attachment
+
+# Types shown in the browser; everything else is downloaded
+INLINE_CONTENT_TYPES = ('image/png', 'image/jpeg', 'image/gif', 'image/webp')
+
+CONTENT_TYPE_RE = re.compile(r'^[\w.+-]+/[\w.+-]+$')
+
+
+class AttachmentTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'The attachment is too large.'
+    default_code = 'attachment_too_large'
+
+
+class UnsatisfiableRange(ValueError):
+    """Raised for a Range header that selects no byte of the file."""
+
+
+def attachment_path(sha256):
+    """
+    Return the path of the stored file with digest ``sha256``.
+    """
+    return Path(settings.ATTACHMENT_DIR) / sha256[:2] / sha256
+
+
+class AttachmentUploadHandler(FileUploadHandler):
+    """
+    Stream uploaded files to disk, hashing them on the way.
+
+    Each file is written to a temporary file next to the attachment storage,
+    so ``store_upload`` can link it in place without copying. The returned
+    ``UploadedFile`` has a ``sha256`` attribute; its temporary file is removed
+    when Django closes the request's files.
+
+    Raises:
+        AttachmentTooLarge: As soon as a file exceeds ``ATTACHMENT_MAX_SIZE``.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        directory = Path(settings.ATTACHMENT_DIR) / 'tmp'
+        directory.mkdir(parents=True, exist_ok=True)
+        self.file = tempfile.NamedTemporaryFile(dir=directory, suffix='.upload')
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.ATTACHMENT_MAX_SIZE:
+            self.file.close()
+            raise AttachmentTooLarge()
+        self.digest.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.flush()
+        self.file.seek(0)
+        upload = UploadedFile(
+            self.file, self.file_name, self.content_type, file_size, self.charset, self.content_type_extra
+        )
+        upload.sha256 = self.digest.hexdigest()
+        return upload
+
+
+def clean_content_type(content_type, name):
+    """
+    Return the declared content type if well formed, else a guess from ``name``.
+    """
+    content_type = (content_type or '').lower()
+    if CONTENT_TYPE_RE.match(content_type) and len(content_type) <= 100:
+        return content_type
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def store_upload(upload):
+    """
+    Move an upload from ``AttachmentUploadHandler`` into the attachment storage.
+
+    The file is linked in place before the row is created, so an
+    ``Attachment`` never points to a missing file. If the content is already
+    stored, the existing file and row are reused.
+
+    Returns:
+        Attachment: The attachment holding the uploaded content.
+    """
+    path = attachment_path(upload.sha256)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(upload.file.name, path)
+    except FileExistsError:
+        pass  # Same content uploaded before
+
+    attachment, _ = Attachment.objects.get_or_create(
+        sha256=upload.sha256,
+        defaults={'size': upload.size, 'content_type': clean_content_type(upload.content_type, upload.name)},
+    )
+    return attachment
+
+
+def attachment_metadata(message):
+    """
+    Describe the attachment of ``message`` for API clients and real-time events.
+
+    Returns:
+        dict: ``name``, ``size``, ``content_type`` and the download ``url``.
+    """
+    return {
+        'name': message.attachment_name,
+        'size': message.attachment.size,
+        'content_type': message.attachment.content_type,
+        'url': reverse('message-attachment', args=[message.id]),
+    }
+
+
+def parse_range(header, size):
+    """
+    Parse a single-range ``Range`` header.
+
+    Headers that are missing, malformed, not in bytes or ask for several
+    ranges are ignored, as RFC 9110 allows, and the whole file is served.
+
+    Returns:
+        tuple: ``(first, last)`` byte positions, inclusive, or None.
+
+    Raises:
+        UnsatisfiableRange: If the range starts past the end of the file.
+    """
+    match = re.fullmatch(r'\s*bytes=(\d*)-(\d*)\s*', header or '')
+    if match is None or match.group(1) == match.group(2) == '':
+        return None
+
+    first, last = match.groups()
+    if first == '':
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise UnsatisfiableRange()
+        return max(size - length, 0), size - 1
+
+    first = int(first)
+    if last != '' and int(last) < first:
+        return None  # Invalid range-spec
+    if first >= size:
+        raise UnsatisfiableRange()
+    last = size - 1 if last == '' else min(int(last), size - 1)
+    return first, last
+
+
+def read_file(handle, length, chunk_size):
+    """
+    Yield ``length`` bytes of an open file from its current position.
+    """
+    try:
+        while length > 0:
+            data = handle.read(min(chunk_size, length))
+            if not data:
+                return
+            length -= len(data)
+            yield data
+    finally:
+        handle.close()
+
+
+def attachment_response(request, message):
+    """
+    Serve the attachment of ``message``, honouring conditional and range requests.
+
+    A whole file requested through WSGI is returned as a ``FileResponse`` so
+    the server can use ``wsgi.file_wrapper`` (sendfile where available).
+    Ranges, and every download under ASGI, are streamed chunk by chunk.
+
+    Args:
+        request (HttpRequest): The Django request.
+        message (Message): A message with an attachment.
+
+    Returns:
+        HttpResponse: 200, 206, 304 or 416 response.
+
+    Raises:
+        Http404: If the stored file is missing.
+    """
+    attachment = message.attachment
+    etag = f'"{attachment.sha256}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if if_range is None or if_range == etag:
+        try:
+            byte_range = parse_range(request.headers.get('Range'), attachment.size)
+        except UnsatisfiableRange:
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = f'bytes */{attachment.size}'
+            return response
+
+    try:
+        handle = open(attachment_path(attachment.sha256), 'rb')
+    except FileNotFoundError:
+        raise Http404('Attachment file is missing')
+
+    asgi = isinstance(request, ASGIRequest)
+    if byte_range is None and not asgi:
+        response = FileResponse(handle, content_type=attachment.content_type)
+    else:
+        first, last = byte_range or (0, attachment.size - 1)
+        handle.seek(first)
+        stream = read_file(handle, last - first + 1, settings.ATTACHMENT_CHUNK_SIZE)
+        if asgi:
+            # Django buffers synchronous iterators under ASGI
+            stream = iterate_in_thread(stream)
+        response = StreamingHttpResponse(stream, content_type=attachment.content_type)
+        response['Content-Length'] = str(last - first + 1)
+        if byte_range is not None:
+            response.status_code = status.HTTP_206_PARTIAL_CONTENT
+            response['Content-Range'] = f'bytes {first}-{last}/{attachment.size}'
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private'
+    response['Content-Disposition'] = content_disposition_header(
+        attachment.content_type not in INLINE_CONTENT_TYPES, message.attachment_name or attachment.sha256
+    )
+    return response
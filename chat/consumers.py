@@ -10,9 +10,11 @@ from channels.generic.websocket import AsyncWebsocketConsumer
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from users.models import CustomUser
-from .models import Message
+from .models import Message, RoomMessage
 from asgiref.sync import sync_to_async
 from django.utils import timezone
+from chat_app.profiling import profile_handler
+from . import delivery, idempotency, inbox, rooms
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
@@ -37,6 +39,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         The group name is created by sorting and joining the usernames of both users
         to ensure that the same group is used regardless of who initiated the chat.
+
+        Messages from the other user that were never acknowledged are then sent
+        in one ``pending`` frame (see ``chat.delivery``).
         """
         try:
             # جلب اسم الغرفة من الرابط
@@ -69,14 +74,18 @@ class ChatConsumer(AsyncWebsocketConsumer):
             # قبول الاتصال عبر WebSocket
             await self.accept()
             print(f"WebSocket connection accepted for {user1} in room {self.room_name}")
+
+            # إرسال الرسائل التي لم تصل أثناء انقطاع المستخدم
+            await self.send_pending()
         except Exception as e:
             print(f"Error in WebSocket connect: {str(e)}")
-            # محاولة قبول الاتصال حتى في حالة الخطأ لتجنب تعليق المتصفح
+            # قبول الاتصال لإبلاغ المتصفح بالخطأ ثم إغلاقه بدل تركه مفتوحاً
             await self.accept()
             # إرسال رسالة خطأ للعميل
             await self.send(text_data=json.dumps({
                 'error': f"Connection error: {str(e)}"
             }))
+            await self.close(code=1011)
 
     async def disconnect(self, close_code):
         """
@@ -98,6 +107,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
         except Exception as e:
             print(f"Error in disconnect: {str(e)}")
 
+    @profile_handler('ChatConsumer.receive')
     async def receive(self, text_data):
         """
         Handle receiving messages from WebSocket.
@@ -105,13 +115,20 @@ class ChatConsumer(AsyncWebsocketConsumer):
         This method is called when a message is received from the WebSocket. It processes
         the message data, determines if it's a new message, an update to an existing one,
         or a message deletion request. It performs the appropriate database operation and
-        broadcasts the action to all users in the room.
+        broadcasts the action to all users in the room. A frame of the form
+        ``{"ack": [ids]}`` marks received messages as delivered instead.
 
         Args:
             text_data: The JSON string containing the message data.
         """
         # تحليل البيانات المستلمة
         text_data_json = json.loads(text_data)
+
+        # تأكيد استلام الرسائل
+        if 'ack' in text_data_json:
+            await sync_to_async(delivery.mark_delivered)(self.scope['user'].id, text_data_json['ack'])
+            return
+
         sender = self.scope['user']
         receiver = await self.get_receiver_user()
 
@@ -119,11 +136,15 @@ class ChatConsumer(AsyncWebsocketConsumer):
         message_id = text_data_json.get('message_id', None)
         delete_message_id = text_data_json.get('delete_message_id', None)
 
+        # مفتاح منع التكرار الذي يولده العميل لكل عملية
+        client_id = idempotency.clean_key(text_data_json.get('client_id'))
+
         # حالة حذف رسالة
         if delete_message_id:
             # حذف الرسالة
-            deleted = await self.delete_message(delete_message_id, sender)
-            if deleted:
+            deleted, replayed = await self.delete_message(delete_message_id, sender, client_id)
+            if deleted and not replayed:
+                await inbox.publish(inbox.MESSAGE_DELETED, deleted, self.channel_layer)
                 # إرسال إشعار الحذف إلى جميع المشتركين في الغرفة
                 await self.channel_layer.group_send(
                     self.room_group_name,
@@ -134,6 +155,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                         'deleted_message_id': delete_message_id
                     }
                 )
+            await self.reply(client_id, deleted or replayed, delete_message_id, 'Message not found')
             return
 
         # الحصول على محتوى الرسالة للإرسال أو التحديث
@@ -142,8 +164,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
         # حالة تحديث رسالة موجودة
         if message_id:
             # تحديث الرسالة
-            updated = await self.update_message(message_id, sender, message)
-            if updated:
+            updated, replayed = await self.update_message(message_id, sender, message, client_id)
+            if updated and not replayed:
+                await inbox.publish(inbox.MESSAGE_UPDATED, updated, self.channel_layer)
                 # إرسال التحديث إلى جميع المشتركين في الغرفة
                 await self.channel_layer.group_send(
                     self.room_group_name,
@@ -155,22 +178,41 @@ class ChatConsumer(AsyncWebsocketConsumer):
                         'message_id': message_id
                     }
                 )
+            await self.reply(client_id, updated or replayed, message_id, 'Message not found')
         # حالة إرسال رسالة جديدة
         else:
             # حفظ الرسالة الجديدة في قاعدة البيانات
-            saved_message = await self.save_message(sender, receiver, message)
+            saved_message, replayed = await self.save_message(sender, receiver, message, client_id)
+            event = {
+                'type': 'chat_message',
+                'sender': sender.username,
+                'receiver': receiver.username,
+                'message': message,
+                'id': saved_message.id if saved_message else None,
+            }
+            if replayed:
+                # إعادة محاولة: الرسالة محفوظة مسبقاً، نرسلها لهذا الاتصال فقط
+                if saved_message is not None:
+                    await self.chat_message(event)
+            else:
+                await inbox.publish(inbox.MESSAGE, saved_message, self.channel_layer)
+                # إخطار جميع المستخدمين بالرسالة الجديدة
+                await self.channel_layer.group_send(self.room_group_name, event)
+            await self.reply(client_id, True, event['id'])
 
-            # إخطار جميع المستخدمين بالرسالة الجديدة
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'chat_message',
-                    'sender': sender.username,
-                    'receiver': receiver.username,
-                    'message': message,
-                    'id': saved_message.id
-                }
-            )
+    async def reply(self, client_id, ok, message_id=None, error=None):
+        """
+        Acknowledge a client frame that carried a ``client_id``.
+
+        The reply only goes to this connection; frames without a key get no
+        reply, as before.
+        """
+        if client_id is None:
+            return
+        payload = {'reply_to': client_id, 'ok': bool(ok), 'id': message_id}
+        if not ok:
+            payload['error'] = error
+        await self.send(text_data=json.dumps(payload))
 
     async def chat_message(self, event):
         """
@@ -209,42 +251,87 @@ class ChatConsumer(AsyncWebsocketConsumer):
         # إرسال البيانات عبر WebSocket
         await self.send(text_data=json.dumps(response_data))
 
+    async def send_pending(self):
+        """
+        Send the unacknowledged messages of the other user in one frame.
+        """
+        user = self.scope['user']
+        if not user.is_authenticated:
+            return
+        partner = await self.get_receiver_user()
+        messages, truncated = await sync_to_async(delivery.pending_messages)(user.id, partner.id)
+        if not messages:
+            return
+        await self.send(text_data=json.dumps({
+            'pending': [
+                {
+                    'sender': message.sender.username,
+                    'receiver': message.receiver.username,
+                    'message': message.content,
+                    'id': message.id,
+                }
+                for message in messages
+            ],
+            'truncated': truncated,
+        }))
+
     @sync_to_async
-    def save_message(self, sender, receiver, message):
+    def save_message(self, sender, receiver, message, client_id=None):
         """
         Save a new message to the database.
+
+        Returns:
+            tuple: ``(message, replayed)``, see ``chat.idempotency.run_once``.
         """
-        return Message.objects.create(sender=sender, receiver=receiver, content=message)
+        return idempotency.run_once(
+            sender, client_id, lambda: Message.objects.create(sender=sender, receiver=receiver, content=message)
+        )
 
     @sync_to_async
-    def update_message(self, message_id, sender, new_content):
+    def update_message(self, message_id, sender, new_content, client_id=None):
         """
         Update an existing message in the database.
+
+        Returns:
+            tuple: ``(message, replayed)``; message is None if the sender does not own it.
         """
-        try:
-            # البحث عن الرسالة والتأكد من ملكية المرسل لها
-            message = Message.objects.get(id=message_id, sender=sender)
+        def write():
+            try:
+                # البحث عن الرسالة والتأكد من ملكية المرسل لها
+                message = Message.objects.select_related('sender', 'receiver', 'attachment').get(
+                    id=message_id, sender=sender
+                )
+            except (Message.DoesNotExist, TypeError, ValueError):
+                return None
             message.content = new_content
             message.save()
-            return True
-        except Message.DoesNotExist:
-            return False
+            return message
+
+        return idempotency.run_once(sender, client_id, write)
+
     @sync_to_async
-    def delete_message(self, message_id, sender):
+    def delete_message(self, message_id, sender, client_id=None):
         """
         delete an existing message in the database.
+
+        Returns:
+            tuple: ``(message, replayed)``; message is None if it was not found.
         """
-        try:
-           
-            message = Message.objects.get(id=message_id, sender=sender, deleted_at__isnull=True)
-            
+        def write():
+            try:
+                message = Message.objects.select_related('sender', 'receiver').get(
+                    id=message_id, sender=sender, deleted_at__isnull=True
+                )
+            except (Message.DoesNotExist, TypeError, ValueError):
+                print(f"Message ID: {message_id} not found or already deleted for sender: {sender.username}")
+                return None
+
             message.deleted_at = timezone.now()
             message.save(update_fields=['deleted_at'])
             print(f"Soft deleted message ID: {message_id} by sender: {sender.username}")
-            return True
-        except Message.DoesNotExist:
-            print(f"Message ID: {message_id} not found or already deleted for sender: {sender.username}")
-            return False
+            return message
+
+        return idempotency.run_once(sender, client_id, write)
 
     @sync_to_async
     def get_receiver_user(self):
@@ -262,3 +349,342 @@ class ChatConsumer(AsyncWebsocketConsumer):
         except Exception as e:
             print(f"Error getting receiver user: {str(e)}")
             return self.scope['user']
+
+
+class InboxConsumer(AsyncWebsocketConsumer):
+    """
+    WebSocket consumer carrying all conversations of a user on one connection.
+
+    The consumer joins the user's inbox group (see ``chat.inbox``), so a user
+    needs a single socket however many chats they have open. The client picks
+    the conversations it is displaying with ``subscribe``/``unsubscribe``:
+    subscribed conversations receive every event (new, edited and deleted
+    messages), the others only a short notification for new messages.
+
+    Client frames:
+        {"action": "subscribe", "conversation": "<username>"}
+        {"action": "unsubscribe", "conversation": "<username>"}
+        {"action": "send", "conversation": "<username>", "message": "...", "client_id": "<key>"}
+        {"action": "edit", "message_id": 1, "message": "..."}
+        {"action": "delete", "message_id": 1}
+        {"action": "ack", "ids": [1, 2]}
+
+    Server frames carry an ``event`` of ``message``, ``message_updated``,
+    ``message_deleted`` or ``notification`` plus the ``conversation`` they
+    belong to; ``subscribed``, ``unsubscribed`` and ``error`` answer client
+    frames. A ``send`` with a ``client_id`` is answered with a ``sent`` frame
+    and may be retried with the same key without creating a duplicate (see
+    ``chat.idempotency``).
+
+    Right after connecting, the client receives a ``pending`` frame with the
+    direct messages it never acknowledged (see ``chat.delivery``); it should
+    ``ack`` those and every new message it receives.
+
+    The consumer also joins the groups of the user's rooms (see
+    ``chat.rooms``) and forwards every message posted to them as a
+    ``room_message`` event.
+    """
+
+    async def connect(self):
+        """
+        Join the inbox group and room groups of the authenticated user, or refuse the connection.
+        """
+        self.user = self.scope.get('user')
+        if self.user is None or not self.user.is_authenticated:
+            await self.close(code=4401)
+            return
+
+        self.subscriptions = set()
+        self.group_name = inbox.inbox_group(self.user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        self.room_groups = set()
+        for room_id in await sync_to_async(rooms.room_ids)(self.user.id):
+            await self.join_room_group(room_id)
+        await self.accept()
+        await self.send_pending()
+
+    async def disconnect(self, close_code):
+        """
+        Leave the inbox group and room groups.
+        """
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        for group in getattr(self, 'room_groups', ()):
+            await self.channel_layer.group_discard(group, self.channel_name)
+
+    async def join_room_group(self, room_id):
+        group = rooms.room_group(room_id)
+        self.room_groups.add(group)
+        await self.channel_layer.group_add(group, self.channel_name)
+
+    @profile_handler('InboxConsumer.receive')
+    async def receive(self, text_data):
+        """
+        Dispatch a client frame to the handler of its ``action``.
+        """
+        try:
+            data = json.loads(text_data)
+            action = data['action']
+        except (ValueError, TypeError, KeyError):
+            await self.send_error('Invalid frame')
+            return
+
+        handler = {
+            'subscribe': self.subscribe,
+            'unsubscribe': self.unsubscribe,
+            'send': self.send_message,
+            'edit': self.edit_message,
+            'delete': self.delete_message,
+            'ack': self.ack_messages,
+        }.get(action)
+        if handler is None:
+            await self.send_error(f'Unknown action: {action}')
+            return
+        await handler(data)
+
+    async def subscribe(self, data):
+        conversation = data.get('conversation')
+        if not conversation:
+            await self.send_error('Missing conversation')
+            return
+        self.subscriptions.add(conversation)
+        await self.send(text_data=json.dumps({'event': 'subscribed', 'conversation': conversation}))
+
+    async def unsubscribe(self, data):
+        conversation = data.get('conversation')
+        self.subscriptions.discard(conversation)
+        await self.send(text_data=json.dumps({'event': 'unsubscribed', 'conversation': conversation}))
+
+    async def send_message(self, data):
+        content = (data.get('message') or '').strip()
+        if not content:
+            await self.send_error('Message content cannot be empty')
+            return
+        client_id = idempotency.clean_key(data.get('client_id'))
+        message, replayed = await self.create_message(data.get('conversation'), content, client_id)
+        if message is None and not replayed:
+            await self.send_error('Receiver not found')
+            return
+        if not replayed:
+            await inbox.publish(inbox.MESSAGE, message, self.channel_layer)
+        if client_id is not None:
+            await self.send(text_data=json.dumps({
+                'event': 'sent', 'reply_to': client_id, 'id': message.id if message else None,
+            }))
+
+    async def edit_message(self, data):
+        content = (data.get('message') or '').strip()
+        if not content:
+            await self.send_error('Message content cannot be empty')
+            return
+        message = await self.update_message(data.get('message_id'), content)
+        if message is None:
+            await self.send_error('Message not found')
+            return
+        await inbox.publish(inbox.MESSAGE_UPDATED, message, self.channel_layer)
+
+    async def delete_message(self, data):
+        message = await self.soft_delete_message(data.get('message_id'))
+        if message is None:
+            await self.send_error('Message not found')
+            return
+        await inbox.publish(inbox.MESSAGE_DELETED, message, self.channel_layer)
+
+    async def ack_messages(self, data):
+        await sync_to_async(delivery.mark_delivered)(self.user.id, data.get('ids') or [])
+
+    async def send_pending(self):
+        """
+        Send the unacknowledged direct messages of the user in one frame.
+        """
+        messages, truncated = await sync_to_async(delivery.pending_messages)(self.user.id)
+        if not messages:
+            return
+        events = []
+        for message in messages:
+            event = inbox.message_event(inbox.MESSAGE, message)
+            del event['type']
+            event['conversation'] = event['sender']
+            events.append(event)
+        await self.send(text_data=json.dumps({'event': 'pending', 'messages': events, 'truncated': truncated}))
+
+    async def inbox_event(self, event):
+        """
+        Forward an inbox event to the client according to its subscriptions.
+        """
+        conversation = event['receiver'] if event['sender'] == self.user.username else event['sender']
+        if conversation in self.subscriptions:
+            payload = {key: value for key, value in event.items() if key != 'type'}
+        elif event['event'] == inbox.MESSAGE:
+            payload = {
+                'event': 'notification',
+                'id': event['id'],
+                'sender': event['sender'],
+                'preview': (event['message'] or event.get('attachment', {}).get('name', ''))[:100],
+            }
+        else:
+            return
+        payload['conversation'] = conversation
+        await self.send(text_data=json.dumps(payload))
+
+    async def room_message(self, event):
+        """
+        Forward a message posted to one of the user's rooms.
+        """
+        payload = {key: value for key, value in event.items() if key != 'type'}
+        payload['event'] = 'room_message'
+        await self.send(text_data=json.dumps(payload))
+
+    async def room_joined(self, event):
+        """
+        Start receiving the messages of a room the user was added to.
+        """
+        await self.join_room_group(event['room'])
+        await self.send(text_data=json.dumps({'event': 'room_joined', 'room': event['room']}))
+
+    async def room_left(self, event):
+        """
+        Stop receiving the messages of a room the user was removed from.
+        """
+        if event['user_id'] != self.user.id:
+            return
+        group = rooms.room_group(event['room'])
+        self.room_groups.discard(group)
+        await self.channel_layer.group_discard(group, self.channel_name)
+        await self.send(text_data=json.dumps({'event': 'room_left', 'room': event['room']}))
+
+    async def send_error(self, error):
+        await self.send(text_data=json.dumps({'event': 'error', 'error': error}))
+
+    @sync_to_async
+    def create_message(self, receiver_username, content, client_id=None):
+        """
+        Save a new message from the connected user to ``receiver_username``.
+
+        Returns:
+            tuple: ``(message, replayed)``, see ``chat.idempotency.run_once``.
+        """
+        def write():
+            try:
+                receiver = CustomUser.objects.get(username=receiver_username)
+            except CustomUser.DoesNotExist:
+                return None
+            return Message.objects.create(sender=self.user, receiver=receiver, content=content)
+
+        return idempotency.run_once(self.user, client_id, write)
+
+    @sync_to_async
+    def update_message(self, message_id, content):
+        """
+        Update a message of the connected user.
+        """
+        message = self.get_own_message(message_id)
+        if message is not None:
+            message.content = content
+            message.save()
+        return message
+
+    @sync_to_async
+    def soft_delete_message(self, message_id):
+        """
+        Soft delete a message of the connected user.
+        """
+        message = self.get_own_message(message_id)
+        if message is not None:
+            message.deleted_at = timezone.now()
+            message.save(update_fields=['deleted_at'])
+        return message
+
+    def get_own_message(self, message_id):
+        """
+        Return the live message ``message_id`` of the connected user, or None.
+        """
+        try:
+            return Message.objects.select_related('sender', 'receiver', 'attachment').get(
+                id=int(message_id), sender=self.user, deleted_at__isnull=True
+            )
+        except (Message.DoesNotExist, TypeError, ValueError):
+            return None
+
+
+class RoomConsumer(AsyncWebsocketConsumer):
+    """
+    WebSocket consumer of a group room.
+
+    Only members can connect. Membership is checked once, on connect, against
+    the cached member ids of the room (see ``chat.rooms``), so no frame costs
+    a membership query. A member removed while connected receives
+    ``room.left`` and is disconnected.
+
+    A posted message is stored once and delivered to all connected members
+    with a single ``group_send``.
+
+    Client frames:
+        {"message": "..."}
+
+    Server frames carry an ``event`` of ``room_message`` or ``error``.
+    """
+
+    async def connect(self):
+        """
+        Join the room group if the authenticated user is a member, or refuse the connection.
+        """
+        self.user = self.scope.get('user')
+        self.room_id = int(self.scope['url_route']['kwargs']['room_id'])
+        if self.user is None or not self.user.is_authenticated:
+            await self.close(code=4401)
+            return
+        if not await sync_to_async(rooms.is_member)(self.room_id, self.user.id):
+            await self.close(code=4403)
+            return
+
+        self.group_name = rooms.room_group(self.room_id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        """
+        Leave the room group.
+        """
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    @profile_handler('RoomConsumer.receive')
+    async def receive(self, text_data):
+        """
+        Store a posted message and publish it to the room.
+        """
+        try:
+            content = (json.loads(text_data).get('message') or '').strip()
+        except (ValueError, AttributeError):
+            content = ''
+        if not content:
+            await self.send(text_data=json.dumps({'event': 'error', 'error': 'Message content cannot be empty'}))
+            return
+
+        message = await self.save_message(content)
+        await rooms.publish(message, self.channel_layer)
+
+    async def room_message(self, event):
+        """
+        Send a message posted to the room to the client.
+        """
+        payload = {key: value for key, value in event.items() if key != 'type'}
+        payload['event'] = 'room_message'
+        await self.send(text_data=json.dumps(payload))
+
+    async def room_left(self, event):
+        """
+        Disconnect when the connected user is removed from the room.
+        """
+        if event['user_id'] == self.user.id:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+            del self.group_name
+            await self.close(code=4403)
+
+    @sync_to_async
+    def save_message(self, content):
+        """
+        Save a new message from the connected user to the room.
+        """
+        return RoomMessage.objects.create(room_id=self.room_id, sender=self.user, content=content)
@@ -0,0 +1,82 @@
+"""Offline delivery of direct messages.
+
+A message is pending until a socket of its receiver acknowledges it, which
+sets ``Message.delivered_at``. When the receiver connects, ``ChatConsumer``
+and ``InboxConsumer`` send their pending messages in one batched frame, and
+the client acks the ids it has shown. Messages published while the receiver
+is connected are acked the same way, so a message that reached nobody is
+replayed on the next connection.
+
+The replay is bounded: only messages younger than ``PENDING_DELIVERY_TTL``
+are replayed, and at most the newest ``PENDING_DELIVERY_MAX`` of them. A
+user who was offline for a long time gets the recent backlog, flagged as
+truncated, and loads the rest through the API. The pending rows are found
+through a partial index, so the lookup stays cheap however much history a
+user has.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from chat_app.metrics import metrics
+
+from .models import Message
+
+
+def pending_messages(user_id, sender_id=None):
+    """
+    Return the messages to replay to ``user_id``, oldest first.
+
+    Args:
+        user_id (int): The receiver.
+        sender_id (int): Only return messages from this sender, if given.
+
+    Returns:
+        tuple: ``(messages, truncated)``; ``truncated`` is True if more
+        pending messages exist than were returned.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.PENDING_DELIVERY_TTL)
+    queryset = Message.objects.filter(
+        receiver_id=user_id,
+        delivered_at__isnull=True,
+        deleted_at__isnull=True,
+        timestamp__gte=cutoff,
+    )
+    if sender_id is not None:
+        queryset = queryset.filter(sender_id=sender_id)
+
+    limit = settings.PENDING_DELIVERY_MAX
+    messages = list(queryset.select_related('sender', 'receiver', 'attachment').order_by('-timestamp')[:limit + 1])
+    truncated = len(messages) > limit
+    messages = messages[:limit]
+    messages.reverse()
+    metrics.incr('chat.delivery.replayed', len(messages))
+    return messages, truncated
+
+
+def mark_delivered(user_id, message_ids):
+    """
+    Mark messages received by ``user_id`` as delivered.
+
+    Ids of messages the user did not receive, or that were already
+    delivered, are ignored.
+
+    Returns:
+        int: Number of messages marked delivered.
+    """
+    try:
+        ids = {int(message_id) for message_id in message_ids}
+    except (TypeError, ValueError):
+        return 0
+    if not ids:
+        return 0
+
+    count = Message.objects.filter(
+        id__in=list(ids)[:settings.PENDING_DELIVERY_MAX],
+        receiver_id=user_id,
+        delivered_at__isnull=True,
+    ).update(delivered_at=timezone.now())
+    metrics.incr('chat.delivery.acked', count)
+    return count
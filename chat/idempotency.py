@@ -0,0 +1,100 @@
+"""Client idempotency keys for message writes.
+
+A client that may retry a send, edit or delete (for example after its
+socket reconnects) attaches a unique ``client_id`` to the request.
+``run_once`` stores the key with the resulting message in the same
+transaction as the write; a retry with the same key returns the stored
+message without writing anything. The unique constraint on
+``ClientRequest`` settles concurrent retries: the loser's transaction is
+rolled back and it answers with the winner's message.
+
+Keys are kept for ``IDEMPOTENCY_KEY_TTL`` seconds and then removed by the
+``purge_idempotency_keys`` management command.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from chat_app.metrics import metrics
+
+from .models import ClientRequest
+
+# Longest key accepted; longer keys are rejected rather than truncated
+MAX_KEY_LENGTH = 64
+
+
+def clean_key(key):
+    """
+    Return ``key`` as a string, or None if it is missing or unusable.
+    """
+    if key is None or isinstance(key, (dict, list)):
+        return None
+    key = str(key).strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        return None
+    return key
+
+
+def previous_request(user, key):
+    """
+    Return the stored request of ``user`` with ``key``, or None.
+    """
+    return (
+        ClientRequest.objects.select_related('message__sender', 'message__receiver', 'message__attachment')
+        .filter(user=user, key=key)
+        .first()
+    )
+
+
+def run_once(user, key, write):
+    """
+    Call ``write()`` unless ``user`` already made a request with ``key``.
+
+    Args:
+        user: The user making the request.
+        key (str): Idempotency key from ``clean_key``; None disables the check.
+        write: Callable performing the write and returning the Message, or
+            None if nothing was written (for example a missing message).
+
+    Returns:
+        tuple: ``(message, replayed)``. ``replayed`` is True when the key was
+        seen before; ``message`` is then the message of the first request,
+        which may be None if it has since been purged.
+    """
+    if key is None:
+        return write(), False
+
+    previous = previous_request(user, key)
+    if previous is not None:
+        metrics.incr('chat.idempotency.replayed')
+        return previous.message, True
+
+    try:
+        with transaction.atomic():
+            message = write()
+            if message is not None:
+                ClientRequest.objects.create(user=user, key=key, message=message)
+    except IntegrityError:
+        # A concurrent retry with the same key committed first
+        previous = previous_request(user, key)
+        if previous is None:
+            raise
+        metrics.incr('chat.idempotency.replayed')
+        return previous.message, True
+    return message, False
+
+
+def purge_expired(now=None):
+    """
+    Delete keys older than ``IDEMPOTENCY_KEY_TTL``.
+
+    Returns:
+        int: Number of keys deleted.
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    deleted, _ = ClientRequest.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,244 @@
+"""Bulk loading of historical messages from NDJSON or CSV files.
+
+Used by the ``import_messages`` management command. Input records carry
+``sender``, ``receiver``, ``content`` and ``timestamp`` (ISO 8601), and
+optionally ``deleted_at``; the format is the one written by
+``export_messages``. ``sender`` and ``receiver`` are identifiers from the
+other system; ``UserMap`` resolves them to ``CustomUser`` ids from memory.
+
+Rows are written with ``COPY ... FROM STDIN`` on PostgreSQL and with
+``bulk_create`` elsewhere. Both keep the original timestamps although
+``Message.timestamp`` has ``auto_now_add``.
+"""
+
+import csv
+import gzip
+import io
+import json
+from contextlib import contextmanager
+from datetime import timezone as dt_timezone
+
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from users.models import CustomUser
+
+from .models import Message
+
+FORMATS = ('ndjson', 'csv')
+
+# Columns written for every imported message, in COPY order
+COLUMNS = ('sender_id', 'receiver_id', 'content', 'timestamp', 'deleted_at')
+
+
+class InvalidRow(ValueError):
+    """Raised for an input record that cannot be imported."""
+
+
+def detect_format(path):
+    """
+    Guess the input format from the file extension, ignoring ``.gz``.
+
+    Returns:
+        str: ``ndjson`` or ``csv``, or None if the extension is unknown.
+    """
+    name = path[:-3] if path.endswith('.gz') else path
+    if name.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    if name.endswith('.csv'):
+        return 'csv'
+    return None
+
+
+def open_input(path):
+    """
+    Open an input file as text, decompressing it if it ends with ``.gz``.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+
+def read_records(handle, file_format):
+    """
+    Yield the raw records of an input file without decoding them.
+
+    NDJSON records are the non-empty lines, CSV records are dicts keyed by
+    the header row. Keeping the decoding separate makes skipping already
+    imported records on resume cheap.
+    """
+    if file_format == 'csv':
+        yield from csv.DictReader(handle)
+        return
+    for line in handle:
+        if line.strip():
+            yield line
+
+
+def decode_record(record, file_format):
+    """
+    Return the dict for a raw record from ``read_records``.
+
+    Raises:
+        InvalidRow: If an NDJSON line is not a JSON object.
+    """
+    if file_format == 'csv':
+        return record
+    try:
+        data = json.loads(record)
+    except ValueError:
+        raise InvalidRow('Invalid JSON')
+    if not isinstance(data, dict):
+        raise InvalidRow('Not a JSON object')
+    return data
+
+
+class UserMap:
+    """
+    In-memory mapping from external user identifiers to ``CustomUser`` ids.
+
+    Every user is loaded once, so resolving a row never queries the database.
+
+    Args:
+        match (str): ``username`` to treat identifiers as usernames, ``id`` to
+            treat them as ``CustomUser`` ids.
+        mapping (dict): Optional ``{external identifier: username}`` pairs
+            applied before matching.
+    """
+
+    def __init__(self, match='username', mapping=None):
+        self.usernames = dict(CustomUser.objects.values_list('username', 'id'))
+        if match == 'id':
+            self.ids = {str(user_id): user_id for user_id in self.usernames.values()}
+        else:
+            self.ids = self.usernames
+        self.mapping = mapping or {}
+
+    @classmethod
+    def load_mapping(cls, path):
+        """
+        Read a CSV file of ``external_id,username`` rows.
+        """
+        with open_input(path) as handle:
+            return {row['external_id']: row['username'] for row in csv.DictReader(handle)}
+
+    def resolve(self, identifier):
+        """
+        Return the ``CustomUser`` id for ``identifier``, or None if unknown.
+        """
+        identifier = str(identifier)
+        if identifier in self.mapping:
+            return self.usernames.get(self.mapping[identifier])
+        return self.ids.get(identifier)
+
+
+def parse_timestamp(value, field):
+    """
+    Parse an ISO 8601 value into an aware datetime.
+
+    Raises:
+        InvalidRow: If the value is not a valid datetime.
+    """
+    try:
+        parsed = parse_datetime(value)
+    except (TypeError, ValueError):
+        parsed = None
+    if parsed is None:
+        raise InvalidRow(f'Invalid {field}: {value!r}')
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed
+
+
+def parse_row(data, user_map):
+    """
+    Convert a decoded record into a tuple of ``COLUMNS`` values.
+
+    Raises:
+        InvalidRow: If a field is missing or invalid, or a user is unknown.
+    """
+    try:
+        sender, receiver, content, timestamp = data['sender'], data['receiver'], data['content'], data['timestamp']
+    except KeyError as exc:
+        raise InvalidRow(f'Missing field: {exc.args[0]}')
+
+    sender_id = user_map.resolve(sender)
+    receiver_id = user_map.resolve(receiver)
+    if sender_id is None or receiver_id is None:
+        raise InvalidRow(f'Unknown user: {sender if sender_id is None else receiver}')
+    if content is None:
+        raise InvalidRow('Missing content')
+
+    deleted_at = data.get('deleted_at')
+    return (
+        sender_id,
+        receiver_id,
+        str(content).replace('\x00', ''),  # PostgreSQL text cannot store NUL
+        parse_timestamp(timestamp, 'timestamp'),
+        parse_timestamp(deleted_at, 'deleted_at') if deleted_at else None,
+    )
+
+
+@contextmanager
+def preserve_timestamps():
+    """
+    Let ``bulk_create`` write the ``timestamp`` given on each Message.
+
+    ``auto_now_add`` is switched off on the field for the duration of the
+    block. The change is process-wide, which is fine for a management
+    command but must not be used while serving requests.
+    """
+    field = Message._meta.get_field('timestamp')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+def copy_value(value):
+    """
+    Encode a value for the PostgreSQL COPY text format.
+    """
+    if value is None:
+        return r'\N'
+    if not isinstance(value, str):
+        value = value.isoformat() if hasattr(value, 'isoformat') else str(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_rows(rows):
+    """
+    Insert rows with ``COPY ... FROM STDIN``; PostgreSQL only.
+    """
+    data = ''.join('\t'.join(copy_value(value) for value in row) + '\n' for row in rows)
+    columns = ', '.join(f'"{column}"' for column in COLUMNS)
+    sql = f'COPY "{Message._meta.db_table}" ({columns}) FROM STDIN'
+    with connection.cursor() as cursor:
+        raw_cursor = cursor.cursor
+        if hasattr(raw_cursor, 'copy_expert'):
+            # psycopg2
+            raw_cursor.copy_expert(sql, io.StringIO(data))
+        else:
+            # psycopg 3
+            with raw_cursor.copy(sql) as copy:
+                copy.write(data)
+
+
+def bulk_create_rows(rows):
+    """
+    Insert rows with ``bulk_create``, keeping their timestamps.
+    """
+    with preserve_timestamps():
+        Message.objects.bulk_create([Message(**dict(zip(COLUMNS, row))) for row in rows])
+
+
+def load_rows(rows):
+    """
+    Insert parsed rows with the fastest method the database supports.
+    """
+    if connection.vendor == 'postgresql':
+        copy_rows(rows)
+    else:
+        bulk_create_rows(rows)
@@ -0,0 +1,81 @@
+"""Per-user inbox groups for real-time message delivery.
+
+Every connected ``InboxConsumer`` joins the channel-layer group of its user
+(``inbox_<user id>``), so one socket receives the events of all of the
+user's conversations. Whoever writes a message, whether ``ChatConsumer``,
+``InboxConsumer`` or ``MessageViewSet``, publishes one event to the inbox
+groups of the sender and the receiver. The sender's group is included so
+that their other devices stay in sync.
+
+Events about a message with an attachment describe the file (name, size,
+type and download URL) but never contain it.
+"""
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from .attachments import attachment_metadata
+
+# Event names sent to clients
+MESSAGE = 'message'
+MESSAGE_UPDATED = 'message_updated'
+MESSAGE_DELETED = 'message_deleted'
+
+
+def inbox_group(user_id):
+    """
+    Return the channel-layer group name of the inbox of ``user_id``.
+    """
+    return f'inbox_{user_id}'
+
+
+def message_event(event, message):
+    """
+    Build the channel-layer event published for ``message``.
+
+    Args:
+        event (str): One of ``MESSAGE``, ``MESSAGE_UPDATED`` or ``MESSAGE_DELETED``.
+        message (Message): The message; its sender, receiver and attachment must be loaded.
+
+    Returns:
+        dict: Event handled by ``InboxConsumer.inbox_event``.
+    """
+    payload = {
+        'type': 'inbox.event',
+        'event': event,
+        'id': message.id,
+        'sender': message.sender.username,
+        'receiver': message.receiver.username,
+    }
+    if event != MESSAGE_DELETED:
+        payload['message'] = message.content
+        payload['timestamp'] = message.timestamp.isoformat()
+        if message.attachment_id is not None:
+            payload['attachment'] = attachment_metadata(message)
+    return payload
+
+
+async def send_event(payload, user_ids, channel_layer=None):
+    """
+    Send ``payload`` to the inbox groups of ``user_ids``.
+    """
+    channel_layer = channel_layer or get_channel_layer()
+    for user_id in set(user_ids):
+        await channel_layer.group_send(inbox_group(user_id), payload)
+
+
+async def publish(event, message, channel_layer=None):
+    """
+    Send an event about ``message`` to the inbox groups of both participants.
+    """
+    await send_event(message_event(event, message), (message.sender_id, message.receiver_id), channel_layer)
+
+
+def publish_sync(event, message):
+    """
+    Synchronous version of ``publish`` for views and other sync code.
+
+    The event is built before switching to async code, so the sender,
+    receiver and attachment may still be loaded lazily here.
+    """
+    async_to_sync(send_event)(message_event(event, message), (message.sender_id, message.receiver_id))
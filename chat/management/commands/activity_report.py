@@ -0,0 +1,51 @@
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from chat import rollups
+
+
+class Command(BaseCommand):
+    help = ('Prints the hour-of-week activity heatmap and the inter-message latency percentiles '
+            'of a time range, computed with NumPy')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', default=None,
+                            help='Start of the range, ISO 8601 date or datetime (default: --days before --until)')
+        parser.add_argument('--until', default=None, help='End of the range (default: now)')
+        parser.add_argument('--days', type=int, default=28, help='Length of the range when --since is not given')
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help='Messages read per query (default: ACTIVITY_CHUNK_SIZE)')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        from chat.activity import activity_report
+
+        try:
+            until = rollups.parse_time(options['until']) if options['until'] else timezone.now()
+            since = rollups.parse_time(options['since']) if options['since'] else until - timedelta(days=options['days'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        if since >= until:
+            raise CommandError('--since must be before --until')
+
+        report = activity_report(since, until, options['chunk_size'])
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(f"{report['messages']} messages from {report['since']} to {report['until']} (UTC)")
+        self.stdout.write('\nMessages per hour of the week')
+        self.stdout.write('     ' + ''.join(f'{hour:>6}' for hour in range(24)))
+        for weekday, row in zip(report['heatmap']['weekdays'], report['heatmap']['messages']):
+            self.stdout.write(f'{weekday:<5}' + ''.join(f'{count:>6}' for count in row))
+
+        for name, label in (('gaps', 'Gap between messages'), ('replies', 'Reply latency')):
+            summary = report[name]
+            percentiles = '  '.join(
+                f'{key} {value:.1f} s' if value is not None else f'{key} -'
+                for key, value in summary['percentiles'].items()
+            )
+            self.stdout.write(f"\n{label:<24} n={summary['count']}  {percentiles}")
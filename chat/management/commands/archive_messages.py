@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from chat import partitions, rollups
+from chat.archive import add_months, archive_path, month_range, month_start, parse_month, write_archive
+from chat.models import Message, MessageArchive
+
+
+class Command(BaseCommand):
+    help = 'Moves messages older than a cutoff month into compressed NDJSON archive files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', required=True,
+                            help='Archive every month before this one (YYYY-MM)')
+        parser.add_argument('--dir', default=None,
+                            help='Directory for the archive files (default: MESSAGE_ARCHIVE_DIR)')
+
+    def handle(self, *args, **options):
+        try:
+            cutoff = parse_month(options['before'])
+        except ValueError:
+            raise CommandError('--before must be a month in YYYY-MM format')
+
+        directory = options['dir'] or settings.MESSAGE_ARCHIVE_DIR
+        partitioned = partitions.is_partitioned()
+
+        oldest = Message.objects.order_by('timestamp').values_list('timestamp', flat=True).first()
+        if oldest is None:
+            self.stdout.write(self.style.NOTICE('No messages to archive'))
+            return
+
+        month = month_start(oldest)
+        while month < cutoff:
+            self.archive_month(month, directory, partitioned)
+            month = add_months(month, 1)
+
+    def archive_month(self, month, directory, partitioned):
+        if MessageArchive.objects.filter(month=month).exists():
+            self.stdout.write(self.style.WARNING(f'{month:%Y-%m} is already archived, skipping'))
+            return
+
+        start, end = month_range(month)
+        messages = Message.objects.filter(timestamp__gte=start, timestamp__lt=end).order_by('timestamp')
+
+        path = archive_path(month, directory)
+        count = write_archive(path, messages.iterator(chunk_size=2000))
+
+        with transaction.atomic():
+            MessageArchive.objects.create(month=month, path=path, row_count=count)
+            if partitioned and month in partitions.existing_partitions():
+                partitions.drop_partition(month)
+            else:
+                # The rollups keep counting archived messages (see chat.rollups)
+                with rollups.suspended():
+                    messages.delete()
+
+        self.stdout.write(self.style.SUCCESS(f'Archived {count} messages from {month:%Y-%m} to {path}'))
@@ -0,0 +1,143 @@
+import asyncio
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+
+from chat_app.benchmark import format_stats, scratch_database, summarize
+from chat_app.cluster import LocalCluster, WebSocketClient
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = ('Starts 1..N local ASGI workers behind a round-robin load balancer and measures direct '
+            'message throughput, delivery latency and delivery correctness across workers')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', default=None,
+                            help='Comma-separated worker counts to measure (default: 1 up to the number of cores)')
+        parser.add_argument('--pairs', type=int, default=50, help='Pairs of users messaging each other')
+        parser.add_argument('--messages', type=int, default=20, help='Messages each user sends to their peer')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds to wait for every delivery')
+
+    def handle(self, *args, **options):
+        if settings.CHANNEL_LAYERS['default']['BACKEND'] == 'channels.layers.InMemoryChannelLayer':
+            raise CommandError('Workers need a cross-process channel layer; set REDIS_URL')
+
+        if options['workers']:
+            counts = [int(count) for count in options['workers'].split(',')]
+        else:
+            counts = list(range(1, (os.cpu_count() or 1) + 1))
+
+        with scratch_database():
+            name = connection.settings_dict['NAME']
+            if connection.vendor == 'sqlite' and connection.creation.is_in_memory_db(name):
+                raise CommandError('Workers cannot share an in-memory SQLite database; use PostgreSQL')
+            env = {**os.environ, 'DATABASE_NAME': name}
+
+            for count in counts:
+                cookies = self.seed(count, options['pairs'])
+                with LocalCluster(count, env=env, quiet=options['verbosity'] < 2) as cluster:
+                    result = asyncio.run(self.run(cluster, cookies, options['messages'], options['timeout']))
+                self.report(count, result)
+
+    def seed(self, count, pairs):
+        """
+        Create ``pairs`` pairs of users and log each of them in.
+
+        Returns:
+            list: ``(username, peer username, session cookie)`` per user, peers next to each other.
+        """
+        users = []
+        for i in range(pairs):
+            first = CustomUser.objects.create_user(username=f'cluster_{count}_{i}_a')
+            second = CustomUser.objects.create_user(username=f'cluster_{count}_{i}_b')
+            users += [(first, second), (second, first)]
+
+        cookies = []
+        for user, peer in users:
+            client = Client()
+            client.force_login(user)
+            session = client.cookies[settings.SESSION_COOKIE_NAME].value
+            cookies.append((user.username, peer.username, f'{settings.SESSION_COOKIE_NAME}={session}'))
+        return cookies
+
+    async def run(self, cluster, cookies, messages, timeout):
+        """
+        Connect every user to ``/ws/inbox/`` and have each send ``messages`` messages to their peer.
+
+        Every message carries its sequence number and send time, so the
+        receiving side measures latency and spots lost or duplicated messages.
+
+        Returns:
+            dict: Latencies, delivery counts, elapsed time and how many pairs
+            were served by two different workers.
+        """
+        clients = {}
+        for username, _, cookie in cookies:
+            clients[username] = await WebSocketClient.connect(cluster.port, '/ws/inbox/', cookie)
+        worker = {username: cluster.balancer.assignments[client.local_port] for username, client in clients.items()}
+
+        latencies = []
+        received = {username: [] for username in clients}
+
+        async def receive(username, peer):
+            client = clients[username]
+            while len(received[username]) < messages:
+                frame = await client.receive_json()
+                if frame is None:
+                    return
+                if frame.get('event') != 'notification' or frame['sender'] != peer:
+                    continue
+                sequence, sent_at = frame['preview'].split()
+                latencies.append(time.perf_counter() - float(sent_at))
+                received[username].append(int(sequence))
+
+        receivers = [asyncio.create_task(receive(username, peer)) for username, peer, _ in cookies]
+        start = time.perf_counter()
+        for sequence in range(messages):
+            for username, peer, _ in cookies:
+                clients[username].send_json({
+                    'action': 'send',
+                    'conversation': peer,
+                    'message': f'{sequence} {time.perf_counter()}',
+                })
+            # Let the sockets flush between rounds
+            await asyncio.sleep(0)
+
+        _, pending = await asyncio.wait(receivers, timeout=timeout)
+        elapsed = time.perf_counter() - start
+        for task in pending:
+            task.cancel()
+        for client in clients.values():
+            client.close()
+
+        delivered = sum(len(set(sequences)) for sequences in received.values())
+        return {
+            'latencies': latencies,
+            'elapsed': elapsed,
+            'expected': messages * len(clients),
+            'delivered': delivered,
+            'duplicated': sum(len(sequences) for sequences in received.values()) - delivered,
+            'pairs': len(clients) // 2,
+            'cross_worker_pairs': sum(
+                worker[username] != worker[peer] for username, peer, _ in cookies[::2]
+            ),
+        }
+
+    def report(self, count, result):
+        label = f"{count} worker{'s' if count > 1 else ''}"
+        if result['latencies']:
+            self.stdout.write(format_stats(f'{label}, delivery', summarize(result['latencies'])))
+        throughput = result['delivered'] / result['elapsed'] if result['elapsed'] else 0
+        missing = result['expected'] - result['delivered']
+        line = (
+            f"{'':<32} {throughput:>10.1f} msg/s  {result['delivered']}/{result['expected']} delivered, "
+            f"{missing} missing, {result['duplicated']} duplicated, "
+            f"{result['cross_worker_pairs']}/{result['pairs']} pairs across workers"
+        )
+        style = self.style.SUCCESS if not missing and not result['duplicated'] else self.style.ERROR
+        self.stdout.write(style(line))
@@ -0,0 +1,96 @@
+import json
+import time
+import zlib
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.utils.text import compress_string
+
+from chat.models import Message
+from chat_app.benchmark import format_stats, measure, scratch_database
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Reports bytes on the wire and CPU cost of gzip for API pages and chat.html, and of permessage-deflate for chat bursts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200, help='Number of timed compressions per payload')
+        parser.add_argument('--messages', type=int, default=100, help='Messages per API page and per WebSocket burst')
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            sender, receiver = self.seed(options['messages'])
+            client = Client()
+            client.force_login(sender)
+
+            payloads = {
+                f'/api/messages/ ({options["messages"]} rows)':
+                    client.get(f'/api/messages/?page_size={options["messages"]}').content,
+                'chat.html': client.get(f'/chat/{receiver.username}/').content,
+            }
+
+        self.stdout.write('HTTP responses (gzip)')
+        for label, body in payloads.items():
+            compressed = compress_string(body)
+            self.report_size(label, len(body), len(compressed))
+            self.stdout.write(format_stats('  compress', measure(lambda: compress_string(body), options['iterations'])))
+
+        frames = self.chat_burst(options['messages'])
+        raw = sum(len(frame) for frame in frames)
+        self.stdout.write(f'WebSocket burst of {len(frames)} chat frames (permessage-deflate)')
+        for label, takeover in (('context takeover', True), ('no context takeover', False)):
+            sizes = self.deflate_frames(frames, takeover)
+            self.report_size(f'  {label}', raw, sum(sizes))
+            stats = measure(lambda: self.deflate_frames(frames, takeover), max(1, options['iterations'] // 10))
+            self.stdout.write(
+                f"  CPU per frame {stats['mean'] / len(frames) * 1e6:.1f} us ({label})"
+            )
+
+    def report_size(self, label, raw, compressed):
+        self.stdout.write(
+            f'{label:<32} {raw:>9} B -> {compressed:>8} B  ({compressed / raw:.0%} of original)'
+        )
+
+    def deflate_frames(self, frames, takeover):
+        """
+        Compress frames the way permessage-deflate does with the configured window.
+        """
+        def compressor():
+            return zlib.compressobj(
+                zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+                -settings.WEBSOCKET_DEFLATE_WINDOW_BITS, settings.WEBSOCKET_DEFLATE_MEM_LEVEL,
+            )
+
+        shared = compressor()
+        sizes = []
+        for frame in frames:
+            deflater = shared if takeover else compressor()
+            data = deflater.compress(frame) + deflater.flush(zlib.Z_SYNC_FLUSH)
+            # The trailing 00 00 ff ff of the sync flush is not sent (RFC 7692)
+            sizes.append(len(data) - 4)
+        return sizes
+
+    def chat_burst(self, count):
+        """
+        Build the frames ChatConsumer sends for a burst of new messages.
+        """
+        return [
+            json.dumps({
+                'sender': 'bench_sender',
+                'receiver': 'bench_receiver',
+                'message': f'Benchmark message {i}: are we still on for {time.strftime("%A")} at {i % 12 + 1}pm?',
+                'id': 1000 + i,
+            }).encode()
+            for i in range(count)
+        ]
+
+    def seed(self, num_messages):
+        sender = CustomUser.objects.create_user(username='bench_sender', password='bench-pass')
+        receiver = CustomUser.objects.create_user(username='bench_receiver', password='bench-pass')
+        Message.objects.bulk_create([
+            Message(sender=sender, receiver=receiver, content=f'Benchmark message {i}')
+            for i in range(num_messages)
+        ])
+        return sender, receiver
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+
+from chat.models import Message
+from chat.serializers import MessageSerializer, message_rows
+from chat_app.benchmark import format_stats, measure, scratch_database
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks fetching and serializing one page of messages with MessageSerializer and the fast read path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=500, help='Number of timed pages per run')
+        parser.add_argument('--page-size', type=int, default=100, help='Number of messages per page')
+
+    def handle(self, *args, **options):
+        page_size = options['page_size']
+        with scratch_database():
+            queryset = self.seed(page_size)
+            self.stdout.write(f'Pages of {page_size} messages')
+
+            def model_serializer():
+                return MessageSerializer(list(queryset[:page_size]), many=True).data
+
+            def fast_path():
+                return message_rows.serialize(message_rows.values(queryset)[:page_size])
+
+            # Serialization alone, on rows that were already fetched
+            instances = list(queryset[:page_size])
+            rows = list(message_rows.values(queryset)[:page_size])
+
+            assert model_serializer() == fast_path()
+            for label, func in (
+                ('MessageSerializer', model_serializer),
+                ('message_rows', fast_path),
+                ('serialize: MessageSerializer', lambda: MessageSerializer(instances, many=True).data),
+                ('serialize: message_rows', lambda: message_rows.serialize(rows)),
+            ):
+                stats = measure(func, options['iterations'])
+                self.stdout.write(format_stats(label, stats))
+
+    def seed(self, page_size):
+        sender = CustomUser.objects.create_user(username='bench_sender', password='bench-pass')
+        receiver = CustomUser.objects.create_user(username='bench_receiver', password='bench-pass')
+        Message.objects.bulk_create([
+            Message(sender=sender, receiver=receiver, content=f'Benchmark message {i}')
+            for i in range(page_size)
+        ])
+        return Message.objects.filter(sender=sender, deleted_at__isnull=True).order_by('-timestamp')
@@ -0,0 +1,98 @@
+import time
+
+import asyncio
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand
+
+from chat import inbox, rooms
+from chat.models import Message, Room, RoomMembership, RoomMessage
+from chat_app.benchmark import format_stats, scratch_database, summarize
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = ('Measures delivery latency of one message to every member as rooms grow, for a room '
+            '(one row, one group_send) and for one-to-one messages to each member')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', default='10,50,100,250,500',
+                            help='Comma-separated member counts to measure')
+        parser.add_argument('--iterations', type=int, default=20, help='Messages sent per member count and mode')
+
+    def handle(self, *args, **options):
+        counts = [int(count) for count in options['members'].split(',')]
+        self.stdout.write(f'Channel layer: {type(get_channel_layer()).__name__}')
+        with scratch_database():
+            for count in counts:
+                room, sender, members = self.seed(count)
+                results = async_to_sync(self.run)(room, sender, members, options['iterations'])
+                for mode, (send, delivery) in results.items():
+                    self.stdout.write(format_stats(f'{count} members, {mode} send', summarize(send)))
+                    self.stdout.write(format_stats(f'{count} members, {mode} delivery', summarize(delivery)))
+
+    async def run(self, room, sender, members, iterations):
+        """
+        Send ``iterations`` messages in each mode and time their delivery.
+
+        Every member is a channel that joined both the room group and its own
+        inbox group, like an ``InboxConsumer``. Delivery latency is measured
+        from the start of the send to the moment each member has received the
+        event.
+
+        Returns:
+            dict: ``{mode: (send durations, delivery latencies)}`` in seconds.
+        """
+        layer = get_channel_layer()
+        channels = []
+        for member in members:
+            channel = await layer.new_channel()
+            await layer.group_add(rooms.room_group(room.id), channel)
+            await layer.group_add(inbox.inbox_group(member.id), channel)
+            channels.append(channel)
+
+        @sync_to_async
+        def save_room_message(content):
+            return RoomMessage.objects.create(room=room, sender=sender, content=content)
+
+        @sync_to_async
+        def save_direct_messages(content):
+            return [Message.objects.create(sender=sender, receiver=member, content=content) for member in members]
+
+        async def room_send(content):
+            await rooms.publish(await save_room_message(content), layer)
+
+        async def direct_send(content):
+            # What sending to every member costs without rooms: one row and one publish per member
+            for message in await save_direct_messages(content):
+                await inbox.send_event(inbox.message_event(inbox.MESSAGE, message), [message.receiver_id], layer)
+
+        async def receive(channel, start):
+            await layer.receive(channel)
+            return time.perf_counter() - start
+
+        results = {}
+        for mode, send in (('room', room_send), ('one-to-one', direct_send)):
+            send_times, latencies = [], []
+            for i in range(iterations):
+                start = time.perf_counter()
+                await send(f'Benchmark message {i}')
+                send_times.append(time.perf_counter() - start)
+                latencies.extend(await asyncio.gather(*(receive(channel, start) for channel in channels)))
+            results[mode] = (send_times, latencies)
+
+        for member, channel in zip(members, channels):
+            await layer.group_discard(rooms.room_group(room.id), channel)
+            await layer.group_discard(inbox.inbox_group(member.id), channel)
+        return results
+
+    def seed(self, count):
+        sender = CustomUser.objects.create_user(username=f'bench_sender_{count}', password='bench-pass')
+        members = CustomUser.objects.bulk_create([
+            CustomUser(username=f'bench_member_{count}_{i}') for i in range(count)
+        ])
+        room = Room.objects.create(name=f'Bench {count}', created_by=sender)
+        RoomMembership.objects.bulk_create(
+            [RoomMembership(room=room, user=user) for user in [sender, *members]]
+        )
+        return room, sender, members
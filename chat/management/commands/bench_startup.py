@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat_app.benchmark import import_time_by_package, measure_startup, summarize
+
+
+class Command(BaseCommand):
+    help = ('Measures the cold start of a worker (importing chat_app.asgi.application and the URLconf '
+            'in a fresh interpreter) and fails when it exceeds the budget or loads deferred modules')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Number of timed cold starts')
+        parser.add_argument('--budget', type=float, default=None,
+                            help='Median start-up time allowed, in ms (default: STARTUP_IMPORT_BUDGET_MS)')
+        parser.add_argument('--top', type=int, default=15, help='Number of packages listed by import time')
+
+    def handle(self, *args, **options):
+        budget = options['budget'] if options['budget'] is not None else settings.STARTUP_IMPORT_BUDGET_MS
+
+        # One run under -X importtime for the breakdown; its timing is inflated
+        # by the instrumentation, so it is not part of the measurement.
+        profile = measure_startup(importtime=True)
+        self.stdout.write(f'Import time by package ({len(profile["imports"])} modules)')
+        for package, seconds in import_time_by_package(profile['imports'])[:options['top']]:
+            self.stdout.write(f'  {package:<30} {seconds * 1000:>8.1f} ms')
+
+        stats = summarize([measure_startup()['seconds'] for _ in range(options['runs'])])
+        self.stdout.write(
+            f"{'cold start':<32} p50 {stats['p50'] * 1000:>8.1f} ms  "
+            f"mean {stats['mean'] * 1000:>8.1f} ms  p95 {stats['p95'] * 1000:>8.1f} ms  "
+            f"budget {budget:.0f} ms"
+        )
+
+        errors = []
+        loaded = set(profile['modules'])
+        deferred = [module for module in settings.STARTUP_DEFERRED_MODULES if module in loaded]
+        if deferred:
+            errors.append(f"modules meant to load on first use were imported at start-up: {', '.join(deferred)}")
+        if stats['p50'] * 1000 > budget:
+            errors.append(f"median start-up of {stats['p50'] * 1000:.0f} ms is over the {budget:.0f} ms budget")
+        if errors:
+            raise CommandError('; '.join(errors))
+        self.stdout.write(self.style.SUCCESS('Start-up is within budget'))
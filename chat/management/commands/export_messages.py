@@ -0,0 +1,74 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from chat.export import FORMATS, export_records, export_stream
+from chat.models import Message
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Writes message history to an NDJSON or CSV file, optionally gzip-compressed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Destination file')
+        parser.add_argument('--user', default=None,
+                            help='Only export the conversations of this username (default: all messages)')
+        parser.add_argument('--with', dest='other_user', default=None,
+                            help='Only export the conversation between --user and this username')
+        parser.add_argument('--type', dest='file_format', choices=sorted(FORMATS), default='ndjson',
+                            help='File format (default: ndjson)')
+        parser.add_argument('--gzip', action='store_true', help='Gzip the file')
+        parser.add_argument('--include-deleted', action='store_true', help='Also export soft-deleted messages')
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help='Rows fetched per round trip (default: MESSAGE_EXPORT_CHUNK_SIZE)')
+
+    def handle(self, *args, **options):
+        queryset = self.get_queryset(options)
+        exported = 0
+
+        def counted(chunks):
+            nonlocal exported
+            for records in chunks:
+                exported += len(records)
+                yield records
+
+        path = options['output']
+        tmp_path = f'{path}.tmp'
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        start = time.perf_counter()
+        chunks = counted(export_records(queryset, options['chunk_size']))
+        with open(tmp_path, 'wb') as export_file:
+            for data in export_stream(chunks, options['file_format'], options['gzip']):
+                export_file.write(data)
+        os.replace(tmp_path, path)
+        elapsed = time.perf_counter() - start
+
+        rate = exported / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Exported {exported} messages to {path} in {elapsed:.2f} s ({rate:.0f} rows/sec)'
+        ))
+
+    def get_queryset(self, options):
+        queryset = Message.objects.all()
+        if not options['include_deleted']:
+            queryset = queryset.filter(deleted_at__isnull=True)
+
+        if options['user']:
+            user = self.get_user(options['user'])
+            queryset = queryset.filter(Q(sender=user) | Q(receiver=user))
+            if options['other_user']:
+                other = self.get_user(options['other_user'])
+                queryset = queryset.filter(Q(sender=other) | Q(receiver=other))
+        elif options['other_user']:
+            raise CommandError('--with requires --user')
+
+        return queryset.order_by('timestamp', 'id')
+
+    def get_user(self, username):
+        try:
+            return CustomUser.objects.get(username=username)
+        except CustomUser.DoesNotExist:
+            raise CommandError(f'Unknown user: {username}')
@@ -0,0 +1,107 @@
+import os
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from chat import rollups, sidebar
+from chat.importer import (
+    COLUMNS, FORMATS, InvalidRow, UserMap, decode_record, detect_format, load_rows, open_input, parse_row,
+    read_records,
+)
+from chat.models import MessageImport
+
+
+class Command(BaseCommand):
+    help = 'Bulk imports historical messages from an NDJSON or CSV file; interrupted imports resume where they stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='NDJSON or CSV file, optionally gzip-compressed')
+        parser.add_argument('--type', dest='file_format', choices=FORMATS, default=None,
+                            help='Input format (default: guessed from the file extension)')
+        parser.add_argument('--users-by', choices=('username', 'id'), default='username',
+                            help='Match sender/receiver values against usernames or user ids (default: username)')
+        parser.add_argument('--user-map', default=None,
+                            help='CSV file with external_id,username columns mapping external identifiers to users')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows loaded per transaction')
+        parser.add_argument('--name', default=None,
+                            help='Name identifying the import for resuming (default: absolute input path)')
+        parser.add_argument('--restart', action='store_true',
+                            help='Forget the progress of a previous import with the same name and start over')
+
+    def handle(self, *args, **options):
+        path = options['input']
+        file_format = options['file_format'] or detect_format(path)
+        if file_format is None:
+            raise CommandError('Cannot guess the input format; use --type ndjson or --type csv')
+        if not os.path.exists(path):
+            raise CommandError(f'No such file: {path}')
+
+        progress = self.get_progress(options['name'] or os.path.abspath(path), options['restart'])
+        if progress.finished_at is not None:
+            self.stdout.write(self.style.WARNING(
+                f'{progress.source} was already imported on {progress.finished_at:%Y-%m-%d %H:%M}; use --restart to import it again'
+            ))
+            return
+
+        mapping = UserMap.load_mapping(options['user_map']) if options['user_map'] else None
+        user_map = UserMap(options['users_by'], mapping)
+
+        if progress.rows_read:
+            self.stdout.write(f'Resuming after {progress.rows_read} rows')
+
+        imported = skipped = 0
+        start = time.perf_counter()
+        with open_input(path) as handle:
+            records = read_records(handle, file_format)
+            for _ in islice(records, progress.rows_read):
+                pass
+
+            while True:
+                batch = list(islice(records, options['batch_size']))
+                if not batch:
+                    break
+
+                rows = []
+                for record in batch:
+                    try:
+                        rows.append(parse_row(decode_record(record, file_format), user_map))
+                    except InvalidRow as exc:
+                        skipped += 1
+                        if options['verbosity'] > 1:
+                            self.stderr.write(f'Skipped row: {exc}')
+
+                # The progress is committed with the rows, so a crash never
+                # loads a batch twice or loses one.
+                with transaction.atomic():
+                    if rows:
+                        load_rows(rows)
+                        rollups.add_rows(dict(zip(COLUMNS, row)) for row in rows)
+                    MessageImport.objects.filter(pk=progress.pk).update(
+                        rows_read=F('rows_read') + len(batch),
+                        rows_imported=F('rows_imported') + len(rows),
+                        rows_skipped=F('rows_skipped') + len(batch) - len(rows),
+                    )
+                imported += len(rows)
+
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'{imported} messages imported')
+
+        MessageImport.objects.filter(pk=progress.pk).update(finished_at=timezone.now())
+        # bulk loading sends no signals, so cached sidebars do not know the new messages
+        sidebar.invalidate_all_sidebars()
+
+        elapsed = time.perf_counter() - start
+        rate = (imported + skipped) / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} messages, skipped {skipped} rows in {elapsed:.2f} s ({rate:.0f} rows/sec)'
+        ))
+
+    def get_progress(self, source, restart):
+        if restart:
+            MessageImport.objects.filter(source=source).delete()
+        progress, _ = MessageImport.objects.get_or_create(source=source)
+        return progress
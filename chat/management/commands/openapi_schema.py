@@ -0,0 +1,38 @@
+import difflib
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat_app.schema import generate_schema, read_schema_file
+
+
+class Command(BaseCommand):
+    help = 'Writes the OpenAPI schema to OPENAPI_SCHEMA_FILE, or checks that the file matches the code'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Fail if the schema file differs from the generated schema instead of writing it')
+
+    def handle(self, *args, **options):
+        path = settings.OPENAPI_SCHEMA_FILE
+        generated = generate_schema()
+        current = read_schema_file()
+
+        if options['check']:
+            if current is None:
+                raise CommandError(f'{path} does not exist; run openapi_schema to create it')
+            if current != generated:
+                diff = difflib.unified_diff(
+                    current.decode().splitlines(), generated.decode().splitlines(),
+                    'committed', 'generated', lineterm='', n=1,
+                )
+                self.stdout.write('\n'.join(list(diff)[:60]))
+                raise CommandError(f'{path} is out of date; run openapi_schema and commit the result')
+            self.stdout.write(self.style.SUCCESS(f'{path} is up to date'))
+            return
+
+        if current == generated:
+            self.stdout.write(f'{path} is already up to date')
+            return
+        path.write_bytes(generated)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {path} ({len(generated)} bytes)'))
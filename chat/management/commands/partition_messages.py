@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from chat import partitions
+
+
+class Command(BaseCommand):
+    help = 'Partitions the message table by month (PostgreSQL) and creates partitions for the coming months'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true',
+                            help='Convert the existing message table into a partitioned table first')
+        parser.add_argument('--months-ahead', type=int, default=settings.MESSAGE_PARTITION_MONTHS_AHEAD,
+                            help='Number of future months to create partitions for')
+
+    def handle(self, *args, **options):
+        if not partitions.is_supported():
+            raise CommandError('Message partitioning requires PostgreSQL')
+
+        today = timezone.now().date()
+        months_ahead = options['months_ahead']
+
+        if not partitions.is_partitioned():
+            if not options['convert']:
+                raise CommandError('The message table is not partitioned yet; run again with --convert')
+            self.stdout.write(self.style.WARNING('Converting the message table, it is locked until this finishes...'))
+            count = partitions.convert_to_partitioned(today, months_ahead)
+            self.stdout.write(self.style.SUCCESS(f'Message table partitioned into {count} monthly partitions'))
+
+        names = partitions.create_future_partitions(today, months_ahead)
+        self.stdout.write(self.style.SUCCESS(f'Partitions ready up to {names[-1]}'))
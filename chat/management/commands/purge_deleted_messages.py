@@ -0,0 +1,77 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from chat import rollups
+from chat.models import Message
+
+
+class Command(BaseCommand):
+    help = 'Hard-deletes (or tombstones) messages that were soft-deleted longer than the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, default=settings.MESSAGE_PURGE_RETENTION_DAYS,
+                            help='Only purge messages soft-deleted more than this many days ago')
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of rows per transaction')
+        parser.add_argument('--sleep', type=float, default=0.1, help='Seconds to pause between batches')
+        parser.add_argument('--max-runtime', type=float, default=None,
+                            help='Stop starting new batches after this many seconds')
+        parser.add_argument('--tombstone', action='store_true',
+                            help='Blank the content and drop the attachment instead of deleting the rows')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['retention_days'])
+        batch_size = options['batch_size']
+        max_runtime = options['max_runtime']
+        tombstone = options['tombstone']
+
+        candidates = Message.objects.filter(deleted_at__lt=cutoff)
+        if tombstone:
+            candidates = candidates.exclude(content='', attachment__isnull=True)
+
+        start = time.monotonic()
+        last_id = 0
+        total = 0
+        while True:
+            if max_runtime is not None and time.monotonic() - start >= max_runtime:
+                self.stdout.write(self.style.WARNING('Runtime budget exhausted, stopping early'))
+                break
+
+            # Keyset pagination on the primary key: each batch is a short index
+            # range scan and a short transaction, however large the table is.
+            ids = list(
+                candidates.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+
+            with transaction.atomic():
+                batch = Message.objects.filter(id__in=ids)
+                # One grouped rollup update per batch instead of one per message
+                rollups.subtract(batch, messages=not tombstone)
+                if tombstone:
+                    count = batch.update(content='', attachment=None, attachment_name='')
+                else:
+                    with rollups.suspended():
+                        count, _ = batch.delete()
+
+            total += count
+            last_id = ids[-1]
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Processed batch up to id {last_id} ({count} rows)')
+
+            if len(ids) < batch_size:
+                break
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        elapsed = time.monotonic() - start
+        rate = total / elapsed if elapsed else 0
+        action = 'Tombstoned' if tombstone else 'Purged'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {total} messages in {elapsed:.2f} s ({rate:.0f} rows/sec)'
+        ))
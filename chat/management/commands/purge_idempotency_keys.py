@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from chat import idempotency
+
+
+class Command(BaseCommand):
+    help = 'Deletes client idempotency keys older than IDEMPOTENCY_KEY_TTL'
+
+    def handle(self, *args, **options):
+        deleted = idempotency.purge_expired()
+        self.stdout.write(self.style.SUCCESS(f'Purged {deleted} idempotency keys'))
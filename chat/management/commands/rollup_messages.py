@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from chat import rollups
+
+
+class Command(BaseCommand):
+    help = ('Recomputes the hourly message rollups of a time range from the stored messages; '
+            'run periodically to catch up with writes that bypassed them')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', default=None,
+                            help='Start of the range, ISO 8601 date or datetime (default: --hours before --until)')
+        parser.add_argument('--until', default=None,
+                            help='End of the range (default: the start of the current hour)')
+        parser.add_argument('--hours', type=int, default=24, help='Length of the range when --since is not given')
+
+    def handle(self, *args, **options):
+        try:
+            until = rollups.parse_time(options['until']) if options['until'] else rollups.hour_of(timezone.now())
+            since = rollups.parse_time(options['since']) if options['since'] else until - timedelta(hours=options['hours'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        if since >= until:
+            raise CommandError('--since must be before --until')
+
+        start, end = rollups.hour_range(since, until)
+        count = rollups.rebuild(start, end)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {count} rollups from {start:%Y-%m-%d %H:00} to {end:%Y-%m-%d %H:00} UTC'
+        ))
@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat import rollups
+
+
+class Command(BaseCommand):
+    help = 'Checks the hourly message rollups of a time range against the stored messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', required=True, help='Start of the range, ISO 8601 date or datetime')
+        parser.add_argument('--until', required=True, help='End of the range, ISO 8601 date or datetime')
+        parser.add_argument('--repair', action='store_true', help='Rebuild the hours whose rollups differ')
+        parser.add_argument('--limit', type=int, default=20, help='Number of differences listed')
+
+    def handle(self, *args, **options):
+        try:
+            since, until = rollups.parse_time(options['since']), rollups.parse_time(options['until'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        if since >= until:
+            raise CommandError('--since must be before --until')
+
+        mismatches = rollups.verify(since, until)
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('Rollups match the messages'))
+            return
+
+        for (hour, user_id, peer_id, room_id), stored, actual in mismatches[:options['limit']]:
+            conversation = f'room {room_id}' if room_id else f'user {peer_id}'
+            self.stdout.write(
+                f'{hour:%Y-%m-%d %H:00}  user {user_id} -> {conversation}: '
+                f'rollup {stored[0]} messages / {stored[1]} bytes, actual {actual[0]} / {actual[1]}'
+            )
+        if len(mismatches) > options['limit']:
+            self.stdout.write(f'... and {len(mismatches) - options["limit"]} more')
+
+        if not options['repair']:
+            raise CommandError(f'{len(mismatches)} rollups differ from the messages')
+
+        hours = sorted({key[0] for key, _, _ in mismatches})
+        for hour in hours:
+            rollups.rebuild(hour, hour + timedelta(hours=1))
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(hours)} hours'))
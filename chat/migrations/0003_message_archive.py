@@ -0,0 +1,57 @@
+# Generated by Django 5.1.2 on 2026-10-19 07:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0002_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MessageArchive",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "month",
+                    models.DateField(
+                        help_text="First day of the archived month", unique=True
+                    ),
+                ),
+                (
+                    "path",
+                    models.CharField(
+                        help_text="Location of the compressed NDJSON file",
+                        max_length=500,
+                    ),
+                ),
+                (
+                    "row_count",
+                    models.PositiveIntegerField(
+                        default=0, help_text="Number of archived messages"
+                    ),
+                ),
+                (
+                    "archived_at",
+                    models.DateTimeField(
+                        auto_now_add=True, help_text="When the month was archived"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Message archive",
+                "verbose_name_plural": "Message archives",
+                "ordering": ["-month"],
+            },
+        ),
+    ]
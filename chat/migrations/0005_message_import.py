@@ -0,0 +1,70 @@
+# Generated by Django 5.1.2 on 2026-10-19 07:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0004_message_deleted_at_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MessageImport",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "source",
+                    models.CharField(
+                        help_text="Name identifying the import",
+                        max_length=500,
+                        unique=True,
+                    ),
+                ),
+                (
+                    "rows_read",
+                    models.PositiveBigIntegerField(
+                        default=0, help_text="Input rows processed so far"
+                    ),
+                ),
+                (
+                    "rows_imported",
+                    models.PositiveBigIntegerField(
+                        default=0, help_text="Messages created so far"
+                    ),
+                ),
+                (
+                    "rows_skipped",
+                    models.PositiveBigIntegerField(
+                        default=0, help_text="Rows skipped so far"
+                    ),
+                ),
+                (
+                    "started_at",
+                    models.DateTimeField(
+                        auto_now_add=True, help_text="When the import was first started"
+                    ),
+                ),
+                (
+                    "finished_at",
+                    models.DateTimeField(
+                        blank=True, help_text="When the import completed", null=True
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Message import",
+                "verbose_name_plural": "Message imports",
+                "ordering": ["-started_at"],
+            },
+        ),
+    ]
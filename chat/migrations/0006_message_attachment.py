@@ -0,0 +1,80 @@
+# Generated by Django 5.1.2 on 2026-10-19 07:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0005_message_import"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Attachment",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "sha256",
+                    models.CharField(
+                        help_text="Hex SHA-256 digest of the content",
+                        max_length=64,
+                        unique=True,
+                    ),
+                ),
+                (
+                    "size",
+                    models.PositiveBigIntegerField(
+                        help_text="Size of the file in bytes"
+                    ),
+                ),
+                (
+                    "content_type",
+                    models.CharField(help_text="MIME type of the file", max_length=100),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True,
+                        help_text="When the content was first uploaded",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Attachment",
+                "verbose_name_plural": "Attachments",
+            },
+        ),
+        migrations.AddField(
+            model_name="message",
+            name="attachment_name",
+            field=models.CharField(
+                blank=True,
+                db_default="",
+                default="",
+                help_text="File name of the attachment as uploaded",
+                max_length=255,
+            ),
+        ),
+        migrations.AddField(
+            model_name="message",
+            name="attachment",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="File attached to this message",
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="messages",
+                to="chat.attachment",
+            ),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.1.2 on 2026-10-19 07:55
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+from django.utils import timezone
+
+
+def mark_recent_messages_delivered(apps, schema_editor):
+    """
+    Treat messages sent before delivery tracking existed as delivered.
+
+    Only messages young enough to be replayed need updating, which keeps the
+    update small on a large table.
+    """
+    Message = apps.get_model("chat", "Message")
+    cutoff = timezone.now() - timedelta(seconds=settings.PENDING_DELIVERY_TTL)
+    Message.objects.filter(timestamp__gte=cutoff, delivered_at__isnull=True).update(
+        delivered_at=F("timestamp")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0007_rooms"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="delivered_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="When a socket of the receiver acknowledged the message",
+                null=True,
+            ),
+        ),
+        migrations.RunPython(mark_recent_messages_delivered, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                condition=models.Q(
+                    ("deleted_at__isnull", True), ("delivered_at__isnull", True)
+                ),
+                fields=["receiver", "timestamp"],
+                name="chat_message_pending_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 5.1.2 on 2026-10-19 08:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0009_client_request"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MessageRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("hour", models.DateTimeField(help_text="Start of the hour, in UTC")),
+                (
+                    "messages",
+                    models.PositiveIntegerField(
+                        default=0, help_text="Number of messages"
+                    ),
+                ),
+                (
+                    "bytes",
+                    models.PositiveBigIntegerField(
+                        default=0, help_text="Total size of the content in bytes"
+                    ),
+                ),
+                (
+                    "peer",
+                    models.ForeignKey(
+                        blank=True,
+                        help_text="The receiver of direct messages",
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "room",
+                    models.ForeignKey(
+                        blank=True,
+                        help_text="The room of room messages",
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="chat.room",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        help_text="The user who sent the messages",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="message_rollups",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Message rollup",
+                "verbose_name_plural": "Message rollups",
+                "ordering": ["-hour"],
+                "indexes": [
+                    models.Index(
+                        fields=["user", "hour"], name="chat_messag_user_id_200410_idx"
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        condition=models.Q(("room__isnull", True)),
+                        fields=("hour", "user", "peer"),
+                        name="chat_rollup_direct_unique",
+                    ),
+                    models.UniqueConstraint(
+                        condition=models.Q(("peer__isnull", True)),
+                        fields=("hour", "user", "room"),
+                        name="chat_rollup_room_unique",
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -16,6 +16,9 @@ class Message(models.Model):
         receiver (ForeignKey): The user who received the message.
         content (TextField): The text content of the message.
         timestamp (DateTimeField): The date and time when the message was sent.
+        delivered_at (DateTimeField): When the receiver acknowledged it, or None while pending.
+        attachment (ForeignKey): The attached file, if any.
+        attachment_name (CharField): The file name the attachment was uploaded with.
     """
     sender = models.ForeignKey(
         User,
@@ -35,6 +38,23 @@ class Message(models.Model):
         help_text="The date and time when the message was sent"
     )
     deleted_at = models.DateTimeField(null=True, blank=True, help_text="The date and time when the message was deleted")
+    delivered_at = models.DateTimeField(
+        null=True, blank=True,
+        help_text="When a socket of the receiver acknowledged the message"
+    )
+    attachment = models.ForeignKey(
+        'Attachment',
+        related_name="messages",
+        null=True,
+        blank=True,
+        on_delete=models.PROTECT,
+        help_text="File attached to this message"
+    )
+    # db_default keeps rows written outside the ORM (COPY imports) valid
+    attachment_name = models.CharField(
+        max_length=255, blank=True, default='', db_default='',
+        help_text="File name of the attachment as uploaded"
+    )
 
     class Meta:
         """
@@ -46,6 +66,16 @@ class Message(models.Model):
         indexes = [
             models.Index(fields=['sender', 'receiver']),  # Index for faster queries
             models.Index(fields=['timestamp']),  # Index for timestamp-based sorting
+            models.Index(  # Small partial index used by the purge job
+                fields=['deleted_at'],
+                name='chat_message_deleted_idx',
+                condition=models.Q(deleted_at__isnull=False),
+            ),
+            models.Index(  # Pending deliveries replayed when the receiver connects
+                fields=['receiver', 'timestamp'],
+                name='chat_message_pending_idx',
+                condition=models.Q(delivered_at__isnull=True, deleted_at__isnull=True),
+            ),
         ]
 
     def __str__(self):
@@ -56,3 +86,280 @@ class Message(models.Model):
             str: A string in the format "sender -> receiver: content_preview"
         """
         return f"{self.sender} -> {self.receiver}: {self.content[:20]}"
+
+
+class ClientRequest(models.Model):
+    """
+    Idempotency key of a message write made by a client.
+
+    Clients attach a unique key (``client_id``) to every send, edit or
+    delete. The key is stored together with the resulting message, in the
+    same transaction as the write (see ``chat.idempotency``), so a retried
+    request is answered from this row instead of writing again.
+
+    The unique constraint lives here rather than on ``Message``: once
+    ``chat_message`` is partitioned every unique constraint on it must
+    include ``timestamp``, which a retry does not share with the original.
+    For the same reason ``message`` has no foreign key constraint in the
+    database.
+
+    Attributes:
+        user (ForeignKey): The user who made the request.
+        key (CharField): The key chosen by the client.
+        message (ForeignKey): The message created or changed by the request.
+        created_at (DateTimeField): When the request was first handled.
+    """
+    user = models.ForeignKey(User, related_name="client_requests", on_delete=models.CASCADE)
+    key = models.CharField(max_length=64, help_text="Idempotency key chosen by the client")
+    message = models.ForeignKey(
+        Message,
+        related_name="+",
+        null=True,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        help_text="The message created or changed by the request"
+    )
+    created_at = models.DateTimeField(auto_now_add=True, help_text="When the request was first handled")
+
+    class Meta:
+        verbose_name = "Client request"
+        verbose_name_plural = "Client requests"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='chat_client_request_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at']),  # Used by purge_idempotency_keys
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.key}"
+
+
+class Attachment(models.Model):
+    """
+    A file attached to one or more messages.
+
+    Files are stored once per content (see ``chat.attachments``): uploading
+    the same bytes again reuses the existing row and file, so the SHA-256 of
+    the content is the identity of an attachment. The name a file was
+    uploaded with belongs to each message.
+
+    Attributes:
+        sha256 (CharField): Hex SHA-256 digest of the content.
+        size (PositiveBigIntegerField): Size of the file in bytes.
+        content_type (CharField): MIME type declared by the first upload.
+        created_at (DateTimeField): When the content was first uploaded.
+    """
+    sha256 = models.CharField(max_length=64, unique=True, help_text="Hex SHA-256 digest of the content")
+    size = models.PositiveBigIntegerField(help_text="Size of the file in bytes")
+    content_type = models.CharField(max_length=100, help_text="MIME type of the file")
+    created_at = models.DateTimeField(auto_now_add=True, help_text="When the content was first uploaded")
+
+    class Meta:
+        verbose_name = "Attachment"
+        verbose_name_plural = "Attachments"
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.size} bytes, {self.content_type})"
+
+
+class Room(models.Model):
+    """
+    A group conversation.
+
+    Members are linked through ``RoomMembership``. Messages posted to a room
+    are stored once as ``RoomMessage`` rows, whatever the number of members,
+    and delivered with a single ``group_send`` (see ``chat.rooms``).
+
+    Attributes:
+        name (CharField): Display name of the room.
+        created_by (ForeignKey): The user who created the room.
+        created_at (DateTimeField): When the room was created.
+        members (ManyToManyField): Users who belong to the room.
+    """
+    name = models.CharField(max_length=100, help_text="Display name of the room")
+    created_by = models.ForeignKey(
+        User,
+        related_name="created_rooms",
+        on_delete=models.CASCADE,
+        help_text="The user who created this room"
+    )
+    created_at = models.DateTimeField(auto_now_add=True, help_text="When the room was created")
+    members = models.ManyToManyField(User, through='RoomMembership', related_name="rooms")
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "Room"
+        verbose_name_plural = "Rooms"
+
+    def __str__(self):
+        return self.name
+
+
+class RoomMembership(models.Model):
+    """
+    Membership of a user in a room.
+
+    Attributes:
+        room (ForeignKey): The room.
+        user (ForeignKey): The member.
+        joined_at (DateTimeField): When the user joined the room.
+    """
+    room = models.ForeignKey(Room, related_name="memberships", on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name="room_memberships", on_delete=models.CASCADE)
+    joined_at = models.DateTimeField(auto_now_add=True, help_text="When the user joined the room")
+
+    class Meta:
+        verbose_name = "Room membership"
+        verbose_name_plural = "Room memberships"
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'user'], name='chat_room_membership_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} in {self.room}"
+
+
+class RoomMessage(models.Model):
+    """
+    A message posted to a room, stored once for all members.
+
+    Attributes:
+        room (ForeignKey): The room the message was posted to.
+        sender (ForeignKey): The member who posted it.
+        content (TextField): The text content of the message.
+        timestamp (DateTimeField): When the message was posted.
+        deleted_at (DateTimeField): When the message was deleted, or None.
+    """
+    room = models.ForeignKey(Room, related_name="messages", on_delete=models.CASCADE)
+    sender = models.ForeignKey(User, related_name="sent_room_messages", on_delete=models.CASCADE)
+    content = models.TextField(help_text="The content of the message")
+    timestamp = models.DateTimeField(auto_now_add=True, help_text="When the message was posted")
+    deleted_at = models.DateTimeField(null=True, blank=True, help_text="When the message was deleted")
+
+    class Meta:
+        ordering = ['-timestamp']
+        verbose_name = "Room message"
+        verbose_name_plural = "Room messages"
+        indexes = [
+            models.Index(fields=['room', 'timestamp']),  # History of one room
+        ]
+
+    def __str__(self):
+        return f"{self.sender} in {self.room}: {self.content[:20]}"
+
+
+class MessageArchive(models.Model):
+    """
+    A calendar month of messages moved out of the Message table.
+
+    Rows of an archived month live in a gzip-compressed NDJSON file (see
+    ``chat.archive``) instead of the database. The archive is created by the
+    ``archive_messages`` management command.
+
+    Attributes:
+        month (DateField): First day of the archived month.
+        path (CharField): Location of the archive file.
+        row_count (PositiveIntegerField): Number of messages in the file.
+        archived_at (DateTimeField): When the month was archived.
+    """
+    month = models.DateField(unique=True, help_text="First day of the archived month")
+    path = models.CharField(max_length=500, help_text="Location of the compressed NDJSON file")
+    row_count = models.PositiveIntegerField(default=0, help_text="Number of archived messages")
+    archived_at = models.DateTimeField(auto_now_add=True, help_text="When the month was archived")
+
+    class Meta:
+        ordering = ['-month']
+        verbose_name = "Message archive"
+        verbose_name_plural = "Message archives"
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} ({self.row_count} messages)"
+
+
+class MessageImport(models.Model):
+    """
+    Progress of one bulk import of historical messages.
+
+    The ``import_messages`` management command commits the position reached
+    in the input file together with every loaded chunk, so an interrupted
+    import resumes exactly where it stopped.
+
+    Attributes:
+        source (CharField): Name identifying the import, by default the input file path.
+        rows_read (PositiveBigIntegerField): Input rows processed so far, loaded or skipped.
+        rows_imported (PositiveBigIntegerField): Messages created so far.
+        rows_skipped (PositiveBigIntegerField): Rows skipped because of unknown users or invalid data.
+        started_at (DateTimeField): When the import was first started.
+        finished_at (DateTimeField): When the whole file was loaded, or None while in progress.
+    """
+    source = models.CharField(max_length=500, unique=True, help_text="Name identifying the import")
+    rows_read = models.PositiveBigIntegerField(default=0, help_text="Input rows processed so far")
+    rows_imported = models.PositiveBigIntegerField(default=0, help_text="Messages created so far")
+    rows_skipped = models.PositiveBigIntegerField(default=0, help_text="Rows skipped so far")
+    started_at = models.DateTimeField(auto_now_add=True, help_text="When the import was first started")
+    finished_at = models.DateTimeField(null=True, blank=True, help_text="When the import completed")
+
+    class Meta:
+        ordering = ['-started_at']
+        verbose_name = "Message import"
+        verbose_name_plural = "Message imports"
+
+    def __str__(self):
+        return f"{self.source} ({self.rows_imported} messages)"
+
+
+class MessageRollup(models.Model):
+    """
+    Number and size of the messages a user sent to one conversation in one hour.
+
+    A conversation is either a peer (direct messages) or a room; the other
+    field is None. Rows are kept equal to grouping the stored messages by
+    hour, sender and conversation (see ``chat.rollups``), so reports read
+    these rows instead of scanning the message tables.
+
+    Attributes:
+        hour (DateTimeField): Start of the hour, in UTC.
+        user (ForeignKey): The user who sent the messages.
+        peer (ForeignKey): The receiver of direct messages, or None.
+        room (ForeignKey): The room of room messages, or None.
+        messages (PositiveIntegerField): Number of messages.
+        bytes (PositiveBigIntegerField): Total size of their content, UTF-8 encoded.
+    """
+    hour = models.DateTimeField(help_text="Start of the hour, in UTC")
+    user = models.ForeignKey(
+        User, related_name="message_rollups", on_delete=models.CASCADE,
+        help_text="The user who sent the messages"
+    )
+    peer = models.ForeignKey(
+        User, related_name="+", null=True, blank=True, on_delete=models.CASCADE,
+        help_text="The receiver of direct messages"
+    )
+    room = models.ForeignKey(
+        Room, related_name="+", null=True, blank=True, on_delete=models.CASCADE,
+        help_text="The room of room messages"
+    )
+    messages = models.PositiveIntegerField(default=0, help_text="Number of messages")
+    bytes = models.PositiveBigIntegerField(default=0, help_text="Total size of the content in bytes")
+
+    class Meta:
+        ordering = ['-hour']
+        verbose_name = "Message rollup"
+        verbose_name_plural = "Message rollups"
+        constraints = [
+            # NULLs are distinct in unique constraints, hence one per kind of conversation
+            models.UniqueConstraint(
+                fields=['hour', 'user', 'peer'], condition=models.Q(room__isnull=True),
+                name='chat_rollup_direct_unique',
+            ),
+            models.UniqueConstraint(
+                fields=['hour', 'user', 'room'], condition=models.Q(peer__isnull=True),
+                name='chat_rollup_room_unique',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'hour']),  # Reports of one user
+        ]
+
+    def __str__(self):
+        return f"{self.user} -> {self.peer or self.room} at {self.hour:%Y-%m-%d %H:00}: {self.messages}"
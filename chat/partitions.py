@@ -0,0 +1,211 @@
+"""Monthly range partitioning of the Message table on PostgreSQL.
+
+Partitioning is optional. ``python manage.py partition_messages --convert``
+turns ``chat_message`` into a table partitioned by ``timestamp`` with one
+partition per calendar month; running the command again (for example from a
+daily cron job) creates the partitions for the coming months.
+
+Once converted, the primary key of ``chat_message`` is ``(id, timestamp)``
+because PostgreSQL requires the partition key in every unique constraint.
+Django still only sees ``id``.
+"""
+
+from datetime import date
+
+from django.db import connection, transaction
+
+from .archive import add_months, month_start
+
+TABLE = 'chat_message'
+
+
+def partition_name(month):
+    """
+    Return the table name of the partition holding ``month``.
+    """
+    return f'{TABLE}_p{month:%Y_%m}'
+
+
+def is_supported():
+    """
+    Return True if the database can partition the Message table.
+    """
+    return connection.vendor == 'postgresql'
+
+
+def is_partitioned():
+    """
+    Return True if ``chat_message`` is already a partitioned table.
+    """
+    if not is_supported():
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass",
+            [TABLE],
+        )
+        return cursor.fetchone() is not None
+
+
+def existing_partitions():
+    """
+    Return the partitions of ``chat_message`` as a ``{month: table_name}`` dict.
+    """
+    if not is_partitioned():
+        return {}
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s
+            """,
+            [TABLE],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = {}
+    prefix = f'{TABLE}_p'
+    for name in names:
+        if name.startswith(prefix):
+            year, month = name[len(prefix):].split('_')
+            partitions[date(int(year), int(month), 1)] = name
+    return partitions
+
+
+def create_partition(cursor, month):
+    """
+    Create the partition for ``month`` if it does not exist yet.
+    """
+    cursor.execute(
+        f'CREATE TABLE IF NOT EXISTS "{partition_name(month)}" PARTITION OF "{TABLE}" '
+        f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+    )
+
+
+def create_future_partitions(today, months_ahead):
+    """
+    Make sure partitions exist from the current month up to ``months_ahead``.
+
+    Returns:
+        list: Names of the partitions that now cover that range.
+    """
+    current = month_start(today)
+    months = [add_months(current, offset) for offset in range(months_ahead + 1)]
+    with transaction.atomic(), connection.cursor() as cursor:
+        for month in months:
+            create_partition(cursor, month)
+    return [partition_name(month) for month in months]
+
+
+def convert_to_partitioned(today, months_ahead):
+    """
+    Rebuild ``chat_message`` as a monthly range-partitioned table.
+
+    The existing rows are copied into partitions covering every month from the
+    oldest message to ``months_ahead`` months from now. The table is locked for
+    the duration of the copy, so run this during a maintenance window.
+
+    Returns:
+        int: Number of partitions created.
+    """
+    old_table = f'{TABLE}_unpartitioned'
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE "{TABLE}" IN ACCESS EXCLUSIVE MODE')
+        cursor.execute(f'SELECT MIN("timestamp") FROM "{TABLE}"')
+        oldest = cursor.fetchone()[0] or today
+
+        # Index names are reused on the new table, so they have to go first.
+        # Foreign keys are dropped with the old table.
+        indexes = index_definitions(cursor)
+        foreign_keys = foreign_key_definitions(cursor)
+        for name in indexes:
+            cursor.execute(f'DROP INDEX "{name}"')
+
+        cursor.execute(f'ALTER TABLE "{TABLE}" RENAME TO "{old_table}"')
+        cursor.execute(
+            f'CREATE TABLE "{TABLE}" (LIKE "{old_table}" INCLUDING DEFAULTS INCLUDING IDENTITY '
+            f'INCLUDING STORAGE INCLUDING COMMENTS) PARTITION BY RANGE ("timestamp")'
+        )
+        cursor.execute(f'ALTER TABLE "{TABLE}" ADD PRIMARY KEY ("id", "timestamp")')
+
+        month = month_start(oldest)
+        last = add_months(month_start(today), months_ahead)
+        count = 0
+        while month <= last:
+            create_partition(cursor, month)
+            month = add_months(month, 1)
+            count += 1
+
+        cursor.execute(f'INSERT INTO "{TABLE}" SELECT * FROM "{old_table}"')
+
+        # A serial column's sequence belongs to the old table; move it over
+        # before the old table is dropped. Identity columns got a new sequence
+        # from LIKE ... INCLUDING IDENTITY, which has to continue the ids.
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [old_table])
+        sequence = cursor.fetchone()[0]
+        cursor.execute(
+            "SELECT attidentity FROM pg_attribute WHERE attrelid = %s::regclass AND attname = 'id'",
+            [TABLE],
+        )
+        if not cursor.fetchone()[0] and sequence:
+            cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY "{TABLE}"."id"')
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE(MAX(\"id\"), 0) + 1, false) FROM \"{TABLE}\"",
+            [TABLE],
+        )
+
+        cursor.execute(f'DROP TABLE "{old_table}"')
+
+        for definition in indexes.values():
+            cursor.execute(definition)
+        for name, definition in foreign_keys.items():
+            cursor.execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{name}" {definition}')
+    return count
+
+
+def index_definitions(cursor):
+    """
+    Return the non-unique indexes of ``chat_message`` as ``{name: CREATE INDEX statement}``.
+
+    The statements come from ``pg_get_indexdef``, so partial indexes keep
+    their ``WHERE`` clause, and always name ``chat_message`` as the table.
+    """
+    cursor.execute(
+        """
+        SELECT i.relname, pg_get_indexdef(ix.indexrelid),
+               quote_ident(n.nspname) || '.' || quote_ident(t.relname)
+        FROM pg_index ix
+        JOIN pg_class t ON t.oid = ix.indrelid
+        JOIN pg_class i ON i.oid = ix.indexrelid
+        JOIN pg_namespace n ON n.oid = t.relnamespace
+        WHERE t.oid = %s::regclass AND NOT ix.indisunique
+        """,
+        [TABLE],
+    )
+    return {
+        name: definition.replace(f' ON {table} ', f' ON "{TABLE}" ', 1)
+        for name, definition, table in cursor.fetchall()
+    }
+
+
+def foreign_key_definitions(cursor):
+    """
+    Return the foreign keys of ``chat_message`` as ``{name: constraint definition}``.
+    """
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+        [TABLE],
+    )
+    return dict(cursor.fetchall())
+
+
+def drop_partition(month):
+    """
+    Detach and drop the partition holding ``month``.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{partition_name(month)}"')
+        cursor.execute(f'DROP TABLE "{partition_name(month)}"')
@@ -0,0 +1,299 @@
+"""Hourly rollups of messaging activity.
+
+``MessageRollup`` holds, per hour, sender and conversation (a peer for direct
+messages, a room for room messages), how many messages were sent and the
+size of their content in bytes, so that reports never ``GROUP BY`` over the
+message tables. The rows are kept equal to that ``GROUP BY`` over the stored
+messages:
+
+- Sending, editing and deleting a message updates its rollup in the same
+  transaction, from ``chat.signals``.
+- Bulk writes that send no signals update the rollups themselves:
+  ``import_messages`` calls ``add_rows`` and ``purge_deleted_messages`` calls
+  ``subtract``.
+- ``rebuild`` recomputes a range of hours from the messages. The
+  ``rollup_messages`` command runs it as a periodic catch-up job, and
+  ``verify_rollups`` compares a range of hours with the messages.
+
+Archiving a month keeps its direct-message rollups: the messages still exist
+in cold storage, so reports keep counting them. Rebuilds and verification
+skip those rollups. Room messages are never archived, so their rollups are
+rebuilt and verified in every month. Hours are in UTC.
+"""
+
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Func, IntegerField, Q, Sum
+from django.db.models.functions import Greatest, TruncHour
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .archive import month_range
+from .models import Message, MessageArchive, MessageRollup, RoomMessage
+
+_suspended = ContextVar('rollups_suspended', default=False)
+
+
+class OctetLength(Func):
+    """
+    Size of a text in bytes, as stored in the database (UTF-8).
+    """
+    function = 'OCTET_LENGTH'
+    output_field = IntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='LENGTH(CAST(%(expressions)s AS BLOB))', **extra_context)
+
+
+def hour_of(value):
+    """
+    Return the start of the UTC hour containing the aware datetime ``value``.
+    """
+    return value.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def parse_time(value):
+    """
+    Parse an ISO 8601 date or datetime; dates and naive datetimes are taken as UTC.
+
+    Raises:
+        ValueError: If ``value`` is neither.
+    """
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'{value!r} is not an ISO 8601 date or datetime')
+        parsed = datetime.combine(day, time())
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=dt_timezone.utc)
+    return parsed
+
+
+def content_size(content):
+    return len(content.encode())
+
+
+@contextmanager
+def suspended():
+    """
+    Leave the rollups alone for the messages written or deleted in the block.
+
+    Used by bulk jobs that account for their changes themselves, or, when
+    archiving, deliberately not at all.
+    """
+    token = _suspended.set(True)
+    try:
+        yield
+    finally:
+        _suspended.reset(token)
+
+
+def is_suspended():
+    return _suspended.get()
+
+
+def _key(message):
+    if isinstance(message, RoomMessage):
+        return hour_of(message.timestamp), message.sender_id, None, message.room_id
+    return hour_of(message.timestamp), message.sender_id, message.receiver_id, None
+
+
+def _apply(key, messages, size):
+    """
+    Add ``messages`` and ``size`` (either may be negative) to the rollup of ``key``.
+
+    Only additions of messages create a missing row. A change that does not
+    find its row is dropped; the next rebuild of the hour corrects it.
+    """
+    hour, user_id, peer_id, room_id = key
+    rows = MessageRollup.objects.filter(hour=hour, user_id=user_id, peer_id=peer_id, room_id=room_id)
+    changes = {
+        'messages': Greatest(F('messages') + messages, 0),
+        'bytes': Greatest(F('bytes') + size, 0),
+    }
+    if rows.update(**changes) or messages <= 0:
+        return
+    try:
+        with transaction.atomic():
+            MessageRollup.objects.create(
+                hour=hour, user_id=user_id, peer_id=peer_id, room_id=room_id,
+                messages=messages, bytes=max(size, 0),
+            )
+    except IntegrityError:
+        # Created by a concurrent write since the update
+        rows.update(**changes)
+
+
+def add_message(message, sign=1):
+    """
+    Count a new ``Message`` or ``RoomMessage`` in its rollup; ``sign=-1`` removes it.
+    """
+    _apply(_key(message), sign, sign * content_size(message.content))
+
+
+def resize_message(message, old_size):
+    """
+    Account for an edit that changed the content of ``message`` from ``old_size`` bytes.
+    """
+    delta = content_size(message.content) - old_size
+    if delta:
+        _apply(_key(message), 0, delta)
+
+
+def add_rows(rows):
+    """
+    Count direct messages written in bulk, given as dicts of their fields.
+
+    Args:
+        rows: Dicts with ``sender_id``, ``receiver_id``, ``content`` and ``timestamp``.
+    """
+    totals = defaultdict(lambda: [0, 0])
+    for row in rows:
+        total = totals[hour_of(row['timestamp']), row['sender_id'], row['receiver_id'], None]
+        total[0] += 1
+        total[1] += content_size(row['content'])
+    for key, (messages, size) in totals.items():
+        _apply(key, messages, size)
+
+
+def _grouped(queryset, conversation):
+    """
+    Return ``{key: (messages, bytes)}`` for the messages of ``queryset``.
+    """
+    rows = (
+        queryset.order_by()
+        .values_list(TruncHour('timestamp', tzinfo=dt_timezone.utc), 'sender_id', conversation)
+        .annotate(count=Count('id'), size=Sum(OctetLength('content')))
+    )
+    totals = {}
+    for hour, sender_id, conversation_id, count, size in rows:
+        if conversation == 'room_id':
+            totals[hour, sender_id, None, conversation_id] = (count, size or 0)
+        else:
+            totals[hour, sender_id, conversation_id, None] = (count, size or 0)
+    return totals
+
+
+def subtract(queryset, messages=True):
+    """
+    Remove the direct messages of ``queryset`` from the rollups before they are deleted.
+
+    Args:
+        messages (bool): False when the messages stay but lose their
+            content, as with ``purge_deleted_messages --tombstone``.
+    """
+    for key, (count, size) in _grouped(queryset, 'receiver_id').items():
+        _apply(key, -count if messages else 0, -size)
+
+
+def archived_ranges():
+    """
+    Return the ``[start, end)`` UTC datetimes of every archived month.
+    """
+    return [month_range(month) for month in MessageArchive.objects.values_list('month', flat=True)]
+
+
+def archived_hours(ranges):
+    """
+    Return a Q matching the direct-message rollups of the hours within ``ranges``.
+    """
+    query = Q(pk__in=[])
+    for start, end in ranges:
+        query |= Q(hour__gte=start, hour__lt=end)
+    return query & Q(room__isnull=True)
+
+
+def is_archived(key, ranges):
+    """
+    Return True if the rollup of ``key`` is a direct-message one within ``ranges``.
+    """
+    hour, _, _, room_id = key
+    return room_id is None and any(start <= hour < end for start, end in ranges)
+
+
+def hour_range(since, until):
+    """
+    Widen ``[since, until)`` to whole hours.
+    """
+    start = hour_of(since)
+    end = hour_of(until)
+    if end < until:
+        end += timedelta(hours=1)
+    return start, end
+
+
+def actual_totals(since, until):
+    """
+    Group the stored messages of ``[since, until)`` (whole hours) like the rollups.
+
+    Returns:
+        dict: ``{(hour, user_id, peer_id, room_id): (messages, bytes)}``.
+    """
+    start, end = hour_range(since, until)
+    totals = _grouped(Message.objects.filter(timestamp__gte=start, timestamp__lt=end), 'receiver_id')
+    totals.update(_grouped(RoomMessage.objects.filter(timestamp__gte=start, timestamp__lt=end), 'room_id'))
+    return totals
+
+
+def stored_totals(since, until):
+    """
+    Return the rollups of ``[since, until)`` (whole hours), except the archived ones.
+
+    Returns:
+        dict: ``{(hour, user_id, peer_id, room_id): (messages, bytes)}``.
+    """
+    start, end = hour_range(since, until)
+    rows = (
+        MessageRollup.objects.filter(hour__gte=start, hour__lt=end).exclude(archived_hours(archived_ranges()))
+        .values_list('hour', 'user_id', 'peer_id', 'room_id', 'messages', 'bytes')
+    )
+    return {(hour, user_id, peer_id, room_id): (count, size) for hour, user_id, peer_id, room_id, count, size in rows}
+
+
+def verify(since, until):
+    """
+    Compare the rollups of ``[since, until)`` with the stored messages.
+
+    Empty rollups count as missing ones. Direct-message rollups of archived
+    months are skipped.
+
+    Returns:
+        list: ``(key, stored, actual)`` for every rollup that differs, each
+        total being ``(messages, bytes)``, sorted by hour.
+    """
+    stored = {key: total for key, total in stored_totals(since, until).items() if total != (0, 0)}
+    ranges = archived_ranges()
+    actual = {key: total for key, total in actual_totals(since, until).items() if not is_archived(key, ranges)}
+    return sorted(
+        ((key, stored.get(key, (0, 0)), actual.get(key, (0, 0)))
+         for key in stored.keys() | actual.keys() if stored.get(key) != actual.get(key)),
+        key=lambda mismatch: (mismatch[0][0], mismatch[0][1]),
+    )
+
+
+def rebuild(since, until):
+    """
+    Recompute the rollups of ``[since, until)`` (whole hours) from the stored messages.
+
+    Messages written while the rebuild runs may be counted twice or not at
+    all, so catch-up jobs should leave out the current hour.
+
+    Returns:
+        int: Number of rollups written.
+    """
+    start, end = hour_range(since, until)
+    with transaction.atomic():
+        ranges = archived_ranges()
+        stale = MessageRollup.objects.filter(hour__gte=start, hour__lt=end)
+        stale.exclude(archived_hours(ranges)).delete()
+        rollups = [
+            MessageRollup(hour=hour, user_id=user_id, peer_id=peer_id, room_id=room_id, messages=count, bytes=size)
+            for (hour, user_id, peer_id, room_id), (count, size) in actual_totals(start, end).items()
+            if not is_archived((hour, user_id, peer_id, room_id), ranges)
+        ]
+        MessageRollup.objects.bulk_create(rollups, batch_size=1000)
+    return len(rollups)
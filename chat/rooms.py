@@ -0,0 +1,145 @@
+"""Group rooms: cached membership and write-once fanout.
+
+A message posted to a room is one ``RoomMessage`` row and one ``group_send``
+to the room's channel-layer group (``room_<id>``), however many members the
+room has. Every socket that should see the room joins that group: the
+``RoomConsumer`` of an open room, and the ``InboxConsumer`` of every member,
+which joins the groups of all the user's rooms when it connects.
+
+Membership changes are published too: ``room.joined`` goes to the new
+member's inbox group so their inbox sockets join the room group, and
+``room.left`` goes to the room group so the sockets of the removed member
+leave it.
+
+The member ids of each room are kept in Django's cache, so consumers can
+authorize a connection without querying the database. ``chat.signals``
+drops the cached set whenever a membership is added or removed.
+"""
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+
+from chat_app.metrics import metrics
+
+from . import inbox
+from .models import RoomMembership
+
+
+def room_group(room_id):
+    """
+    Return the channel-layer group name of ``room_id``.
+    """
+    return f'room_{room_id}'
+
+
+def members_key(room_id):
+    """
+    Return the cache key of the member ids of ``room_id``.
+    """
+    return f'chat:room:members:{room_id}'
+
+
+def member_ids(room_id):
+    """
+    Return the ids of the members of ``room_id``, from the cache when possible.
+
+    Returns:
+        frozenset: User ids; empty if the room does not exist.
+    """
+    key = members_key(room_id)
+    ids = cache.get(key)
+    if ids is not None:
+        metrics.incr('chat.rooms.members.hits')
+        return ids
+
+    metrics.incr('chat.rooms.members.misses')
+    ids = frozenset(RoomMembership.objects.filter(room_id=room_id).values_list('user_id', flat=True))
+    cache.set(key, ids, timeout=settings.ROOM_MEMBERS_CACHE_TTL)
+    return ids
+
+
+def is_member(room_id, user_id):
+    """
+    Return True if ``user_id`` belongs to ``room_id``.
+    """
+    return user_id in member_ids(room_id)
+
+
+def invalidate_members(room_id):
+    """
+    Drop the cached member ids of ``room_id``.
+    """
+    cache.delete(members_key(room_id))
+
+
+def room_ids(user_id):
+    """
+    Return the ids of the rooms ``user_id`` belongs to.
+    """
+    return list(RoomMembership.objects.filter(user_id=user_id).values_list('room_id', flat=True))
+
+
+def message_event(message):
+    """
+    Build the channel-layer event published for a new room message.
+
+    Args:
+        message (RoomMessage): The message; its sender must be loaded.
+
+    Returns:
+        dict: Event handled by ``RoomConsumer.room_message`` and ``InboxConsumer.room_message``.
+    """
+    return {
+        'type': 'room.message',
+        'room': message.room_id,
+        'id': message.id,
+        'sender': message.sender.username,
+        'message': message.content,
+        'timestamp': message.timestamp.isoformat(),
+    }
+
+
+async def publish(message, channel_layer=None):
+    """
+    Deliver a new room message to every connected member with one ``group_send``.
+    """
+    channel_layer = channel_layer or get_channel_layer()
+    await channel_layer.group_send(room_group(message.room_id), message_event(message))
+
+
+def publish_sync(message):
+    """
+    Synchronous version of ``publish`` for views and other sync code.
+    """
+    event = message_event(message)
+    async_to_sync(get_channel_layer().group_send)(room_group(message.room_id), event)
+
+
+def add_member(room, user):
+    """
+    Add ``user`` to ``room`` and let their inbox sockets join the room group.
+
+    Returns:
+        bool: True if the user was added, False if they already were a member.
+    """
+    _, created = RoomMembership.objects.get_or_create(room=room, user=user)
+    if created:
+        event = {'type': 'room.joined', 'room': room.id}
+        async_to_sync(inbox.send_event)(event, [user.id])
+    return created
+
+
+def remove_member(room, user):
+    """
+    Remove ``user`` from ``room`` and disconnect their sockets from the room group.
+
+    Returns:
+        bool: True if the user was removed, False if they were not a member.
+    """
+    deleted, _ = RoomMembership.objects.filter(room=room, user=user).delete()
+    if deleted:
+        event = {'type': 'room.left', 'room': room.id, 'user_id': user.id}
+        async_to_sync(get_channel_layer().group_send)(room_group(room.id), event)
+    return bool(deleted)
@@ -4,4 +4,6 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/chat/(?P<room_name>[^/]+)/$', consumers.ChatConsumer.as_asgi()),
+    re_path(r'ws/inbox/$', consumers.InboxConsumer.as_asgi()),
+    re_path(r'ws/rooms/(?P<room_id>\d+)/$', consumers.RoomConsumer.as_asgi()),
 ]
@@ -1,5 +1,10 @@
+from datetime import timezone as dt_timezone
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.functional import cached_property
 from rest_framework import serializers
-from .models import Message
+from users.models import CustomUser
+from .models import Message, Room, RoomMessage
 
 class MessageSerializer(serializers.ModelSerializer):
     """
@@ -22,8 +27,8 @@ class MessageSerializer(serializers.ModelSerializer):
             read_only_fields: Fields that should not be modified during deserialization.
         """
         model = Message
-        fields = ['id', 'sender', 'receiver', 'content', 'timestamp']
-        read_only_fields = ['sender', 'timestamp']
+        fields = ['id', 'sender', 'receiver', 'content', 'timestamp', 'delivered_at', 'attachment', 'attachment_name']
+        read_only_fields = ['sender', 'timestamp', 'delivered_at', 'attachment', 'attachment_name']
 
     def validate_content(self, value):
         """
@@ -42,4 +47,134 @@ class MessageSerializer(serializers.ModelSerializer):
         """
         if not value.strip():
             raise serializers.ValidationError("Message content cannot be empty")
-        return value
\ No newline at end of file
+        return value
+
+
+class RoomSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the Room model.
+
+    ``members`` lists the ids of the members. When creating a room it holds
+    the users to add besides the creator, who is always a member.
+    """
+    members = serializers.PrimaryKeyRelatedField(many=True, queryset=CustomUser.objects.all(), required=False)
+
+    class Meta:
+        model = Room
+        fields = ['id', 'name', 'created_by', 'created_at', 'members']
+        read_only_fields = ['created_by', 'created_at']
+
+
+class RoomMessageSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the RoomMessage model.
+    """
+
+    class Meta:
+        model = RoomMessage
+        fields = ['id', 'room', 'sender', 'content', 'timestamp']
+        read_only_fields = ['room', 'sender', 'timestamp']
+
+    def validate_content(self, value):
+        """
+        Reject empty or whitespace-only content, as ``MessageSerializer`` does.
+        """
+        if not value.strip():
+            raise serializers.ValidationError("Message content cannot be empty")
+        return value
+
+
+class MessageRollupSerializer(serializers.Serializer):
+    """
+    Totals of one period, sender and conversation, summed from ``MessageRollup`` rows.
+    """
+    period = serializers.DateTimeField(default_timezone=dt_timezone.utc, help_text="Start of the hour or day, in UTC")
+    user = serializers.IntegerField(help_text="The user who sent the messages")
+    peer = serializers.IntegerField(allow_null=True, help_text="The receiver of direct messages")
+    room = serializers.IntegerField(allow_null=True, help_text="The room of room messages")
+    messages = serializers.IntegerField(source='message_count', help_text="Number of messages")
+    bytes = serializers.IntegerField(source='byte_count', help_text="Total size of the content in bytes")
+
+
+class CompiledReadSerializer:
+    """
+    Fast read-only serialization of ``values_list()`` rows.
+
+    Building model instances and running the DRF field machinery for every
+    row dominates the cost of a message listing. This class inspects the
+    fields of a ``ModelSerializer`` once, then turns plain database rows into
+    the same dicts the serializer would produce, so that the rendered JSON is
+    identical:
+
+    - primary key related fields read the ``<name>_id`` column directly,
+    - char and integer fields pass database values through unchanged,
+    - every other field keeps its own ``to_representation``.
+
+    Only read fields mapping to a single model column are supported.
+
+    Example:
+        rows = message_rows.values(queryset)[:100]
+        data = message_rows.serialize(rows)
+    """
+
+    # Fields whose to_representation is the identity for values from the database
+    passthrough_fields = (serializers.CharField, serializers.IntegerField)
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+
+    @cached_property
+    def compiled(self):
+        """
+        Return ``(field_names, columns, converters)`` for the serializer.
+
+        Raises:
+            ImproperlyConfigured: If a field cannot be read from a single column.
+        """
+        serializer = self.serializer_class()
+        model = serializer.Meta.model
+        names, columns, converters = [], [], []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if '.' in field.source or field.source == '*':
+                raise ImproperlyConfigured(f'{self.serializer_class.__name__}.{name} does not map to a column')
+
+            model_field = model._meta.get_field(field.source)
+            if isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+                converter = None
+            elif type(field) in self.passthrough_fields:
+                converter = None
+            else:
+                converter = field.to_representation
+
+            names.append(name)
+            columns.append(model_field.attname)
+            converters.append(converter)
+        return tuple(names), tuple(columns), tuple(converters)
+
+    def values(self, queryset):
+        """
+        Return ``queryset`` as tuples of the columns needed by the serializer.
+        """
+        return queryset.values_list(*self.compiled[1])
+
+    def serialize(self, rows):
+        """
+        Convert rows from ``values()`` into a list of serialized dicts.
+        """
+        names, _, converters = self.compiled
+        # Pairs of (position, converter) for the columns that need converting
+        convert = [(index, converter) for index, converter in enumerate(converters) if converter is not None]
+        data = []
+        for row in rows:
+            if convert:
+                row = list(row)
+                for index, converter in convert:
+                    if row[index] is not None:
+                        row[index] = converter(row[index])
+            data.append(dict(zip(names, row)))
+        return data
+
+
+message_rows = CompiledReadSerializer(MessageSerializer)
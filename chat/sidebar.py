@@ -0,0 +1,239 @@
+"""Per-user cache of the chat sidebar.
+
+The sidebar of ``chat_room`` lists every other user with the last message
+exchanged with them, newest conversation first. Building it costs one query
+per user, so the result is kept in Django's cache framework per user and
+only rebuilt on a miss.
+
+``chat.signals`` keeps the cached lists current: a new message is patched
+into the sidebars of both participants, an edit of the last message updates
+its content, and a deletion drops both sidebars so that the next view rebuilds
+them. Adding, deleting or renaming a user changes every sidebar, so it bumps a
+shared version that is part of every key. The handlers run once the writing
+transaction commits, so a rolled-back message never reaches the cache.
+
+Patches and rebuilds of one sidebar write under a short lock, and a writer
+that finds it taken drops the sidebar rather than risk losing a change. Every
+patch and invalidation also bumps a generation counter; a rebuild only caches
+its list if the generation did not move while it read the database.
+
+Hits, misses and rebuild times are recorded in ``chat_app.metrics``.
+"""
+
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from chat_app.db_router import primary_reads
+from chat_app.metrics import metrics
+from users.models import CustomUser
+
+from .models import Message
+
+VERSION_KEY = 'chat:sidebar:version'
+
+# Seconds a patch of a cached sidebar may hold its lock
+LOCK_TIMEOUT = 5
+
+
+def sidebar_key(user_id):
+    """
+    Return the cache key of the sidebar of ``user_id``.
+    """
+    version = cache.get_or_set(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+    return f'chat:sidebar:{version}:{user_id}'
+
+
+def detached_message(message):
+    """
+    Return a copy of ``message`` without its cached related objects.
+    """
+    return Message(**{field.attname: getattr(message, field.attname) for field in Message._meta.concrete_fields})
+
+
+def sort_sidebar(entries):
+    """
+    Sort sidebar entries by the timestamp of their last message, newest first.
+    """
+    entries.sort(key=lambda entry: entry['timestamp'], reverse=True)
+    return entries
+
+
+def build_sidebar(user):
+    """
+    Build the sidebar of ``user`` from the database.
+
+    Returns:
+        list: Dicts with ``user``, ``last_message`` (or None) and ``timestamp``.
+    """
+    user_last_messages = []
+
+    # Use a minimum datetime for users with no messages
+    min_datetime = timezone.now().replace(year=1, month=1, day=1)
+
+    # For each user, find the most recent non-soft-deleted message between them and the current user
+    for other in CustomUser.objects.exclude(id=user.id):
+        last_message = Message.objects.filter(
+            (Q(sender=user) & Q(receiver=other)) |
+            (Q(receiver=user) & Q(sender=other)),
+            deleted_at__isnull=True  # Filter out soft-deleted messages
+        ).order_by('-timestamp').first()
+
+        user_last_messages.append({
+            'user': other,
+            'last_message': last_message,
+            'timestamp': last_message.timestamp if last_message else min_datetime
+        })
+
+    return sort_sidebar(user_last_messages)
+
+
+def get_sidebar(user):
+    """
+    Return the sidebar of ``user``, from the cache when possible.
+
+    A miss rebuilds the sidebar from the primary database, so that a lagging
+    replica never ends up in the cache.
+    """
+    key = sidebar_key(user.id)
+    entries = cache.get(key)
+    if entries is not None:
+        metrics.incr('chat.sidebar.hits')
+        return entries
+
+    metrics.incr('chat.sidebar.misses')
+    generation = cache.get(f'{key}:generation')
+    with metrics.timer('chat.sidebar.rebuild'), primary_reads():
+        entries = build_sidebar(user)
+    # A message written during the rebuild may be missing from it
+    with _write_lock(key) as locked:
+        if locked and cache.get(f'{key}:generation') == generation:
+            cache.set(key, entries, timeout=settings.CHAT_SIDEBAR_CACHE_TTL)
+    return entries
+
+
+def invalidate_sidebar(user_id):
+    """
+    Drop the cached sidebar of ``user_id``.
+    """
+    key = sidebar_key(user_id)
+    _bump_generation(key)
+    cache.delete(key)
+
+
+def invalidate_all_sidebars():
+    """
+    Drop every cached sidebar by moving to a new key version.
+    """
+    cache.set(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def participants(message):
+    """
+    Return ``(owner_id, partner_id)`` for each sidebar ``message`` appears in.
+    """
+    pairs = {(message.sender_id, message.receiver_id), (message.receiver_id, message.sender_id)}
+    return sorted(pairs)
+
+
+def _bump_generation(key):
+    """
+    Record that the sidebar under ``key`` changed, cached or not.
+    """
+    generation_key = f'{key}:generation'
+    cache.add(generation_key, 0, timeout=settings.CHAT_SIDEBAR_CACHE_TTL)
+    try:
+        cache.incr(generation_key)
+    except ValueError:
+        # Expired since the add
+        cache.set(generation_key, 1, timeout=settings.CHAT_SIDEBAR_CACHE_TTL)
+
+
+@contextmanager
+def _write_lock(key):
+    """
+    Hold the write lock of the sidebar under ``key``; yields False if another writer has it.
+
+    The cache has no compare-and-set. A writer that finds the lock taken
+    cannot write without losing one of the two changes: it drops the
+    sidebar and flags the conflict, and the lock holder drops the list it
+    wrote on seeing the flag.
+    """
+    lock_key, conflict_key = f'{key}:lock', f'{key}:conflict'
+    if not cache.add(lock_key, True, timeout=LOCK_TIMEOUT):
+        metrics.incr('chat.sidebar.conflicts')
+        # The flag goes first: the holder either sees it or wrote before this delete
+        cache.set(conflict_key, True, timeout=LOCK_TIMEOUT)
+        cache.delete(key)
+        yield False
+        return
+    try:
+        yield True
+        if cache.get(conflict_key):
+            cache.delete_many([key, conflict_key])
+    finally:
+        cache.delete(lock_key)
+
+
+def _update_entries(message, update):
+    """
+    Apply ``update(entry)`` to the entry of each participant's cached sidebar.
+
+    ``update`` returns True if it changed the entry. A sidebar without an entry
+    for the partner (for example a user created after it was cached) is
+    dropped instead.
+    """
+    for owner_id, partner_id in participants(message):
+        key = sidebar_key(owner_id)
+        _bump_generation(key)
+        with _write_lock(key) as locked:
+            if locked:
+                _patch_entries(key, partner_id, update)
+
+
+def _patch_entries(key, partner_id, update):
+    entries = cache.get(key)
+    if entries is None:
+        return
+
+    entry = next((entry for entry in entries if entry['user'].id == partner_id), None)
+    if entry is None:
+        cache.delete(key)
+    elif update(entry):
+        cache.set(key, sort_sidebar(entries), timeout=settings.CHAT_SIDEBAR_CACHE_TTL)
+
+
+def record_new_message(message):
+    """
+    Make ``message`` the last message in both participants' cached sidebars.
+    """
+    def update(entry):
+        if entry['last_message'] is not None and entry['last_message'].timestamp > message.timestamp:
+            return False
+        entry['last_message'] = detached_message(message)
+        entry['timestamp'] = message.timestamp
+        return True
+
+    _update_entries(message, update)
+
+
+def record_changed_message(message):
+    """
+    Update both participants' cached sidebars after ``message`` was edited or deleted.
+    """
+    if message.deleted_at is not None:
+        for owner_id, _ in participants(message):
+            invalidate_sidebar(owner_id)
+        return
+
+    def update(entry):
+        if entry['last_message'] is None or entry['last_message'].id != message.id:
+            return False
+        entry['last_message'] = detached_message(message)
+        return True
+
+    _update_entries(message, update)
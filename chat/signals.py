@@ -0,0 +1,108 @@
+"""Signal handlers for the chat app."""
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from chat_app.db_router import mark_write
+from users.models import CustomUser
+
+from . import rollups, rooms, sidebar
+from .models import Message, RoomMembership, RoomMessage
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def pin_sender_to_primary(sender, instance, **kwargs):
+    """
+    Keep the sender's reads on the primary right after they send, edit or delete a message.
+    """
+    mark_write(instance.sender_id)
+
+
+@receiver(post_save, sender=Message)
+def update_sidebars_on_save(sender, instance, created, using, **kwargs):
+    """
+    Patch the cached sidebars of both participants once a sent or edited message is committed.
+    """
+    # A copy, as the message may change again before the transaction commits
+    message = sidebar.detached_message(instance)
+    record = sidebar.record_new_message if created else sidebar.record_changed_message
+    transaction.on_commit(lambda: record(message), using=using)
+
+
+@receiver(post_delete, sender=Message)
+def update_sidebars_on_delete(sender, instance, using, **kwargs):
+    """
+    Drop the cached sidebars of both participants once a message deletion is committed.
+    """
+    def invalidate():
+        for owner_id, _ in sidebar.participants(message):
+            sidebar.invalidate_sidebar(owner_id)
+
+    message = sidebar.detached_message(instance)
+    transaction.on_commit(invalidate, using=using)
+
+
+@receiver(pre_save, sender=Message)
+@receiver(pre_save, sender=RoomMessage)
+def remember_size_before_edit(sender, instance, using, update_fields, **kwargs):
+    """
+    Read the stored size of the content of a message that is about to be saved again.
+    """
+    if instance._state.adding or rollups.is_suspended():
+        return
+    if update_fields is not None and 'content' not in update_fields:
+        return
+    size = (
+        sender.objects.using(using).filter(pk=instance.pk)
+        .values_list(rollups.OctetLength('content'), flat=True).first()
+    )
+    if size is not None:
+        instance._rollup_size = size
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_save, sender=RoomMessage)
+def update_rollups_on_save(sender, instance, created, **kwargs):
+    """
+    Count a new message in its hourly rollup, or the new size of an edited one.
+    """
+    if rollups.is_suspended():
+        return
+    if created:
+        rollups.add_message(instance)
+    elif '_rollup_size' in instance.__dict__:
+        rollups.resize_message(instance, instance.__dict__.pop('_rollup_size'))
+
+
+@receiver(post_delete, sender=Message)
+@receiver(post_delete, sender=RoomMessage)
+def update_rollups_on_delete(sender, instance, **kwargs):
+    """
+    Remove a deleted message from its hourly rollup.
+    """
+    if not rollups.is_suspended():
+        rollups.add_message(instance, sign=-1)
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_sidebars_on_user_change(sender, instance, created=False, update_fields=None, **kwargs):
+    """
+    Drop every cached sidebar when a user is added, removed or renamed.
+
+    Saves limited to other fields, such as ``last_login`` on every login, do
+    not affect the sidebar.
+    """
+    if created or update_fields is None or 'username' in update_fields:
+        sidebar.invalidate_all_sidebars()
+
+
+@receiver(post_save, sender=RoomMembership)
+@receiver(post_delete, sender=RoomMembership)
+def invalidate_room_members(sender, instance, **kwargs):
+    """
+    Drop the cached member ids of a room when someone joins or leaves it.
+    """
+    rooms.invalidate_members(instance.room_id)
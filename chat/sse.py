@@ -0,0 +1,307 @@
+"""Server-Sent Events transport for clients that cannot keep a WebSocket open.
+
+``GET /api/stream/`` is an async view that holds a ``text/event-stream``
+response open under ASGI. The stream gets its own channel-layer channel and
+joins the same groups as ``InboxConsumer``: the user's inbox group, which
+carries every direct message event however it was written, and the groups
+of the user's rooms. Events are forwarded as they arrive, so a client gets
+push delivery without polling ``/api/messages/``.
+
+Every event carries an ``id`` holding a cursor for direct messages and one
+for room messages (``"<message cursor>-<room message cursor>"``). When the
+connection drops, ``EventSource`` reconnects with that value in the
+``Last-Event-ID`` header and the stream first replays, from the database,
+the messages sent and received since then. Writers publish when they
+commit, not in id order, so a cursor is not simply the highest id sent: ids
+sent in the last ``SSE_RESUME_WINDOW`` seconds are listed after the id below
+which everything was sent (``"<floor>.<id>.<id>"``), and a resumed stream
+replays every id above the floor that the list does not hold. A lower id
+published after the client disconnected is therefore not lost. A reconnect
+after a long absence replays the newest ``SSE_REPLAY_MAX`` messages, after a
+``truncated`` event telling the client to load the rest through the API.
+Edits and deletions made while disconnected are not replayed.
+
+Proxies that drop idle connections see a comment line every
+``SSE_KEEPALIVE_INTERVAL`` seconds. Streams are closed after
+``SSE_MAX_DURATION`` seconds, which keeps the room memberships of an open
+stream from going stale; the client reconnects and resumes where it left off.
+"""
+
+import asyncio
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db.models import Q
+
+from chat_app.metrics import metrics
+
+from . import inbox, rooms
+from .models import Message, RoomMessage
+
+# Event names of the room events forwarded to clients, by channel-layer type
+ROOM_EVENTS = {
+    'room.message': 'room_message',
+    'room.joined': 'room_joined',
+    'room.left': 'room_left',
+}
+
+
+def format_event(event, data, event_id=None):
+    """
+    Encode one event in the ``text/event-stream`` format.
+
+    Returns:
+        bytes: The event, ending with the blank line that dispatches it.
+    """
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data)}')
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+class Cursor:
+    """
+    How far a stream has got in one id sequence.
+
+    Every id up to ``floor`` has been sent or does not concern the user;
+    ``sent`` maps the ids sent above it to the time they were sent. An id is
+    folded into ``floor`` ``SSE_RESUME_WINDOW`` seconds after it was sent,
+    so a lower id whose writer has not published yet stays above the floor
+    meanwhile.
+
+    Args:
+        floor (int): The id below which nothing is pending.
+        sent (iterable): Ids above ``floor`` already sent to the client.
+    """
+
+    def __init__(self, floor=0, sent=()):
+        self.floor = floor
+        now = time.monotonic()
+        self.sent = {sent_id: now for sent_id in sent if sent_id > floor}
+
+    @classmethod
+    def parse(cls, value):
+        """
+        Parse the ``"<floor>.<id>.<id>"`` form of a cursor.
+
+        Raises:
+            ValueError: If ``value`` is malformed.
+        """
+        floor, *sent = (int(part) for part in value.split('.'))
+        if floor < 0:
+            raise ValueError(value)
+        return cls(floor, sent)
+
+    def __str__(self):
+        return '.'.join(str(part) for part in (self.floor, *sorted(self.sent)))
+
+    def add(self, sent_id):
+        if sent_id > self.floor:
+            self.sent.setdefault(sent_id, time.monotonic())
+
+    def settle(self):
+        """
+        Fold into ``floor`` the ids sent more than ``SSE_RESUME_WINDOW`` seconds ago.
+        """
+        cutoff = time.monotonic() - settings.SSE_RESUME_WINDOW
+        oldest_first = sorted(self.sent, key=self.sent.get)
+        # Capping the pending ids keeps the event id short on a busy stream
+        overflow = max(len(oldest_first) - settings.SSE_REPLAY_MAX, 0)
+        settled = oldest_first[:overflow] + [
+            sent_id for sent_id in oldest_first[overflow:] if self.sent[sent_id] <= cutoff
+        ]
+        if settled:
+            self.floor = max(self.floor, *settled)
+            self.sent = {sent_id: at for sent_id, at in self.sent.items() if sent_id > self.floor}
+
+
+def parse_event_id(value):
+    """
+    Parse a ``Last-Event-ID`` into ``(message_cursor, room_message_cursor)``.
+
+    Returns:
+        tuple: The two ``Cursor`` objects, or None if ``value`` is missing or malformed.
+    """
+    try:
+        message_part, room_message_part = value.split('-')
+        return Cursor.parse(message_part), Cursor.parse(room_message_part)
+    except (AttributeError, ValueError):
+        return None
+
+
+def latest_ids():
+    """
+    Return the current highest message id and room message id.
+    """
+    message_id = Message.objects.order_by('-id').values_list('id', flat=True).first()
+    room_message_id = RoomMessage.objects.order_by('-id').values_list('id', flat=True).first()
+    return message_id or 0, room_message_id or 0
+
+
+def missed_messages(user_id, cursor, room_cursor):
+    """
+    Return the messages of ``user_id`` the given cursors have not covered, oldest first.
+
+    At most ``SSE_REPLAY_MAX`` of each kind are returned, the newest ones.
+
+    Returns:
+        tuple: ``(messages, room_messages, truncated)``; ``truncated`` is
+        True if more messages were missed than returned.
+    """
+    limit = settings.SSE_REPLAY_MAX
+    messages = list(
+        Message.objects.filter(Q(sender_id=user_id) | Q(receiver_id=user_id), id__gt=cursor.floor,
+                               deleted_at__isnull=True)
+        .exclude(id__in=list(cursor.sent))
+        .select_related('sender', 'receiver', 'attachment').order_by('-id')[:limit + 1]
+    )
+    room_messages = list(
+        RoomMessage.objects.filter(room_id__in=rooms.room_ids(user_id), id__gt=room_cursor.floor)
+        .exclude(id__in=list(room_cursor.sent))
+        .select_related('sender').order_by('-id')[:limit + 1]
+    )
+    truncated = len(messages) > limit or len(room_messages) > limit
+    messages = messages[:limit]
+    room_messages = room_messages[:limit]
+    messages.reverse()
+    room_messages.reverse()
+    return messages, room_messages, truncated
+
+
+class EventStream:
+    """
+    The events of one user; ``events()`` is the body of the streaming response.
+
+    Args:
+        user: The authenticated user.
+        last_event_id (str): The ``Last-Event-ID`` sent by the client, if any.
+    """
+
+    def __init__(self, user, last_event_id=None):
+        self.user = user
+        self.resume_from = parse_event_id(last_event_id)
+        self.channel_layer = get_channel_layer()
+        self.groups = set()
+        # Ids sent by the replay, which the live events may repeat
+        self.replayed = set()
+        self.replayed_room = set()
+
+    @property
+    def event_id(self):
+        self.cursor.settle()
+        self.room_cursor.settle()
+        return f'{self.cursor}-{self.room_cursor}'
+
+    async def events(self):
+        """
+        Yield the encoded events until the client disconnects or ``SSE_MAX_DURATION`` passes.
+        """
+        self.channel_name = await self.channel_layer.new_channel()
+        receive = None
+        try:
+            # Groups are joined before the cursor is read, so nothing
+            # published in between is lost; live events for messages the
+            # replay already sent are skipped
+            await self.join(inbox.inbox_group(self.user.id))
+            for room_id in await sync_to_async(rooms.room_ids)(self.user.id):
+                await self.join(rooms.room_group(room_id))
+            metrics.incr('chat.sse.connections')
+
+            yield f'retry: {settings.SSE_RETRY_MS}\n\n'.encode()
+            if self.resume_from is None:
+                message_id, room_message_id = await sync_to_async(latest_ids)()
+                self.cursor, self.room_cursor = Cursor(message_id), Cursor(room_message_id)
+                yield format_event('ready', {}, self.event_id)
+            else:
+                self.cursor, self.room_cursor = self.resume_from
+                for chunk in await self.replay():
+                    yield chunk
+
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + settings.SSE_MAX_DURATION
+            while True:
+                timeout = min(settings.SSE_KEEPALIVE_INTERVAL, deadline - loop.time())
+                if timeout <= 0:
+                    return
+                if receive is None:
+                    receive = asyncio.ensure_future(self.channel_layer.receive(self.channel_name))
+                done, _ = await asyncio.wait({receive}, timeout=timeout)
+                if not done:
+                    yield b': keepalive\n\n'
+                    continue
+                event, receive = receive.result(), None
+                chunk = await self.handle(event)
+                if chunk is not None:
+                    yield chunk
+        finally:
+            if receive is not None:
+                receive.cancel()
+            for group in self.groups:
+                await self.channel_layer.group_discard(group, self.channel_name)
+
+    async def join(self, group):
+        self.groups.add(group)
+        await self.channel_layer.group_add(group, self.channel_name)
+
+    async def replay(self):
+        """
+        Return the events of the messages missed since ``Last-Event-ID``.
+        """
+        messages, room_messages, truncated = await sync_to_async(missed_messages)(
+            self.user.id, self.cursor, self.room_cursor
+        )
+        metrics.incr('chat.sse.replayed', len(messages) + len(room_messages))
+        chunks = []
+        if truncated:
+            chunks.append(format_event('truncated', {}, self.event_id))
+        self.replayed.update(message.id for message in messages)
+        self.replayed_room.update(message.id for message in room_messages)
+        for message in messages:
+            chunks.append(self.direct_event(inbox.message_event(inbox.MESSAGE, message)))
+        for message in room_messages:
+            chunks.append(self.room_event(rooms.message_event(message)))
+        return chunks
+
+    async def handle(self, event):
+        """
+        Turn a channel-layer event into a stream event, or None to skip it.
+
+        Writers publish in the order they finish, not in id order, so a
+        message is only skipped if the replay sent it, never because a
+        higher id was already streamed.
+        """
+        if event['type'] == 'inbox.event':
+            if event['event'] == inbox.MESSAGE and event['id'] in self.replayed:
+                return None
+            return self.direct_event(event)
+        if event['type'] == 'room.message':
+            if event['id'] in self.replayed_room:
+                return None
+            return self.room_event(event)
+        if event['type'] == 'room.joined':
+            await self.join(rooms.room_group(event['room']))
+            return self.room_event(event)
+        if event['type'] == 'room.left' and event['user_id'] == self.user.id:
+            group = rooms.room_group(event['room'])
+            self.groups.discard(group)
+            await self.channel_layer.group_discard(group, self.channel_name)
+            return self.room_event({'type': event['type'], 'room': event['room']})
+        return None
+
+    def direct_event(self, event):
+        payload = {key: value for key, value in event.items() if key not in ('type', 'event')}
+        payload['conversation'] = event['receiver'] if event['sender'] == self.user.username else event['sender']
+        if event['event'] == inbox.MESSAGE:
+            self.cursor.add(event['id'])
+        return format_event(event['event'], payload, self.event_id)
+
+    def room_event(self, event):
+        payload = {key: value for key, value in event.items() if key != 'type'}
+        if event['type'] == 'room.message':
+            self.room_cursor.add(event['id'])
+        return format_event(ROOM_EVENTS[event['type']], payload, self.event_id)
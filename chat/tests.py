@@ -1,16 +1,62 @@
-from django.test import TestCase, Client, TransactionTestCase
+from django.test import AsyncClient, TestCase, Client, TransactionTestCase
 from django.urls import reverse
 from users.models import CustomUser
-from rest_framework.test import APITestCase, APIClient
+from rest_framework.test import APITestCase, APITransactionTestCase, APIClient
 from rest_framework import status
-from chat.models import Message
+from rest_framework.renderers import JSONRenderer
+from chat.models import (
+    Attachment, ClientRequest, Message, MessageArchive, MessageImport, MessageRollup, Room, RoomMembership, RoomMessage,
+)
 from chat.serializers import MessageSerializer
 from django.utils import timezone
 from channels.testing import WebsocketCommunicator
 from channels.db import database_sync_to_async
+from asgiref.sync import iscoroutinefunction
 from chat.consumers import ChatConsumer
 from chat_app.asgi import application
+import asyncio
+import csv
+import gzip
+import hashlib
 import json
+import os
+import pstats
+import shutil
+import tempfile
+import time
+from unittest import mock
+from datetime import datetime, timedelta, timezone as dt_timezone
+import io
+from io import StringIO
+from pathlib import Path
+from django.core.management import call_command, CommandError
+from django.core.exceptions import SynchronousOnlyOperation
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.db import connection, connections, transaction
+from django.test import override_settings
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from chat_app import db_router, profiling
+from chat_app.benchmark import import_time_by_package, measure_startup, parse_importtime
+from chat_app.middleware import ProfilingMiddleware
+from chat_app.metrics import Metrics, metrics
+from chat.attachments import UnsatisfiableRange, attachment_path, parse_range
+from chat.importer import copy_value
+from chat import delivery, idempotency, inbox, rollups, rooms, sidebar
+from chat.sse import EventStream
+from chat.sidebar import get_sidebar
+from chat_app.admission import AdmissionMiddleware, TokenBucket
+from chat_app.loopmonitor import LoopMonitor
+from chat_app import schema as openapi_schema
+from channels.auth import AuthMiddlewareStack
+from channels.routing import URLRouter
+from channels.layers import get_channel_layer
+from rest_framework_simplejwt.tokens import RefreshToken
+from chat.routing import websocket_urlpatterns
+from chat_app.server import Server, accept_permessage_deflate
+from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
 
 class MessageViewSetTest(APITestCase):
     def setUp(self):
@@ -54,6 +100,17 @@ class MessageViewSetTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data['results']), 2)  # لازم يجيب كل الرسائل بينهم
 
+    def test_list_matches_model_serializer(self):
+        """The fast list path renders the same JSON as MessageSerializer"""
+        response = self.client.get('/api/messages/')
+        expected = MessageSerializer(Message.objects.order_by('-timestamp'), many=True).data
+        self.assertEqual(JSONRenderer().render(response.data['results']), JSONRenderer().render(expected))
+
+    def test_search_messages(self):
+        """اختبار البحث في محتوى الرسائل"""
+        response = self.client.get('/api/messages/?search=hello')
+        self.assertEqual([row['id'] for row in response.data['results']], [self.message1.id])
+
     def test_create_message(self):
         """اختبار إرسال رسالة جديدة"""
         data = {
@@ -385,3 +442,1882 @@ class WebSocketTests(TransactionTestCase):
 
         # Disconnect
         await communicator.disconnect()
+
+class MessageArchiveTest(APITestCase):
+    """Test cases for archiving old messages to cold storage"""
+
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        self.user1 = CustomUser.objects.create_user(username='archive1', password='testpass123')
+        self.user2 = CustomUser.objects.create_user(username='archive2', password='testpass123')
+        self.user3 = CustomUser.objects.create_user(username='archive3', password='testpass123')
+
+        self.old_messages = []
+        for day, (sender, receiver) in enumerate([(self.user1, self.user2), (self.user2, self.user1), (self.user3, self.user1)]):
+            message = Message.objects.create(sender=sender, receiver=receiver, content=f'Old message {day}')
+            Message.objects.filter(pk=message.pk).update(timestamp=datetime(2024, 1, day + 1, 12, tzinfo=dt_timezone.utc))
+            self.old_messages.append(message)
+        self.recent = Message.objects.create(sender=self.user1, receiver=self.user2, content='Recent message')
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user1)
+
+    def tearDown(self):
+        shutil.rmtree(self.archive_dir)
+
+    def archive(self, before='2024-02'):
+        call_command('archive_messages', before=before, dir=self.archive_dir, stdout=StringIO())
+
+    def test_archive_moves_old_months_out_of_the_table(self):
+        """Archived months are removed from the table and recorded"""
+        self.archive()
+        self.assertEqual(list(Message.objects.all()), [self.recent])
+        archive = MessageArchive.objects.get()
+        self.assertEqual(archive.row_count, 3)
+        self.assertTrue(archive.path.endswith('messages-2024-01.ndjson.gz'))
+
+    def test_archived_messages_match_list_output(self):
+        """The archived endpoint returns exactly what the list endpoint returned before"""
+        before = self.client.get('/api/messages/?user=archive2').data['results']
+        self.archive()
+        archived = self.client.get('/api/messages/archived/?month=2024-01&user=archive2').data['results']
+        self.assertEqual(archived, [row for row in before if row['id'] != self.recent.id])
+
+    def test_archived_messages_filtered_by_participant(self):
+        """Only messages of the requesting user are visible"""
+        self.archive()
+        self.client.force_authenticate(user=self.user3)
+        response = self.client.get('/api/messages/archived/?month=2024-01')
+        self.assertEqual([row['content'] for row in response.data['results']], ['Old message 2'])
+
+    def test_archived_requires_valid_month(self):
+        """Missing or unknown months are rejected"""
+        self.archive()
+        self.assertEqual(self.client.get('/api/messages/archived/').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/api/messages/archived/?month=2023-05').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_archive_is_idempotent(self):
+        """Running the archive twice does not archive a month twice"""
+        self.archive()
+        self.archive()
+        self.assertEqual(MessageArchive.objects.count(), 1)
+
+    def test_partitioning_requires_postgres(self):
+        """The partition command refuses to run on other databases"""
+        if connection.vendor == 'postgresql':
+            self.skipTest('Partitioning is supported on this database')
+        with self.assertRaises(CommandError):
+            call_command('partition_messages')
+
+class PurgeDeletedMessagesTest(TestCase):
+    """Test cases for the purge_deleted_messages command"""
+
+    def setUp(self):
+        self.user1 = CustomUser.objects.create_user(username='purge1', password='testpass123')
+        self.user2 = CustomUser.objects.create_user(username='purge2', password='testpass123')
+        now = timezone.now()
+        self.live = Message.objects.create(sender=self.user1, receiver=self.user2, content='Live')
+        self.recently_deleted = Message.objects.create(
+            sender=self.user1, receiver=self.user2, content='Recently deleted',
+            deleted_at=now - timezone.timedelta(days=1)
+        )
+        self.expired = [
+            Message.objects.create(
+                sender=self.user1, receiver=self.user2, content=f'Expired {i}',
+                deleted_at=now - timezone.timedelta(days=90)
+            )
+            for i in range(5)
+        ]
+
+    def purge(self, **options):
+        out = StringIO()
+        call_command('purge_deleted_messages', retention_days=30, batch_size=2, sleep=0, stdout=out, **options)
+        return out.getvalue()
+
+    def test_purges_only_expired_soft_deletes(self):
+        """Messages soft-deleted before the retention period are removed in batches"""
+        output = self.purge()
+        self.assertIn('Purged 5 messages', output)
+        self.assertIn('rows/sec', output)
+        self.assertEqual(set(Message.objects.all()), {self.live, self.recently_deleted})
+
+    def test_tombstone_keeps_rows(self):
+        """Tombstone mode blanks the content and keeps the rows"""
+        output = self.purge(tombstone=True)
+        self.assertIn('Tombstoned 5 messages', output)
+        self.assertEqual(Message.objects.filter(content='').count(), 5)
+        self.assertIn('Tombstoned 0 messages', self.purge(tombstone=True))
+
+    def test_runtime_budget(self):
+        """A zero runtime budget stops before the first batch"""
+        output = self.purge(max_runtime=0)
+        self.assertIn('Runtime budget exhausted', output)
+        self.assertEqual(Message.objects.count(), 7)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTest(APITestCase):
+    """Test cases for routing chat reads to a second SQLite database acting as a replica"""
+
+    @classmethod
+    def setUpClass(cls):
+        # The replica alias is only created here, so the test runner does not
+        # know about it; it has to exist, with its tables, before the test case
+        # opens its per-database transactions.
+        cls.replica_dir = tempfile.mkdtemp()
+        connections.settings['replica'] = connections.configure_settings({
+            'default': connections.settings['default'],
+            'replica': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(cls.replica_dir, 'replica.sqlite3'),
+            },
+        })['replica']
+        call_command('migrate', database='replica', verbosity=0)
+        cls.databases = {'default', 'replica'}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        shutil.rmtree(cls.replica_dir)
+
+    def setUp(self):
+        db_router._lag_checks.clear()
+        self.user1 = CustomUser.objects.create_user(username='replica1', password='testpass123')
+        self.user2 = CustomUser.objects.create_user(username='replica2', password='testpass123')
+        Message.objects.create(sender=self.user1, receiver=self.user2, content='On the primary')
+
+        # The replica holds the same users but a different message, so the
+        # responses show which database served them.
+        for user in (self.user1, self.user2):
+            CustomUser.objects.using('replica').create(id=user.id, username=user.username)
+        Message.objects.using('replica').create(sender_id=self.user1.id, receiver_id=self.user2.id, content='On the replica')
+
+        # Creating the fixtures made user1 a recent writer.
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user1)
+
+    def list_contents(self):
+        return [row['content'] for row in self.client.get('/api/messages/').data['results']]
+
+    def test_list_reads_from_replica(self):
+        """The message list is served by the replica"""
+        self.assertEqual(self.list_contents(), ['On the replica'])
+
+    def test_chat_room_reads_from_replica(self):
+        """The chat room page and its sidebar are served by the replica"""
+        self.client.force_login(self.user1)
+        response = self.client.get(reverse('chat', args=['replica2']))
+        self.assertEqual([chat.content for chat in response.context['chats']], ['On the replica'])
+
+    def test_reads_stick_to_primary_after_write(self):
+        """A user who just wrote reads their own writes from the primary"""
+        self.client.post('/api/messages/', {'receiver': self.user2.id, 'content': 'Just sent'})
+        self.assertEqual(self.list_contents(), ['Just sent', 'On the primary'])
+
+        # Other users keep reading from the replica.
+        self.client.force_authenticate(user=self.user2)
+        self.assertEqual(self.list_contents(), ['On the replica'])
+
+    def test_stickiness_is_checked_once_per_block(self):
+        """Reads inside replica_reads() make no cache lookups of their own"""
+        with mock.patch('chat_app.db_router.cache.get', wraps=cache.get) as cache_get:
+            with db_router.replica_reads(self.user1):
+                for _ in range(3):
+                    self.assertEqual(list(Message.objects.values_list('content', flat=True)), ['On the replica'])
+        self.assertEqual(cache_get.call_count, 1)
+
+    def test_write_inside_block_pins_later_reads(self):
+        """A write made inside replica_reads() sends the rest of the block to the primary"""
+        with db_router.replica_reads(self.user1):
+            db_router.mark_write(self.user1.id)
+            self.assertEqual(list(Message.objects.values_list('content', flat=True)), ['On the primary'])
+
+    def test_lagging_replica_is_skipped(self):
+        """Reads fall back to the primary when the replica lags too far behind"""
+        with mock.patch('chat_app.db_router.measure_lag', return_value=60.0):
+            self.assertEqual(self.list_contents(), ['On the primary'])
+
+    def test_other_reads_use_primary(self):
+        """Views outside replica_reads() and writes always use the primary"""
+        message = Message.objects.get()
+        response = self.client.get(f'/api/messages/{message.id}/')
+        self.assertEqual(response.data['content'], 'On the primary')
+        self.assertEqual(db_router.ReplicaRouter().db_for_write(Message), 'default')
+
+
+class SidebarCacheTest(APITransactionTestCase):
+    """Test cases for the per-user cache of the chat sidebar"""
+
+    def setUp(self):
+        self.user1 = CustomUser.objects.create_user(username='side1', password='testpass123')
+        self.user2 = CustomUser.objects.create_user(username='side2', password='testpass123')
+        self.user3 = CustomUser.objects.create_user(username='side3', password='testpass123')
+        self.message = Message.objects.create(sender=self.user1, receiver=self.user2, content='First')
+        cache.clear()
+        metrics.reset()
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user1)
+
+    def sidebar(self, user):
+        return [(entry['user'].username, entry['last_message'] and entry['last_message'].content) for entry in get_sidebar(user)]
+
+    def test_sidebar_is_cached(self):
+        """The second page view reads the sidebar from the cache"""
+        self.client.force_login(self.user1)
+        self.client.get(reverse('chat', args=['side2']))
+        self.client.get(reverse('chat', args=['side2']) + '?search=Fir')
+        self.assertEqual(metrics.counter('chat.sidebar.misses'), 1)
+        self.assertEqual(metrics.counter('chat.sidebar.hits'), 1)
+        self.assertEqual(metrics.snapshot()['timings']['chat.sidebar.rebuild']['count'], 1)
+
+    def test_new_message_patches_both_sidebars(self):
+        """Sending a message moves the conversation to the top for both participants"""
+        self.sidebar(self.user1)
+        self.sidebar(self.user3)
+        self.client.post('/api/messages/', {'receiver': self.user3.id, 'content': 'Hi three'})
+
+        self.assertEqual(self.sidebar(self.user1), [('side3', 'Hi three'), ('side2', 'First')])
+        self.assertEqual(self.sidebar(self.user3)[0], ('side1', 'Hi three'))
+        self.assertEqual(metrics.counter('chat.sidebar.misses'), 2)
+
+    def test_edit_patches_last_message(self):
+        """Editing the last message updates its content in the cached sidebar"""
+        self.sidebar(self.user2)
+        self.client.post(f'/api/messages/{self.message.id}/update_message/', {'content': 'Edited'})
+        self.assertEqual(self.sidebar(self.user2)[0], ('side1', 'Edited'))
+        self.assertEqual(metrics.counter('chat.sidebar.misses'), 1)
+
+    def test_delete_rebuilds_sidebar(self):
+        """Deleting a message drops the cached sidebars of both participants"""
+        self.sidebar(self.user1)
+        self.client.delete(f'/api/messages/{self.message.id}/delete_message/')
+        self.assertEqual(dict(self.sidebar(self.user1))['side2'], None)
+        self.assertEqual(metrics.counter('chat.sidebar.misses'), 2)
+
+    def test_concurrent_patches_drop_sidebar(self):
+        """A patch that races another one drops the sidebar instead of losing a change"""
+        self.sidebar(self.user1)
+        key = sidebar.sidebar_key(self.user1.id)
+
+        # Another writer holds the lock: this one cannot patch safely
+        cache.add(f'{key}:lock', True)
+        Message.objects.create(sender=self.user1, receiver=self.user3, content='While locked')
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(metrics.counter('chat.sidebar.conflicts'), 1)
+        cache.delete(f'{key}:lock')
+
+        # A writer that conflicted while this patch held the lock: the patched list is dropped too
+        self.sidebar(self.user1)
+        cache.set(f'{key}:conflict', True)
+        Message.objects.create(sender=self.user1, receiver=self.user2, content='Racing')
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(self.sidebar(self.user1)[0], ('side2', 'Racing'))
+
+    def test_rolled_back_message_is_not_cached(self):
+        """Sidebars are only patched once the message is committed"""
+        self.sidebar(self.user1)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Message.objects.create(sender=self.user1, receiver=self.user3, content='Rolled back')
+            raise RuntimeError
+        self.assertEqual(self.sidebar(self.user1), [('side2', 'First'), ('side3', None)])
+        self.assertEqual(metrics.counter('chat.sidebar.misses'), 1)
+
+    def test_rebuild_racing_a_write_is_not_cached(self):
+        """A rebuild that may have missed a message written meanwhile is not cached"""
+        build_sidebar = sidebar.build_sidebar
+
+        def slow_build(user):
+            entries = build_sidebar(user)
+            Message.objects.create(sender=self.user1, receiver=self.user3, content='During rebuild')
+            return entries
+
+        with mock.patch('chat.sidebar.build_sidebar', slow_build):
+            get_sidebar(self.user1)
+        self.assertIsNone(cache.get(sidebar.sidebar_key(self.user1.id)))
+        self.assertEqual(self.sidebar(self.user1)[0], ('side3', 'During rebuild'))
+
+    def test_new_user_invalidates_sidebars(self):
+        """A new user shows up in sidebars cached before they registered"""
+        self.sidebar(self.user1)
+        CustomUser.objects.create_user(username='side4', password='testpass123')
+        self.assertIn('side4', dict(self.sidebar(self.user1)))
+
+    def test_metrics_endpoint_is_staff_only(self):
+        """Metrics are only visible to staff users"""
+        self.assertEqual(self.client.get('/metrics/').status_code, status.HTTP_403_FORBIDDEN)
+        self.user1.is_staff = True
+        self.user1.save()
+        self.sidebar(self.user1)
+        response = self.client.get('/metrics/')
+        self.assertEqual(response.data['counters']['chat.sidebar.misses'], 1)
+
+
+class InboxConsumerTests(TransactionTestCase):
+    """Test cases for the multiplexed /ws/inbox/ consumer"""
+
+    @database_sync_to_async
+    def create_user(self, username):
+        return CustomUser.objects.create_user(username=username, password='password123')
+
+    @database_sync_to_async
+    def get_message(self, **filters):
+        return Message.objects.get(**filters)
+
+    async def connect(self, user, path='/ws/inbox/'):
+        communicator = WebsocketCommunicator(application=application, path=path)
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_anonymous_user_is_rejected(self):
+        """Connections without an authenticated user are closed"""
+        communicator = WebsocketCommunicator(application=application, path='/ws/inbox/')
+        communicator.scope['user'] = AnonymousUser()
+        connected, code = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, 4401)
+
+    async def test_unsubscribed_conversation_gets_notification(self):
+        """A new message in a conversation that is not open arrives as a notification"""
+        alice = await self.create_user('inbox_alice')
+        bob = await self.create_user('inbox_bob')
+        alice_socket = await self.connect(alice)
+        bob_socket = await self.connect(bob)
+
+        await alice_socket.send_json_to({'action': 'send', 'conversation': 'inbox_bob', 'message': 'Hi Bob'})
+        event = await bob_socket.receive_json_from()
+        self.assertEqual(event['event'], 'notification')
+        self.assertEqual(event['conversation'], 'inbox_alice')
+        self.assertEqual(event['preview'], 'Hi Bob')
+
+        message = await self.get_message(content='Hi Bob')
+        self.assertEqual(message.receiver_id, bob.id)
+
+        await alice_socket.disconnect()
+        await bob_socket.disconnect()
+
+    async def test_subscribed_conversation_gets_all_events(self):
+        """Subscribed conversations receive new, edited and deleted messages until unsubscribed"""
+        alice = await self.create_user('inbox_carol')
+        bob = await self.create_user('inbox_dave')
+        alice_socket = await self.connect(alice)
+        bob_socket = await self.connect(bob)
+
+        await bob_socket.send_json_to({'action': 'subscribe', 'conversation': 'inbox_carol'})
+        self.assertEqual((await bob_socket.receive_json_from())['event'], 'subscribed')
+
+        await alice_socket.send_json_to({'action': 'send', 'conversation': 'inbox_dave', 'message': 'Hello'})
+        event = await bob_socket.receive_json_from()
+        self.assertEqual((event['event'], event['message'], event['conversation']), ('message', 'Hello', 'inbox_carol'))
+
+        await alice_socket.send_json_to({'action': 'edit', 'message_id': event['id'], 'message': 'Hello!'})
+        updated = await bob_socket.receive_json_from()
+        self.assertEqual((updated['event'], updated['message']), ('message_updated', 'Hello!'))
+
+        await bob_socket.send_json_to({'action': 'unsubscribe', 'conversation': 'inbox_carol'})
+        self.assertEqual((await bob_socket.receive_json_from())['event'], 'unsubscribed')
+        await alice_socket.send_json_to({'action': 'delete', 'message_id': event['id']})
+        self.assertTrue(await bob_socket.receive_nothing())
+
+        message = await self.get_message(id=event['id'])
+        self.assertIsNotNone(message.deleted_at)
+
+        await alice_socket.disconnect()
+        await bob_socket.disconnect()
+
+    async def test_chat_consumer_fans_out_to_inbox(self):
+        """Messages sent through a conversation socket reach the receiver's inbox"""
+        alice = await self.create_user('inbox_erin')
+        bob = await self.create_user('inbox_frank')
+        chat_socket = await self.connect(alice, path='/ws/chat/inbox_frank/')
+        bob_socket = await self.connect(bob)
+
+        await chat_socket.send_json_to({'message': 'From the chat page'})
+        event = await bob_socket.receive_json_from()
+        self.assertEqual((event['event'], event['preview']), ('notification', 'From the chat page'))
+
+        await chat_socket.disconnect()
+        await bob_socket.disconnect()
+
+    async def test_invalid_frames_return_errors(self):
+        """Malformed frames and unknown messages are answered with an error"""
+        alice = await self.create_user('inbox_gina')
+        socket = await self.connect(alice)
+        await socket.send_to(text_data='not json')
+        self.assertEqual((await socket.receive_json_from())['event'], 'error')
+        await socket.send_json_to({'action': 'edit', 'message_id': 'abc', 'message': 'x'})
+        self.assertEqual((await socket.receive_json_from())['error'], 'Message not found')
+        await socket.disconnect()
+
+
+class MessageExportTest(APITestCase):
+    """Test cases for streaming message exports"""
+
+    def setUp(self):
+        self.user1 = CustomUser.objects.create_user(username='export1', password='testpass123')
+        self.user2 = CustomUser.objects.create_user(username='export2', password='testpass123')
+        self.user3 = CustomUser.objects.create_user(username='export3', password='testpass123')
+        self.messages = [
+            Message.objects.create(sender=sender, receiver=receiver, content=f'Message {i}, "quoted"')
+            for i, (sender, receiver) in enumerate([
+                (self.user1, self.user2), (self.user2, self.user1), (self.user1, self.user3), (self.user2, self.user3),
+            ])
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user1)
+
+    def download(self, query=''):
+        response = self.client.get(f'/api/messages/export/{query}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, b''.join(response.streaming_content)
+
+    def expected(self, messages):
+        return json.loads(json.dumps(MessageSerializer(messages, many=True).data))
+
+    def test_ndjson_export(self):
+        """The NDJSON export streams the user's messages, oldest first"""
+        response, body = self.download()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertIn('messages.ndjson', response['Content-Disposition'])
+        records = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual(records, self.expected(self.messages[:3]))
+
+    def test_csv_export_with_gzip(self):
+        """The CSV export can be gzip-compressed and filtered by conversation"""
+        response, body = self.download('?type=csv&compress=gzip&user=export2')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        rows = list(csv.DictReader(io.StringIO(gzip.decompress(body).decode())))
+        self.assertEqual([row['content'] for row in rows], ['Message 0, "quoted"', 'Message 1, "quoted"'])
+        self.assertEqual(rows[0]['sender'], str(self.user1.id))
+
+    async def test_export_streams_under_asgi(self):
+        """Under ASGI the export is streamed through an async iterator"""
+        client = AsyncClient()
+        await client.aforce_login(self.user1)
+        response = await client.get('/api/messages/export/')
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(body.decode().splitlines()), 3)
+
+    def test_invalid_type(self):
+        """Unknown export types are rejected"""
+        response = self.client.get('/api/messages/export/?type=xml')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_command(self):
+        """export_messages writes the same records to disk in small chunks"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'export.ndjson.gz')
+        out = StringIO()
+        call_command('export_messages', path, user='export1', gzip=True, chunk_size=2, stdout=out)
+        self.assertIn('Exported 3 messages', out.getvalue())
+        with gzip.open(path, 'rt') as export_file:
+            self.assertEqual([json.loads(line) for line in export_file], self.expected(self.messages[:3]))
+
+
+class ImportMessagesTest(TestCase):
+    """Test cases for the import_messages command"""
+
+    def setUp(self):
+        self.alice = CustomUser.objects.create_user(username='import_alice', password='testpass123')
+        self.bob = CustomUser.objects.create_user(username='import_bob', password='testpass123')
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        opener = gzip.open if name.endswith('.gz') else open
+        with opener(path, 'wt', encoding='utf-8') as input_file:
+            input_file.write(text)
+        return path
+
+    def run_import(self, path, **options):
+        out = StringIO()
+        call_command('import_messages', path, stdout=out, stderr=StringIO(), **options)
+        return out.getvalue()
+
+    def test_ndjson_import_keeps_timestamps(self):
+        """Messages are created with their original timestamps; unknown users are skipped"""
+        rows = [
+            {'sender': 'import_alice', 'receiver': 'import_bob', 'content': 'Old\thello', 'timestamp': '2020-05-01T10:00:00Z'},
+            {'sender': 'import_bob', 'receiver': 'import_alice', 'content': 'Reply', 'timestamp': '2020-05-01T10:01:00+00:00',
+             'deleted_at': '2020-05-02T00:00:00Z'},
+            {'sender': 'nobody', 'receiver': 'import_alice', 'content': 'Lost', 'timestamp': '2020-05-01T10:02:00Z'},
+        ]
+        path = self.write('history.ndjson.gz', '\n'.join(json.dumps(row) for row in rows) + '\nnot json\n')
+        output = self.run_import(path, batch_size=2)
+
+        self.assertIn('Imported 2 messages, skipped 2 rows', output)
+        self.assertIn('rows/sec', output)
+        first, second = Message.objects.order_by('timestamp')
+        self.assertEqual((first.sender, first.content), (self.alice, 'Old\thello'))
+        self.assertEqual(first.timestamp, datetime(2020, 5, 1, 10, 0, tzinfo=dt_timezone.utc))
+        self.assertEqual(second.deleted_at, datetime(2020, 5, 2, tzinfo=dt_timezone.utc))
+
+    def test_csv_import_with_user_map(self):
+        """External identifiers are mapped to users through a mapping file"""
+        mapping = self.write('users.csv', 'external_id,username\nU1,import_alice\nU2,import_bob\n')
+        path = self.write('history.csv', 'sender,receiver,content,timestamp\nU1,U2,"Hi, Bob",2021-01-01T00:00:00\n')
+        self.run_import(path, user_map=mapping)
+        message = Message.objects.get()
+        self.assertEqual((message.sender, message.receiver, message.content), (self.alice, self.bob, 'Hi, Bob'))
+
+    def test_import_resumes_and_is_not_repeated(self):
+        """An interrupted import continues after the rows already loaded"""
+        lines = [
+            json.dumps({'sender': self.alice.id, 'receiver': self.bob.id, 'content': f'Message {i}',
+                        'timestamp': f'2022-01-01T00:00:0{i}Z'})
+            for i in range(5)
+        ]
+        path = self.write('history.ndjson', '\n'.join(lines))
+        MessageImport.objects.create(source=os.path.abspath(path), rows_read=3, rows_imported=3)
+
+        output = self.run_import(path, users_by='id')
+        self.assertIn('Resuming after 3 rows', output)
+        self.assertEqual(list(Message.objects.order_by('timestamp').values_list('content', flat=True)),
+                         ['Message 3', 'Message 4'])
+        progress = MessageImport.objects.get()
+        self.assertEqual((progress.rows_read, progress.rows_imported), (5, 5))
+        self.assertIsNotNone(progress.finished_at)
+
+        self.assertIn('already imported', self.run_import(path, users_by='id'))
+        self.assertEqual(Message.objects.count(), 2)
+
+    def test_export_round_trip(self):
+        """A file written by export_messages can be imported again"""
+        Message.objects.create(sender=self.alice, receiver=self.bob, content='Round trip')
+        path = os.path.join(self.directory, 'export.csv')
+        call_command('export_messages', path, type='csv', stdout=StringIO())
+        original = Message.objects.get()
+        original.delete()
+
+        self.run_import(path, users_by='id')
+        imported = Message.objects.get()
+        self.assertEqual((imported.content, imported.timestamp), (original.content, original.timestamp))
+
+    def test_copy_value_escaping(self):
+        """Values are escaped for the PostgreSQL COPY text format"""
+        self.assertEqual(copy_value(None), '\\N')
+        self.assertEqual(copy_value('a\tb\nc\\d'), 'a\\tb\\nc\\\\d')
+        self.assertEqual(copy_value(datetime(2020, 1, 1, tzinfo=dt_timezone.utc)), '2020-01-01T00:00:00+00:00')
+
+
+class CompressionTest(APITestCase):
+    """Test cases for HTTP response and WebSocket frame compression"""
+
+    def setUp(self):
+        self.user1 = CustomUser.objects.create_user(username='gzip1', password='testpass123')
+        self.user2 = CustomUser.objects.create_user(username='gzip2', password='testpass123')
+        Message.objects.bulk_create([
+            Message(sender=self.user1, receiver=self.user2, content=f'Compressible message {i}')
+            for i in range(50)
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user1)
+
+    def test_large_json_page_is_gzipped(self):
+        response = self.client.get('/api/messages/?page_size=100', HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        data = json.loads(gzip.decompress(response.content))
+        self.assertEqual(len(data['results']), 50)
+
+    def test_client_without_gzip_gets_plain_response(self):
+        response = self.client.get('/api/messages/?page_size=100')
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(len(response.json()['results']), 50)
+
+    def test_small_response_is_not_compressed(self):
+        response = self.client.get('/api/messages/?page_size=1', HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertLess(len(response.content), 1024)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_streaming_export_is_gzipped(self):
+        response = self.client.get('/api/messages/export/', HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        body = gzip.decompress(b''.join(response.streaming_content))
+        self.assertEqual(len(body.splitlines()), 50)
+
+    def test_compressed_export_is_not_compressed_twice(self):
+        response = self.client.get('/api/messages/export/?compress=gzip', HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        body = gzip.decompress(b''.join(response.streaming_content))
+        self.assertEqual(len(body.splitlines()), 50)
+
+    def test_accepts_permessage_deflate_offer(self):
+        accept = accept_permessage_deflate([PerMessageDeflateOffer(request_max_window_bits=9)])
+
+        self.assertIsInstance(accept, PerMessageDeflateOfferAccept)
+        self.assertEqual(accept.window_bits, 9)
+
+        with override_settings(WEBSOCKET_DEFLATE=False):
+            self.assertIsNone(accept_permessage_deflate([PerMessageDeflateOffer()]))
+        self.assertIsNone(accept_permessage_deflate([]))
+
+    def test_server_configures_websocket_factory(self):
+        server = Server.__new__(Server)
+        factory = mock.Mock()
+        server.ws_factory = factory
+
+        factory.setProtocolOptions.assert_called_once_with(perMessageCompressionAccept=accept_permessage_deflate)
+        self.assertIs(server.ws_factory, factory)
+
+
+class AttachmentTest(APITestCase):
+    """Test cases for attachment uploads and range-capable downloads"""
+
+    def setUp(self):
+        self.user1 = CustomUser.objects.create_user(username='files1', password='testpass123')
+        self.user2 = CustomUser.objects.create_user(username='files2', password='testpass123')
+        self.outsider = CustomUser.objects.create_user(username='files3', password='testpass123')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        storage = override_settings(ATTACHMENT_DIR=directory)
+        storage.enable()
+        self.addCleanup(storage.disable)
+        self.directory = directory
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user1)
+
+    def upload(self, data=b'0123456789' * 10, name='notes.txt', content_type='text/plain', **fields):
+        upload = SimpleUploadedFile(name, data, content_type=content_type)
+        return self.client.post(
+            '/api/messages/upload/', {'receiver': self.user2.id, 'file': upload, **fields}, format='multipart'
+        )
+
+    def test_upload_creates_message_with_attachment(self):
+        with mock.patch('chat.inbox.send_event', new_callable=mock.AsyncMock) as send_event:
+            response = self.upload(content=' Caption ')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        message = Message.objects.get(id=response.data['id'])
+        self.assertEqual(message.content, 'Caption')
+        self.assertEqual(message.attachment_name, 'notes.txt')
+        self.assertEqual(message.attachment.size, 100)
+        self.assertEqual(message.attachment.content_type, 'text/plain')
+        self.assertEqual(message.attachment.sha256, hashlib.sha256(b'0123456789' * 10).hexdigest())
+        with open(attachment_path(message.attachment.sha256), 'rb') as stored:
+            self.assertEqual(stored.read(), b'0123456789' * 10)
+        # Temporary upload files are gone once the request is finished
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'tmp')), [])
+
+        # The event describes the file without carrying it
+        payload, user_ids = send_event.call_args.args
+        self.assertEqual(set(user_ids), {self.user1.id, self.user2.id})
+        self.assertEqual(payload['attachment'], {
+            'name': 'notes.txt',
+            'size': 100,
+            'content_type': 'text/plain',
+            'url': f'/api/messages/{message.id}/attachment/',
+        })
+
+    def test_same_content_is_stored_once(self):
+        with mock.patch('chat.inbox.send_event', new_callable=mock.AsyncMock):
+            first = self.upload(name='a.txt')
+            second = self.upload(name='b.txt')
+
+        self.assertEqual(Attachment.objects.count(), 1)
+        messages = Message.objects.filter(id__in=[first.data['id'], second.data['id']])
+        self.assertEqual({message.attachment_name for message in messages}, {'a.txt', 'b.txt'})
+        self.assertEqual(len({message.attachment_id for message in messages}), 1)
+        stored = [name for name in os.listdir(self.directory) if name != 'tmp']
+        self.assertEqual(len(stored), 1)
+
+    @override_settings(ATTACHMENT_MAX_SIZE=50)
+    def test_too_large_upload_is_rejected(self):
+        response = self.upload()
+
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertFalse(Message.objects.exists())
+        self.assertFalse(Attachment.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'tmp')), [])
+
+    def test_upload_requires_file_and_receiver(self):
+        response = self.client.post('/api/messages/upload/', {'receiver': self.user2.id}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        upload = SimpleUploadedFile('a.txt', b'data')
+        response = self.client.post('/api/messages/upload/', {'receiver': 0, 'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def attached_message(self, data=b'0123456789' * 10, **kwargs):
+        with mock.patch('chat.inbox.send_event', new_callable=mock.AsyncMock):
+            return Message.objects.get(id=self.upload(data, **kwargs).data['id'])
+
+    def test_download_whole_file(self):
+        message = self.attached_message()
+
+        response = self.client.get(f'/api/messages/{message.id}/attachment/', HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789' * 10)
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['ETag'], f'"{message.attachment.sha256}"')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="notes.txt"')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_images_are_shown_inline(self):
+        message = self.attached_message(b'\x89PNG fake', name='photo.png', content_type='image/png')
+
+        response = self.client.get(f'/api/messages/{message.id}/attachment/')
+
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['Content-Disposition'], 'inline; filename="photo.png"')
+
+    def test_range_requests(self):
+        message = self.attached_message()
+        url = f'/api/messages/{message.id}/attachment/'
+
+        response = self.client.get(url, HTTP_RANGE='bytes=10-14')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), b'01234')
+        self.assertEqual(response['Content-Range'], 'bytes 10-14/100')
+        self.assertEqual(response['Content-Length'], '5')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+        self.assertEqual(response['Content-Range'], 'bytes 97-99/100')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=100-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response['Content-Range'], 'bytes */100')
+
+        # A stale If-Range gets the whole file
+        response = self.client.get(url, HTTP_RANGE='bytes=0-4', HTTP_IF_RANGE='"other"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_parse_range(self):
+        self.assertIsNone(parse_range(None, 100))
+        self.assertIsNone(parse_range('bytes=0-1,5-6', 100))
+        self.assertIsNone(parse_range('bytes=5-1', 100))
+        self.assertIsNone(parse_range('items=0-1', 100))
+        self.assertEqual(parse_range('bytes=0-', 100), (0, 99))
+        self.assertEqual(parse_range('bytes=90-500', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-500', 100), (0, 99))
+        with self.assertRaises(UnsatisfiableRange):
+            parse_range('bytes=-0', 100)
+
+    async def test_async_download_streams_range(self):
+        message = await database_sync_to_async(self.attached_message)()
+        client = AsyncClient()
+        await client.aforce_login(self.user2)
+
+        response = await client.get(f'/api/messages/{message.id}/attachment/', headers={'Range': 'bytes=95-'})
+
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), b'56789')
+
+    def test_only_participants_can_download(self):
+        message = self.attached_message()
+        self.client.force_authenticate(user=self.outsider)
+
+        response = self.client.get(f'/api/messages/{message.id}/attachment/')
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class RoomApiTest(APITestCase):
+    """Test cases for group rooms over the REST API"""
+
+    def setUp(self):
+        self.owner = CustomUser.objects.create_user(username='room_owner', password='testpass123')
+        self.members = [
+            CustomUser.objects.create_user(username=f'room_member{i}', password='testpass123') for i in range(3)
+        ]
+        self.outsider = CustomUser.objects.create_user(username='room_outsider', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.owner)
+        self.channel_layer = mock.Mock(group_send=mock.AsyncMock())
+        patcher = mock.patch('chat.rooms.get_channel_layer', return_value=self.channel_layer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+
+    def create_room(self):
+        response = self.client.post(
+            '/api/rooms/', {'name': 'Team', 'members': [member.id for member in self.members]}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Room.objects.get(id=response.data['id'])
+
+    def test_create_room_adds_creator_and_members(self):
+        with mock.patch('chat.inbox.send_event', new_callable=mock.AsyncMock) as send_event:
+            room = self.create_room()
+
+        self.assertEqual(set(room.members.all()), {self.owner, *self.members})
+        self.assertEqual(room.created_by, self.owner)
+        # Each new member's inbox is told to join the room group
+        self.assertEqual(send_event.call_count, 4)
+
+        response = self.client.get('/api/rooms/')
+        self.assertEqual([item['id'] for item in response.data['results']], [room.id])
+        self.client.force_authenticate(user=self.outsider)
+        self.assertEqual(self.client.get('/api/rooms/').data['count'], 0)
+
+    def test_message_is_stored_once_and_sent_once(self):
+        room = self.create_room()
+
+        response = self.client.post(f'/api/rooms/{room.id}/messages/', {'content': 'Hello team'}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(RoomMessage.objects.filter(room=room).count(), 1)
+        self.channel_layer.group_send.assert_called_once()
+        group, event = self.channel_layer.group_send.call_args.args
+        self.assertEqual(group, f'room_{room.id}')
+        self.assertEqual((event['type'], event['sender'], event['message']), ('room.message', 'room_owner', 'Hello team'))
+
+        self.client.force_authenticate(user=self.members[0])
+        response = self.client.get(f'/api/rooms/{room.id}/messages/')
+        self.assertEqual([item['content'] for item in response.data['results']], ['Hello team'])
+
+    def test_outsider_cannot_read_or_post(self):
+        room = self.create_room()
+        self.client.force_authenticate(user=self.outsider)
+
+        self.assertEqual(self.client.get(f'/api/rooms/{room.id}/messages/').status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.post(f'/api/rooms/{room.id}/messages/', {'content': 'Hi'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(RoomMessage.objects.exists())
+
+    def test_remove_member(self):
+        room = self.create_room()
+        member = self.members[0]
+
+        # Members can only remove themselves
+        self.client.force_authenticate(user=self.members[1])
+        response = self.client.post(f'/api/rooms/{room.id}/remove_member/', {'user': member.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.post(f'/api/rooms/{room.id}/remove_member/', {'user': self.members[1].id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.post(f'/api/rooms/{room.id}/remove_member/', {'user': member.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(set(room.members.all()), {self.owner, self.members[2]})
+        group, event = self.channel_layer.group_send.call_args.args
+        self.assertEqual((group, event['type'], event['user_id']), (f'room_{room.id}', 'room.left', member.id))
+
+    def test_membership_cache(self):
+        room = self.create_room()
+
+        self.assertTrue(rooms.is_member(room.id, self.owner.id))
+        with self.assertNumQueries(0):
+            self.assertTrue(rooms.is_member(room.id, self.members[0].id))
+            self.assertFalse(rooms.is_member(room.id, self.outsider.id))
+
+        # Adding a member drops the cached ids
+        with mock.patch('chat.inbox.send_event', new_callable=mock.AsyncMock):
+            rooms.add_member(room, self.outsider)
+        self.assertTrue(rooms.is_member(room.id, self.outsider.id))
+
+
+class RoomConsumerTests(TransactionTestCase):
+    """Test cases for the /ws/rooms/<id>/ consumer"""
+
+    @database_sync_to_async
+    def create_room(self, name, member_count):
+        users = [
+            CustomUser.objects.create_user(username=f'{name}_{i}', password='password123') for i in range(member_count)
+        ]
+        room = Room.objects.create(name=name, created_by=users[0])
+        for user in users:
+            RoomMembership.objects.create(room=room, user=user)
+        return room, users
+
+    async def connect(self, user, path):
+        communicator = WebsocketCommunicator(application=application, path=path)
+        communicator.scope['user'] = user
+        connected, code = await communicator.connect()
+        return communicator, connected, code
+
+    async def test_non_member_is_rejected(self):
+        """Only members of the room can connect"""
+        room, _ = await self.create_room('closed', 1)
+        outsider = await database_sync_to_async(CustomUser.objects.create_user)(username='closed_out', password='x')
+
+        _, connected, code = await self.connect(outsider, f'/ws/rooms/{room.id}/')
+
+        self.assertFalse(connected)
+        self.assertEqual(code, 4403)
+
+    async def test_message_reaches_every_member_socket(self):
+        """A posted message is stored once and delivered to room and inbox sockets of all members"""
+        room, users = await self.create_room('team', 3)
+        sockets = [(await self.connect(user, f'/ws/rooms/{room.id}/'))[0] for user in users]
+        inbox_socket, connected, _ = await self.connect(users[2], '/ws/inbox/')
+        self.assertTrue(connected)
+
+        await sockets[0].send_json_to({'message': 'Hello room'})
+
+        for socket in [*sockets, inbox_socket]:
+            event = await socket.receive_json_from()
+            self.assertEqual((event['event'], event['room'], event['message']), ('room_message', room.id, 'Hello room'))
+            self.assertEqual(event['sender'], 'team_0')
+        count = await database_sync_to_async(RoomMessage.objects.filter(room=room).count)()
+        self.assertEqual(count, 1)
+
+        for socket in [*sockets, inbox_socket]:
+            await socket.disconnect()
+
+    async def test_removed_member_is_disconnected(self):
+        """Removing a member closes their room socket and stops their inbox from receiving the room"""
+        room, users = await self.create_room('shrinking', 2)
+        room_socket, _, _ = await self.connect(users[1], f'/ws/rooms/{room.id}/')
+        inbox_socket, _, _ = await self.connect(users[1], '/ws/inbox/')
+
+        await database_sync_to_async(rooms.remove_member)(room, users[1])
+
+        output = await room_socket.receive_output()
+        self.assertEqual(output, {'type': 'websocket.close', 'code': 4403})
+        self.assertEqual((await inbox_socket.receive_json_from())['event'], 'room_left')
+
+        await database_sync_to_async(RoomMessage.objects.create)(room=room, sender=users[0], content='Gone')
+        message = await database_sync_to_async(RoomMessage.objects.select_related('sender').get)(content='Gone')
+        await rooms.publish(message)
+        self.assertTrue(await inbox_socket.receive_nothing())
+        await inbox_socket.disconnect()
+
+
+class PendingDeliveryTest(TestCase):
+    """Test cases for the bounded replay of unacknowledged messages"""
+
+    def setUp(self):
+        self.alice = CustomUser.objects.create_user(username='pending_alice', password='testpass123')
+        self.bob = CustomUser.objects.create_user(username='pending_bob', password='testpass123')
+        self.carol = CustomUser.objects.create_user(username='pending_carol', password='testpass123')
+
+    def send(self, sender, receiver, content):
+        return Message.objects.create(sender=sender, receiver=receiver, content=content)
+
+    def test_pending_messages_oldest_first(self):
+        first = self.send(self.alice, self.bob, 'First')
+        second = self.send(self.carol, self.bob, 'Second')
+        self.send(self.bob, self.alice, 'Not for Bob')
+        deleted = self.send(self.alice, self.bob, 'Deleted')
+        deleted.deleted_at = timezone.now()
+        deleted.save()
+
+        self.assertEqual(delivery.pending_messages(self.bob.id), ([first, second], False))
+        self.assertEqual(delivery.pending_messages(self.bob.id, self.carol.id), ([second], False))
+
+    def test_replay_is_bounded_and_expires(self):
+        old = self.send(self.alice, self.bob, 'Old')
+        Message.objects.filter(id=old.id).update(timestamp=timezone.now() - timedelta(days=8))
+        recent = [self.send(self.alice, self.bob, f'Recent {i}') for i in range(3)]
+
+        with override_settings(PENDING_DELIVERY_MAX=2):
+            messages, truncated = delivery.pending_messages(self.bob.id)
+
+        self.assertEqual(messages, recent[1:])
+        self.assertTrue(truncated)
+
+    def test_ack_marks_only_own_messages(self):
+        to_bob = self.send(self.alice, self.bob, 'For Bob')
+        to_alice = self.send(self.bob, self.alice, 'For Alice')
+
+        self.assertEqual(delivery.mark_delivered(self.bob.id, [to_bob.id, to_alice.id, 'junk']), 0)
+        self.assertEqual(delivery.mark_delivered(self.bob.id, [to_bob.id, to_alice.id]), 1)
+        self.assertEqual(delivery.mark_delivered(self.bob.id, [to_bob.id]), 0)
+
+        to_bob.refresh_from_db()
+        to_alice.refresh_from_db()
+        self.assertIsNotNone(to_bob.delivered_at)
+        self.assertIsNone(to_alice.delivered_at)
+        self.assertEqual(delivery.pending_messages(self.bob.id), ([], False))
+
+
+class PendingDeliveryConsumerTests(TransactionTestCase):
+    """Test cases for flushing and acknowledging pending messages over WebSockets"""
+
+    @database_sync_to_async
+    def create_user(self, username):
+        return CustomUser.objects.create_user(username=username, password='password123')
+
+    @database_sync_to_async
+    def send(self, sender, receiver, content):
+        return Message.objects.create(sender=sender, receiver=receiver, content=content)
+
+    @database_sync_to_async
+    def delivered(self, message):
+        message.refresh_from_db()
+        return message.delivered_at is not None
+
+    async def connect(self, user, path):
+        communicator = WebsocketCommunicator(application=application, path=path)
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_inbox_flushes_pending_messages_until_acked(self):
+        """Messages sent while offline arrive in one frame on connect and stop once acked"""
+        alice = await self.create_user('offline_alice')
+        bob = await self.create_user('offline_bob')
+        messages = [await self.send(alice, bob, f'While you were away {i}') for i in range(2)]
+
+        socket = await self.connect(bob, '/ws/inbox/')
+        frame = await socket.receive_json_from()
+        self.assertEqual(frame['event'], 'pending')
+        self.assertFalse(frame['truncated'])
+        self.assertEqual([event['id'] for event in frame['messages']], [message.id for message in messages])
+        self.assertEqual(frame['messages'][0]['conversation'], 'offline_alice')
+
+        await socket.send_json_to({'action': 'ack', 'ids': [messages[0].id]})
+        self.assertTrue(await socket.receive_nothing())
+        self.assertTrue(await self.delivered(messages[0]))
+        await socket.disconnect()
+
+        # Only the unacknowledged message is replayed
+        socket = await self.connect(bob, '/ws/inbox/')
+        frame = await socket.receive_json_from()
+        self.assertEqual([event['id'] for event in frame['messages']], [messages[1].id])
+        await socket.disconnect()
+
+    async def test_chat_room_flushes_messages_from_partner(self):
+        """A chat socket replays pending messages from the other user only and accepts acks"""
+        alice = await self.create_user('offline_carol')
+        bob = await self.create_user('offline_dave')
+        erin = await self.create_user('offline_erin')
+        message = await self.send(alice, bob, 'Hi Dave')
+        await self.send(erin, bob, 'Other conversation')
+
+        socket = await self.connect(bob, '/ws/chat/offline_carol/')
+        frame = await socket.receive_json_from()
+        self.assertEqual(frame['pending'], [
+            {'sender': 'offline_carol', 'receiver': 'offline_dave', 'message': 'Hi Dave', 'id': message.id},
+        ])
+
+        await socket.send_json_to({'ack': [message.id]})
+        self.assertTrue(await socket.receive_nothing())
+        self.assertTrue(await self.delivered(message))
+        await socket.disconnect()
+
+
+class IdempotencyTest(APITestCase):
+    """Test cases for client idempotency keys"""
+
+    def setUp(self):
+        self.user1 = CustomUser.objects.create_user(username='retry_one', password='password123')
+        self.user2 = CustomUser.objects.create_user(username='retry_two', password='password123')
+        self.client.force_authenticate(user=self.user1)
+
+    def write(self):
+        return Message.objects.create(sender=self.user1, receiver=self.user2, content='Once')
+
+    def test_run_once_writes_once_per_key(self):
+        """A repeated key returns the first message without writing again"""
+        first, replayed = idempotency.run_once(self.user1, 'key-1', self.write)
+        self.assertFalse(replayed)
+        again, replayed = idempotency.run_once(self.user1, 'key-1', self.write)
+        self.assertTrue(replayed)
+        self.assertEqual(again, first)
+        self.assertEqual(Message.objects.count(), 1)
+
+        # Keys are scoped per user, and no key means no check
+        idempotency.run_once(self.user2, 'key-1', self.write)
+        idempotency.run_once(self.user1, None, self.write)
+        self.assertEqual(Message.objects.count(), 3)
+
+    def test_failed_write_does_not_store_key(self):
+        """A write that finds nothing to change can be retried with the same key"""
+        message, replayed = idempotency.run_once(self.user1, 'key-2', lambda: None)
+        self.assertEqual((message, replayed), (None, False))
+        self.assertFalse(ClientRequest.objects.exists())
+
+    def test_clean_key(self):
+        self.assertEqual(idempotency.clean_key(' abc '), 'abc')
+        self.assertIsNone(idempotency.clean_key(''))
+        self.assertIsNone(idempotency.clean_key({'a': 1}))
+        self.assertIsNone(idempotency.clean_key('x' * (idempotency.MAX_KEY_LENGTH + 1)))
+
+    def test_purge_expired_keys(self):
+        idempotency.run_once(self.user1, 'old', self.write)
+        idempotency.run_once(self.user1, 'new', self.write)
+        ClientRequest.objects.filter(key='old').update(created_at=timezone.now() - timedelta(days=2))
+
+        out = StringIO()
+        call_command('purge_idempotency_keys', stdout=out)
+        self.assertIn('Purged 1 idempotency keys', out.getvalue())
+        self.assertEqual(list(ClientRequest.objects.values_list('key', flat=True)), ['new'])
+
+    def test_api_create_with_idempotency_key(self):
+        """Retrying a POST with the same Idempotency-Key returns the first message"""
+        data = {'receiver': self.user2.id, 'content': 'Posted once'}
+        first = self.client.post('/api/messages/', data, HTTP_IDEMPOTENCY_KEY='post-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        again = self.client.post('/api/messages/', data, HTTP_IDEMPOTENCY_KEY='post-1')
+        self.assertEqual(again.status_code, status.HTTP_200_OK)
+        self.assertEqual(again.data['id'], first.data['id'])
+        self.assertEqual(Message.objects.count(), 1)
+
+
+class IdempotencyConsumerTests(TransactionTestCase):
+    """Test cases for retried WebSocket writes carrying a client_id"""
+
+    @database_sync_to_async
+    def create_user(self, username):
+        return CustomUser.objects.create_user(username=username, password='password123')
+
+    @database_sync_to_async
+    def get_message(self, **filters):
+        return Message.objects.get(**filters)
+
+    @database_sync_to_async
+    def message_count(self):
+        return Message.objects.count()
+
+    async def connect(self, user, path):
+        communicator = WebsocketCommunicator(application=application, path=path)
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def frames(self, socket, count):
+        return [await socket.receive_json_from() for _ in range(count)]
+
+    async def test_retried_send_edit_and_delete_apply_once(self):
+        alice = await self.create_user('retry_alice')
+        await self.create_user('retry_bob')
+        socket = await self.connect(alice, '/ws/chat/retry_bob/')
+
+        send = {'message': 'Hello once', 'client_id': 'send-1'}
+        await socket.send_json_to(send)
+        frames = await self.frames(socket, 2)
+        reply = next(frame for frame in frames if 'reply_to' in frame)
+        self.assertEqual(reply['reply_to'], 'send-1')
+        self.assertTrue(reply['ok'])
+
+        # The retry is answered with the same id and shown to this socket only
+        await socket.send_json_to(send)
+        frames = await self.frames(socket, 2)
+        retry = next(frame for frame in frames if 'reply_to' in frame)
+        self.assertEqual(retry['id'], reply['id'])
+        self.assertEqual(await self.message_count(), 1)
+
+        edit = {'message': 'Edited once', 'message_id': reply['id'], 'client_id': 'edit-1'}
+        await socket.send_json_to(edit)
+        await self.frames(socket, 2)
+        await socket.send_json_to(edit)
+        self.assertTrue((await socket.receive_json_from())['ok'])
+        self.assertTrue(await socket.receive_nothing())
+
+        delete = {'message': '', 'delete_message_id': reply['id'], 'client_id': 'delete-1'}
+        await socket.send_json_to(delete)
+        await self.frames(socket, 2)
+        await socket.send_json_to(delete)
+        self.assertTrue((await socket.receive_json_from())['ok'])
+        self.assertTrue(await socket.receive_nothing())
+
+        message = await self.get_message(id=reply['id'])
+        self.assertEqual(message.content, 'Edited once')
+        self.assertIsNotNone(message.deleted_at)
+        await socket.disconnect()
+
+    async def test_edit_of_someone_elses_message_is_rejected(self):
+        alice = await self.create_user('retry_carol')
+        bob = await self.create_user('retry_dave')
+        message = await database_sync_to_async(Message.objects.create)(sender=bob, receiver=alice, content='Mine')
+        await database_sync_to_async(delivery.mark_delivered)(alice.id, [message.id])
+
+        socket = await self.connect(alice, '/ws/chat/retry_dave/')
+        await socket.send_json_to({'message': 'Hijacked', 'message_id': message.id, 'client_id': 'edit-2'})
+        reply = await socket.receive_json_from()
+        self.assertEqual(reply, {'reply_to': 'edit-2', 'ok': False, 'id': message.id, 'error': 'Message not found'})
+        self.assertEqual((await self.get_message(id=message.id)).content, 'Mine')
+        await socket.disconnect()
+
+    async def test_inbox_send_retry_creates_one_message(self):
+        alice = await self.create_user('retry_erin')
+        await self.create_user('retry_frank')
+        socket = await self.connect(alice, '/ws/inbox/')
+
+        frame = {'action': 'send', 'conversation': 'retry_frank', 'message': 'Hi', 'client_id': 'inbox-1'}
+        await socket.send_json_to(frame)
+        sent = next(f for f in await self.frames(socket, 2) if f['event'] == 'sent')
+        await socket.send_json_to(frame)
+        again = await socket.receive_json_from()
+        self.assertEqual(again, {'event': 'sent', 'reply_to': 'inbox-1', 'id': sent['id']})
+        self.assertTrue(await socket.receive_nothing())
+        self.assertEqual(await self.message_count(), 1)
+        await socket.disconnect()
+
+
+class AdmissionTest(TransactionTestCase):
+    """Test cases for refusing WebSocket handshakes under load"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='admission_user', password='password123')
+        CustomUser.objects.create_user(username='admission_peer', password='password123')
+        # A fresh middleware around the real WebSocket stack, so limits start from zero
+        self.monitor = LoopMonitor()
+        self.middleware = AdmissionMiddleware(AuthMiddlewareStack(URLRouter(websocket_urlpatterns)), self.monitor)
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(application=self.middleware, path='/ws/inbox/')
+        communicator.scope['user'] = self.user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def assert_refused(self, communicator):
+        self.assertEqual(await communicator.receive_json_from(), {'retry_after': 7})
+        output = await communicator.receive_output()
+        self.assertEqual(output, {'type': 'websocket.close', 'code': 1013})
+
+    @override_settings(WEBSOCKET_MAX_CONNECTIONS=1, WEBSOCKET_RETRY_AFTER=7)
+    async def test_refuses_beyond_max_connections(self):
+        shed = metrics.counter('websocket.admission.shed.connections')
+        first = await self.connect()
+        await self.assert_refused(await self.connect())
+        self.assertEqual(metrics.counter('websocket.admission.shed.connections'), shed + 1)
+
+        # A slot frees up when a socket closes
+        await first.disconnect()
+        self.assertEqual(self.middleware.active, 0)
+        second = await self.connect()
+        self.assertTrue(await second.receive_nothing())
+        await second.disconnect()
+
+    @override_settings(WEBSOCKET_HANDSHAKE_RATE=0.001, WEBSOCKET_HANDSHAKE_BURST=1, WEBSOCKET_RETRY_AFTER=7)
+    async def test_refuses_handshakes_over_rate(self):
+        shed = metrics.counter('websocket.admission.shed.rate')
+        first = await self.connect()
+        await self.assert_refused(await self.connect())
+        self.assertEqual(metrics.counter('websocket.admission.shed.rate'), shed + 1)
+        await first.disconnect()
+
+    @override_settings(WEBSOCKET_MAX_LOOP_LAG=0.2, WEBSOCKET_RETRY_AFTER=7)
+    async def test_refuses_when_event_loop_lags(self):
+        self.monitor.lag = 0.5
+        await self.assert_refused(await self.connect())
+
+        self.monitor.lag = 0.1
+        socket = await self.connect()
+        self.assertTrue(await socket.receive_nothing())
+        await socket.disconnect()
+
+    def test_token_bucket_refills_at_rate(self):
+        now = [0.0]
+        bucket = TokenBucket(clock=lambda: now[0])
+        self.assertTrue(bucket.take(rate=2, burst=2))
+        self.assertTrue(bucket.take(rate=2, burst=2))
+        self.assertFalse(bucket.take(rate=2, burst=2))
+        now[0] += 0.5
+        self.assertTrue(bucket.take(rate=2, burst=2))
+        self.assertFalse(bucket.take(rate=2, burst=2))
+        # Idle time never banks more than the burst
+        now[0] += 60
+        self.assertEqual(sum(bucket.take(rate=2, burst=2) for _ in range(5)), 2)
+
+
+class ProfilingTest(TransactionTestCase):
+    """Test cases for on-demand profiling of requests and socket handlers"""
+
+    def setUp(self):
+        self.profile_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.profile_dir, ignore_errors=True)
+        self.staff = CustomUser.objects.create_user(username='profiler_staff', password='password123', is_staff=True)
+        self.user = CustomUser.objects.create_user(username='profiler_user', password='password123')
+
+    def profiles(self, suffix='.json'):
+        return [json.loads(path.read_text()) for path in sorted(self.profile_dir.glob(f'*{suffix}'))]
+
+    def test_disabled_by_default(self):
+        self.client.force_login(self.staff)
+        with override_settings(PROFILING_DIR=self.profile_dir):
+            response = self.client.get('/api/messages/', HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(list(self.profile_dir.iterdir()), [])
+
+    def test_staff_header_writes_profile_with_metadata(self):
+        self.client.force_login(self.staff)
+        with override_settings(PROFILING_ENABLED=True, PROFILING_DIR=self.profile_dir):
+            response = self.client.get('/api/messages/?page=1', HTTP_X_PROFILE='1')
+
+        profile_id = response['X-Profile-Id']
+        [metadata] = self.profiles()
+        self.assertEqual(metadata['id'], profile_id)
+        self.assertEqual(metadata['kind'], 'http')
+        self.assertEqual(metadata['path'], '/api/messages/?page=1')
+        self.assertEqual(metadata['status'], 200)
+        self.assertEqual(metadata['user_id'], self.staff.id)
+        self.assertEqual(metadata['trigger'], 'header')
+        stats = pstats.Stats(str(self.profile_dir / f'{profile_id}.prof'))
+        self.assertTrue(stats.total_calls)
+
+    def test_header_from_non_staff_is_ignored(self):
+        self.client.force_login(self.user)
+        with override_settings(PROFILING_ENABLED=True, PROFILING_DIR=self.profile_dir):
+            response = self.client.get('/api/messages/', HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(self.profiles(), [])
+
+    def test_sampled_requests_are_profiled(self):
+        self.client.force_login(self.user)
+        with override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1.0, PROFILING_DIR=self.profile_dir):
+            response = self.client.get('/api/messages/')
+        self.assertNotIn('X-Profile-Id', response)
+        [metadata] = self.profiles()
+        self.assertEqual(metadata['trigger'], 'sample')
+
+    async def test_async_view_is_profiled_without_leaving_the_loop(self):
+        with override_settings(PROFILING_ENABLED=True, PROFILING_DIR=self.profile_dir):
+            async def view(request):
+                return HttpResponse()
+            self.assertTrue(iscoroutinefunction(ProfilingMiddleware(view)))
+
+            client = AsyncClient()
+            await client.aforce_login(self.staff)
+            with mock.patch('chat_app.profiling._ProfiledCoroutine', wraps=profiling._ProfiledCoroutine) as profiled:
+                response = await client.get('/api/stream/', headers={'X-Profile': '1'})
+            profiled.assert_called_once()
+
+        self.assertEqual(response.status_code, 200)
+        [metadata] = self.profiles()
+        self.assertEqual(metadata['id'], response['X-Profile-Id'])
+        self.assertEqual(metadata['name'], 'event-stream')
+        self.assertEqual(metadata['user_id'], self.staff.id)
+
+    async def test_consumer_handler_is_profiled(self):
+        with override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1.0, PROFILING_DIR=self.profile_dir):
+            communicator = WebsocketCommunicator(application=application, path='/ws/chat/profiler_staff/')
+            communicator.scope['user'] = await database_sync_to_async(CustomUser.objects.get)(id=self.user.id)
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.send_json_to({'message': 'Profile me'})
+            await communicator.receive_json_from()
+            await communicator.disconnect()
+
+        [metadata] = self.profiles()
+        self.assertEqual(metadata['kind'], 'websocket')
+        self.assertEqual(metadata['name'], 'ChatConsumer.receive')
+        self.assertEqual(metadata['path'], '/ws/chat/profiler_staff/')
+        stats = pstats.Stats(str(self.profile_dir / f"{metadata['id']}.prof"))
+        self.assertIn('receive', {function for _, _, function in stats.stats})
+
+
+class LoopMonitorTest(TransactionTestCase):
+    """Test cases for the event-loop lag monitor"""
+
+    def test_histogram_buckets(self):
+        registry = Metrics()
+        for value in (0.5, 3, 3, 80, 5000):
+            registry.histogram('lag', value, buckets=(1, 5, 100))
+        histogram = registry.snapshot()['histograms']['lag']
+        self.assertEqual(histogram['count'], 5)
+        self.assertEqual(histogram['buckets'], {'1': 1, '5': 2, '100': 1, '+Inf': 1})
+
+    async def test_captures_stack_of_blocking_call(self):
+        monitor = LoopMonitor(interval=0.02, threshold=0.1)
+        monitor.ensure_started()
+        await asyncio.sleep(0.05)
+        lags = metrics.snapshot()['histograms']['asgi.loop.lag_ms']['buckets']['500']
+
+        def block_the_loop():
+            time.sleep(0.3)
+
+        with self.assertLogs('chat_app.loopmonitor', 'WARNING') as logs:
+            block_the_loop()
+            await asyncio.sleep(0.05)
+
+        [stall] = monitor.stalls
+        self.assertIn('block_the_loop', stall['stack'])
+        self.assertIsNotNone(stall['task'])
+        self.assertIn('Event loop blocked', logs.output[0])
+        self.assertEqual(metrics.snapshot()['histograms']['asgi.loop.lag_ms']['buckets']['500'], lags + 1)
+
+    async def test_debug_mode_flags_sync_database_access_on_loop(self):
+        monitor = LoopMonitor(interval=60, threshold=60)
+        with override_settings(LOOP_MONITOR_DEBUG=True):
+            monitor.ensure_started()
+        self.addCleanup(monitor.disable_debug)
+        flagged = metrics.counter('asgi.loop.sync_db')
+
+        with self.assertLogs('chat_app.loopmonitor', 'WARNING') as logs, self.assertRaises(SynchronousOnlyOperation):
+            CustomUser.objects.count()
+        self.assertIn('test_debug_mode_flags_sync_database_access_on_loop', logs.output[0])
+        self.assertEqual(metrics.counter('asgi.loop.sync_db'), flagged + 1)
+
+        # The same query from a worker thread is fine
+        await database_sync_to_async(CustomUser.objects.count)()
+        self.assertEqual(metrics.counter('asgi.loop.sync_db'), flagged + 1)
+
+
+class OpenAPISchemaTest(APITestCase):
+    """Test cases for the precomputed OpenAPI schema"""
+
+    def setUp(self):
+        openapi_schema.reset_schema()
+        self.addCleanup(openapi_schema.reset_schema)
+
+    def test_schema_file_matches_code(self):
+        """Fails when the API changes without running openapi_schema"""
+        call_command('openapi_schema', '--check', stdout=StringIO())
+
+    def test_check_flags_drift(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'openapi.json'
+            path.write_bytes(settings.OPENAPI_SCHEMA_FILE.read_bytes().replace(b'/api/messages/', b'/api/old/'))
+            with override_settings(OPENAPI_SCHEMA_FILE=path):
+                with self.assertRaisesMessage(CommandError, 'out of date'):
+                    call_command('openapi_schema', '--check', stdout=StringIO())
+
+    def test_schema_served_from_file_with_etag(self):
+        with mock.patch('chat_app.schema.generate_schema') as generate:
+            response = self.client.get('/swagger.json')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('/api/messages/', json.loads(response.content)['paths'])
+            etag = response['ETag']
+
+            response = self.client.get('/swagger.json', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+
+            response = self.client.get('/swagger.yaml')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'/api/messages/:', response.content)
+        generate.assert_not_called()
+
+    def test_schema_generated_once_without_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(OPENAPI_SCHEMA_FILE=Path(directory) / 'missing.json'):
+                with mock.patch('chat_app.schema.generate_schema', wraps=openapi_schema.generate_schema) as generate:
+                    self.client.get('/swagger.json')
+                    self.client.get('/swagger.json')
+        self.assertEqual(generate.call_count, 1)
+
+    def test_ui_pages_load_precomputed_schema(self):
+        with mock.patch('chat_app.schema.generate_schema') as generate:
+            for path in ('/swagger/', '/redoc/'):
+                response = self.client.get(path)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn(b'/swagger.json', response.content)
+        generate.assert_not_called()
+
+
+class StartupTest(TestCase):
+    """
+    Tests that heavy optional packages stay out of the start-up of a worker.
+    """
+
+    def test_deferred_modules_not_imported_at_startup(self):
+        result = measure_startup()
+        modules = set(result['modules'])
+        self.assertIn('chat_app.urls', modules)
+        for module in settings.STARTUP_DEFERRED_MODULES:
+            self.assertNotIn(module, modules)
+
+    def test_oauth_clients_imported_on_first_use(self):
+        from users.oauth import get_oauth_client, reset_oauth_client
+
+        self.addCleanup(reset_oauth_client)
+        client = get_oauth_client()
+        self.assertEqual(type(client).__module__, 'users.oauth_clients')
+        self.assertIs(get_oauth_client(), client)
+
+    def test_parse_importtime(self):
+        output = (
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       200 |        200 |     chat.models\n'
+            'import time:       300 |        500 |   chat.views\n'
+            'import time:      1000 |       1000 |   rest_framework\n'
+        )
+        imports = parse_importtime(output)
+        self.assertEqual([entry['module'] for entry in imports], ['chat.models', 'chat.views', 'rest_framework'])
+        self.assertEqual([entry['depth'] for entry in imports], [2, 1, 1])
+        self.assertEqual(imports[1]['cumulative'], 0.0005)
+        self.assertEqual(import_time_by_package(imports), [('rest_framework', 0.001), ('chat', 0.0005)])
+
+
+class MessageRollupTest(APITestCase):
+    """Test cases for the hourly message rollups"""
+
+    def setUp(self):
+        self.user1 = CustomUser.objects.create_user(username='rollup_one', password='password123')
+        self.user2 = CustomUser.objects.create_user(username='rollup_two', password='password123')
+        self.client.force_authenticate(user=self.user1)
+
+    def totals(self):
+        """Sum the rollups per sender and conversation, across hours"""
+        totals = {}
+        for rollup in MessageRollup.objects.all():
+            messages, size = totals.get((rollup.user_id, rollup.peer_id, rollup.room_id), (0, 0))
+            totals[rollup.user_id, rollup.peer_id, rollup.room_id] = (messages + rollup.messages, size + rollup.bytes)
+        return totals
+
+    def test_write_paths_update_rollups(self):
+        """Sending, editing and deleting messages keep the rollups equal to the messages"""
+        first = Message.objects.create(sender=self.user1, receiver=self.user2, content='مرحبا')
+        Message.objects.create(sender=self.user1, receiver=self.user2, content='Hi')
+        self.assertEqual(self.totals(), {(self.user1.id, self.user2.id, None): (2, 12)})
+
+        first.content = 'Hello'
+        first.save()
+        self.assertEqual(self.totals(), {(self.user1.id, self.user2.id, None): (2, 7)})
+
+        first.delete()
+        room = Room.objects.create(name='Rollups', created_by=self.user2)
+        RoomMessage.objects.create(room=room, sender=self.user2, content='Welcome')
+        self.assertEqual(self.totals(), {
+            (self.user1.id, self.user2.id, None): (1, 2),
+            (self.user2.id, None, room.id): (1, 7),
+        })
+        since = timezone.now() - timedelta(hours=1)
+        self.assertEqual(rollups.verify(since, timezone.now()), [])
+
+    def test_verify_and_rebuild(self):
+        """Writes that bypass the signals are reported and repaired"""
+        now = timezone.now()
+        Message.objects.create(sender=self.user1, receiver=self.user2, content='Counted')
+        Message.objects.bulk_create([Message(sender=self.user2, receiver=self.user1, content='Missed')])
+        since, until = now - timedelta(hours=1), now + timedelta(hours=1)
+
+        mismatches = rollups.verify(since, until)
+        self.assertEqual(len(mismatches), 1)
+        key, stored, actual = mismatches[0]
+        self.assertEqual((key[1:], stored, actual), ((self.user2.id, self.user1.id, None), (0, 0), (1, 6)))
+        with self.assertRaises(CommandError):
+            call_command('verify_rollups', since=since.isoformat(), until=until.isoformat(), stdout=StringIO())
+
+        call_command('verify_rollups', since=since.isoformat(), until=until.isoformat(), repair=True, stdout=StringIO())
+        self.assertEqual(rollups.verify(since, until), [])
+        self.assertEqual(self.totals()[self.user2.id, self.user1.id, None], (1, 6))
+
+        # A full rebuild gives the same rollups
+        MessageRollup.objects.update(messages=99)
+        rollups.rebuild(since, until)
+        self.assertEqual(rollups.verify(since, until), [])
+
+    def test_rebuild_archived_month_with_room_messages(self):
+        """Rebuilding an archived month keeps its direct rollups and rebuilds its room rollups"""
+        archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_dir)
+        january = datetime(2020, 1, 15, 12, tzinfo=dt_timezone.utc)
+        room = Room.objects.create(name='Archived rollups', created_by=self.user1)
+        message = Message.objects.create(sender=self.user1, receiver=self.user2, content='Archived')
+        room_message = RoomMessage.objects.create(room=room, sender=self.user2, content='Stays')
+        Message.objects.filter(pk=message.pk).update(timestamp=january)
+        RoomMessage.objects.filter(pk=room_message.pk).update(timestamp=january)
+        since, until = datetime(2020, 1, 1, tzinfo=dt_timezone.utc), datetime(2020, 2, 1, tzinfo=dt_timezone.utc)
+        rollups.rebuild(since, until)
+
+        call_command('archive_messages', before='2020-02', dir=archive_dir, stdout=StringIO())
+        january_rollups = MessageRollup.objects.filter(hour__gte=since, hour__lt=until)
+        january_rollups.filter(room=room).update(messages=99)
+        self.assertEqual(len(rollups.verify(since, until)), 1)
+
+        call_command('rollup_messages', since=since.isoformat(), until=until.isoformat(), stdout=StringIO())
+        self.assertEqual(rollups.verify(since, until), [])
+        self.assertEqual(
+            set(january_rollups.values_list('user_id', 'peer_id', 'room_id', 'messages', 'bytes')),
+            {(self.user1.id, self.user2.id, None, 1, 8), (self.user2.id, None, room.id, 1, 5)},
+        )
+
+    def test_purge_updates_rollups(self):
+        """Purged and tombstoned messages leave the rollups in one update per batch"""
+        deleted_at = timezone.now() - timedelta(days=60)
+        for content in ('One', 'Two', 'Three'):
+            Message.objects.create(sender=self.user1, receiver=self.user2, content=content, deleted_at=deleted_at)
+        since, until = timezone.now() - timedelta(hours=1), timezone.now() + timedelta(hours=1)
+
+        call_command('purge_deleted_messages', tombstone=True, sleep=0, stdout=StringIO())
+        self.assertEqual(self.totals(), {(self.user1.id, self.user2.id, None): (3, 0)})
+        call_command('purge_deleted_messages', sleep=0, stdout=StringIO())
+        self.assertEqual(self.totals(), {(self.user1.id, self.user2.id, None): (0, 0)})
+        self.assertEqual(rollups.verify(since, until), [])
+
+    def test_endpoint_reads_rollups(self):
+        """The analytics endpoint sums hourly rollups per day without touching messages"""
+        day = datetime(2026, 3, 2, tzinfo=dt_timezone.utc)
+        for hour, count in ((9, 2), (15, 3)):
+            MessageRollup.objects.create(
+                hour=day.replace(hour=hour), user=self.user1, peer=self.user2, messages=count, bytes=count * 10
+            )
+        MessageRollup.objects.create(hour=day, user=self.user2, peer=self.user1, messages=4, bytes=40)
+        params = {'since': '2026-03-01', 'until': '2026-03-03'}
+
+        with self.assertNumQueries(2):  # The page and its count, both on the rollups
+            response = self.client.get('/api/analytics/messages/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [{
+            'period': '2026-03-02T00:00:00Z', 'user': self.user1.id, 'peer': self.user2.id, 'room': None,
+            'messages': 5, 'bytes': 50,
+        }])
+
+        response = self.client.get('/api/analytics/messages/', {**params, 'period': 'hour'})
+        self.assertEqual([row['messages'] for row in response.data['results']], [3, 2])
+
+        # Staff users see every sender
+        self.user1.is_staff = True
+        self.user1.save()
+        response = self.client.get('/api/analytics/messages/', params)
+        self.assertEqual(response.data['count'], 2)
+        response = self.client.get('/api/analytics/messages/', {**params, 'user': self.user2.id})
+        self.assertEqual(response.data['results'][0]['messages'], 4)
+
+        self.assertEqual(self.client.get('/api/analytics/messages/', {'period': 'week'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/analytics/messages/', {'since': 'yesterday'}).status_code, 400)
+
+    def test_admin_lists_rollups(self):
+        """The admin lists rollups but does not allow editing them"""
+        admin_user = CustomUser.objects.create_superuser(username='rollup_admin', password='password123')
+        Message.objects.create(sender=self.user1, receiver=self.user2, content='Listed')
+        self.client.force_login(admin_user)
+        response = self.client.get('/admin/chat/messagerollup/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'rollup_one')
+        self.assertEqual(self.client.get('/admin/chat/messagerollup/add/').status_code, 403)
+
+
+class ActivityReportTest(APITestCase):
+    """Test cases for the activity heatmap and latency report"""
+
+    def setUp(self):
+        cache.clear()
+        self.user1 = CustomUser.objects.create_user(username='activity_one', password='password123')
+        self.user2 = CustomUser.objects.create_user(username='activity_two', password='password123')
+        self.user3 = CustomUser.objects.create_user(username='activity_three', password='password123')
+        # 2024-01-01 was a Monday
+        self.monday = datetime(2024, 1, 1, 10, tzinfo=dt_timezone.utc)
+        for sender, receiver, content, sent in [
+            (self.user1, self.user2, 'Hello', self.monday),
+            (self.user2, self.user1, 'Hi', self.monday + timedelta(seconds=30)),
+            (self.user2, self.user1, 'How are you?', self.monday + timedelta(seconds=90)),
+            (self.user1, self.user3, 'Tuesday', self.monday + timedelta(hours=23)),
+        ]:
+            message = Message.objects.create(sender=sender, receiver=receiver, content=content)
+            Message.objects.filter(pk=message.pk).update(timestamp=sent)
+        self.since = self.monday - timedelta(days=1)
+        self.until = self.monday + timedelta(days=2)
+
+    def test_heatmap_and_latencies(self):
+        """Messages land in their hour of the week and gaps are measured per conversation"""
+        from chat import activity
+
+        report = activity.activity_report(self.since, self.until)
+        self.assertEqual(report['messages'], 4)
+        self.assertEqual(report['heatmap']['messages'][0][10], 3)
+        self.assertEqual(report['heatmap']['messages'][1][9], 1)
+        self.assertEqual(report['heatmap']['characters'][0][10], 19)
+        self.assertEqual(sum(map(sum, report['heatmap']['messages'])), 4)
+
+        self.assertEqual(report['gaps']['count'], 2)
+        self.assertAlmostEqual(report['gaps']['percentiles']['p50'], 45, places=3)
+        self.assertEqual(report['replies']['count'], 1)
+        self.assertAlmostEqual(report['replies']['percentiles']['p99'], 30, places=3)
+        self.assertEqual(report['replies']['histogram']['counts'][3], 1)
+
+        # Chunks of one message give the same report
+        chunked = activity.activity_report(self.since, self.until, chunk_size=1)
+        self.assertEqual(chunked['heatmap'], report['heatmap'])
+        self.assertEqual(chunked['gaps']['percentiles'], report['gaps']['percentiles'])
+
+        empty = activity.activity_report(self.until, self.until + timedelta(days=1))
+        self.assertEqual(empty['messages'], 0)
+        self.assertIsNone(empty['replies']['percentiles']['p50'])
+
+    def test_endpoint_is_staff_only_and_cached(self):
+        """Only staff users get the report, which is computed once per range"""
+        params = {'since': self.since.isoformat(), 'until': self.until.isoformat()}
+        self.client.force_authenticate(user=self.user1)
+        self.assertEqual(self.client.get('/api/analytics/activity/', params).status_code, 403)
+
+        self.user1.is_staff = True
+        self.user1.save()
+        response = self.client.get('/api/analytics/activity/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['replies']['count'], 1)
+
+        hits = metrics.snapshot()['counters'].get('chat.activity.cache.hit', 0)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/analytics/activity/', params)
+        self.assertEqual(response.data['messages'], 4)
+        self.assertEqual(metrics.snapshot()['counters']['chat.activity.cache.hit'], hits + 1)
+
+        self.assertEqual(self.client.get('/api/analytics/activity/', {'since': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/analytics/activity/', {'since': params['until'], 'until': params['since']}).status_code, 400)
+
+    def test_command(self):
+        """The activity_report command prints the heatmap and the percentiles"""
+        out = StringIO()
+        call_command('activity_report', since=self.since.isoformat(), until=self.until.isoformat(), stdout=out)
+        output = out.getvalue()
+        self.assertIn('4 messages', output)
+        self.assertIn('Reply latency', output)
+        self.assertIn('p50 30.0 s', output)
+
+        out = StringIO()
+        call_command('activity_report', since=self.since.isoformat(), until=self.until.isoformat(),
+                     json=True, chunk_size=2, stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['heatmap']['messages'][0][10], 3)
+        with self.assertRaises(CommandError):
+            call_command('activity_report', since='tomorrow', stdout=StringIO())
+
+
+def parse_sse(chunk):
+    """Split one text/event-stream chunk into its fields, decoding data as JSON"""
+    fields = {}
+    for line in chunk.decode().splitlines():
+        if line.startswith(':') or not line:
+            continue
+        name, _, value = line.partition(': ')
+        fields[name] = json.loads(value) if name == 'data' else value
+    return fields
+
+
+@override_settings(SSE_KEEPALIVE_INTERVAL=0.2, SSE_RESUME_WINDOW=0)
+class EventStreamTests(TransactionTestCase):
+    """Test cases for the Server-Sent Events fallback at /api/stream/"""
+
+    def setUp(self):
+        self.alice = CustomUser.objects.create_user(username='sse_alice', password='password123')
+        self.bob = CustomUser.objects.create_user(username='sse_bob', password='password123')
+        self.room = Room.objects.create(name='SSE', created_by=self.alice)
+        RoomMembership.objects.create(room=self.room, user=self.alice)
+        RoomMembership.objects.create(room=self.room, user=self.bob)
+
+    @database_sync_to_async
+    def send_message(self, content):
+        return Message.objects.create(sender=self.alice, receiver=self.bob, content=content)
+
+    @database_sync_to_async
+    def post_to_room(self, content):
+        return RoomMessage.objects.create(room=self.room, sender=self.alice, content=content)
+
+    async def next_event(self, events):
+        return parse_sse(await asyncio.wait_for(anext(events), timeout=5))
+
+    async def test_endpoint_authenticates_and_streams(self):
+        """Anonymous clients get a 401; a JWT or a session opens the stream"""
+        client = AsyncClient()
+        response = await client.get('/api/stream/')
+        self.assertEqual(response.status_code, 401)
+
+        token = str(RefreshToken.for_user(self.bob).access_token)
+        response = await client.get('/api/stream/', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        chunks = aiter(response.streaming_content)
+        self.assertTrue((await anext(chunks)).startswith(b'retry: '))
+        self.assertEqual((await self.next_event(chunks))['event'], 'ready')
+
+        # Plain WSGI would buffer the stream, so it is refused there
+        await database_sync_to_async(self.client.force_login)(self.bob)
+        response = await database_sync_to_async(self.client.get)('/api/stream/')
+        self.assertEqual(response.status_code, 501)
+
+    async def test_streams_direct_and_room_events(self):
+        """Inbox and room group events are forwarded with an advancing event id"""
+        events = EventStream(self.bob).events()
+        self.assertTrue((await anext(events)).startswith(b'retry: '))
+        ready = await self.next_event(events)
+        self.assertEqual(ready['event'], 'ready')
+
+        message = await self.send_message('Hello over SSE')
+        await inbox.publish(inbox.MESSAGE, message)
+        event = await self.next_event(events)
+        self.assertEqual(event['event'], 'message')
+        self.assertEqual(event['data']['message'], 'Hello over SSE')
+        self.assertEqual(event['data']['conversation'], 'sse_alice')
+        self.assertEqual(event['id'], f'{message.id}-{ready["id"].split("-")[1]}')
+
+        room_message = await self.post_to_room('Hello room')
+        await rooms.publish(room_message)
+        event = await self.next_event(events)
+        self.assertEqual(event['event'], 'room_message')
+        self.assertEqual(event['data']['room'], self.room.id)
+        self.assertEqual(event['id'], f'{message.id}-{room_message.id}')
+
+        # Writers may publish out of id order; a lower id after a higher one still arrives
+        first = await self.send_message('Committed first, published last')
+        second = await self.send_message('Committed last, published first')
+        await inbox.publish(inbox.MESSAGE, second)
+        await inbox.publish(inbox.MESSAGE, first)
+        received = [await self.next_event(events) for _ in range(2)]
+        self.assertEqual([event['data']['id'] for event in received], [second.id, first.id])
+        self.assertEqual(received[-1]['id'], f'{second.id}-{room_message.id}')
+        await events.aclose()
+
+    async def test_resume_replays_missed_messages(self):
+        """A stream resumed with Last-Event-ID first replays what was missed"""
+        events = EventStream(self.bob).events()
+        await anext(events)
+        last_event_id = (await self.next_event(events))['id']
+        await events.aclose()
+
+        first = await self.send_message('Missed one')
+        second = await self.send_message('Missed two')
+        room_message = await self.post_to_room('Missed in the room')
+
+        events = EventStream(self.bob, last_event_id).events()
+        await anext(events)
+        replayed = [await self.next_event(events) for _ in range(3)]
+        self.assertEqual([event['data']['id'] for event in replayed], [first.id, second.id, room_message.id])
+        self.assertEqual(replayed[-1]['id'], f'{second.id}-{room_message.id}')
+
+        # Live events for messages the replay already sent are skipped
+        await inbox.publish(inbox.MESSAGE, first)
+        await rooms.publish(room_message)
+        self.assertEqual(await asyncio.wait_for(anext(events), timeout=5), b': keepalive\n\n')
+        await events.aclose()
+
+        # Too many missed messages: the newest are replayed after a truncated event
+        with override_settings(SSE_REPLAY_MAX=1):
+            events = EventStream(self.bob, last_event_id).events()
+            await anext(events)
+            self.assertEqual((await self.next_event(events))['event'], 'truncated')
+            self.assertEqual((await self.next_event(events))['data']['message'], 'Missed two')
+            await events.aclose()
+
+    @override_settings(SSE_RESUME_WINDOW=60)
+    async def test_resume_replays_lower_id_published_late(self):
+        """A lower id published after a reconnect is replayed even though a higher id was sent"""
+        events = EventStream(self.bob).events()
+        await anext(events)
+        floor = (await self.next_event(events))['id'].split('-')[0]
+
+        first = await self.send_message('Committed first, published after the reconnect')
+        second = await self.send_message('Committed last, published first')
+        await inbox.publish(inbox.MESSAGE, second)
+        last_event_id = (await self.next_event(events))['id']
+        self.assertTrue(last_event_id.startswith(f'{floor}.{second.id}-'))
+        await events.aclose()
+
+        # The ids the client received are not sent again
+        events = EventStream(self.bob, last_event_id).events()
+        await anext(events)
+        replayed = await self.next_event(events)
+        self.assertEqual(replayed['data']['id'], first.id)
+        self.assertTrue(replayed['id'].startswith(f'{floor}.{first.id}.{second.id}-'))
+        self.assertEqual(await asyncio.wait_for(anext(events), timeout=5), b': keepalive\n\n')
+        await events.aclose()
+
+    @override_settings(SSE_MAX_DURATION=0.3)
+    async def test_stream_ends_and_leaves_groups(self):
+        """Streams close after SSE_MAX_DURATION and leave their groups"""
+        stream = EventStream(self.bob)
+        chunks = [chunk async for chunk in stream.events()]
+        self.assertIn(b': keepalive\n\n', chunks)
+        groups = get_channel_layer().groups
+        self.assertFalse(any(stream.channel_name in groups.get(group, {}) for group in stream.groups))
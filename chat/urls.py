@@ -6,9 +6,13 @@ from . import views
 # نمط التصميم facory انشاء مسارات افتراضيه لل api 
 router = DefaultRouter()
 router.register(r'messages', views.MessageViewSet, basename='message')
+router.register(r'rooms', views.RoomViewSet, basename='room')
 
 urlpatterns = [
     # path('', views.home_view, name='home'),
+    path('api/analytics/messages/', views.MessageRollupView.as_view(), name='message-rollups'),
+    path('api/analytics/activity/', views.ActivityReportView.as_view(), name='activity-report'),
+    path('api/stream/', views.event_stream, name='event-stream'),
     path('api/', include(router.urls)),
     path('chat/<str:room_name>/', views.chat_room, name='chat'),
 ]
@@ -2,30 +2,46 @@
 
 This module contains the views and viewsets for the chat application, including:
 - MessageViewSet: API endpoints for CRUD operations on messages
+- event_stream: Server-Sent Events fallback for clients that cannot use WebSockets
 - chat_room: View for rendering the chat room interface
 
 The views handle user authentication, message filtering, pagination, and WebSocket integration.
 """
 
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from users.authentication import CachedJWTAuthentication
 from users.models import CustomUser
-from django.http import JsonResponse
-from django.db.models import Q
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import F, Q, Sum
+from django.db.models.functions import TruncDay
 from django.utils import timezone
-from datetime import datetime
-import pytz
+from datetime import timedelta, timezone as dt_timezone
 from rest_framework import serializers
-from rest_framework import viewsets, status
+from rest_framework import mixins, viewsets, status
 from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination
 from rest_framework import generics, permissions, pagination
 from rest_framework.decorators import action
+from rest_framework.exceptions import APIException
 from rest_framework.authentication import SessionAuthentication, TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
-
-from chat.serializers import MessageSerializer
-from .models import Message
+from rest_framework.parsers import MultiPartParser
+from rest_framework.views import APIView
+
+from chat.serializers import (
+    MessageRollupSerializer, MessageSerializer, RoomMessageSerializer, RoomSerializer, message_rows,
+)
+from chat_app.db_router import replica_reads, use_replicas
+from . import idempotency, inbox, rollups, rooms
+from .attachments import AttachmentUploadHandler, attachment_response, store_upload
+from .archive import load_archived_messages, parse_month
+from .export import FORMATS, export_filename, export_records, export_stream, iterate_in_thread
+from .models import Message, MessageArchive, MessageRollup, Room
+from .sidebar import get_sidebar
+from .sse import EventStream
 
 # def home_view(request):
 #     # Check if access token is in URL parameters
@@ -80,32 +96,62 @@ class MessageViewSet(viewsets.ModelViewSet):
     API Endpoints:
         GET /api/messages/: List all messages for the current user (paginated, 10 per page).
             - Can filter by user with query parameter: ?user=username
+            - Can search message content with query parameter: ?search=text
             - Can paginate with query parameter: ?page=2
         POST /api/messages/: Create a new message.
             - Required fields: receiver (user ID), content (message text)
+            - Optional Idempotency-Key header: a retry with the same key returns the first message
         GET /api/messages/{id}/: Retrieve a specific message by ID.
         PUT /api/messages/{id}/: Update a specific message (only allowed for sender).
         DELETE /api/messages/{id}/: Delete a specific message (only allowed for sender).
         POST /api/messages/{id}/update_message/: Custom endpoint to update message content.
         DELETE /api/messages/{id}/delete_message/: Custom endpoint to delete a message.
+        GET /api/messages/archived/?month=YYYY-MM: List archived messages of one month.
+            - Supports the same ?user= and ?page= parameters as the list endpoint
+        GET /api/messages/export/: Download all messages of the current user, oldest first.
+            - File type with query parameter: ?type=ndjson (default) or ?type=csv
+            - Gzip the file with query parameter: ?compress=gzip
+            - Supports the same ?user= and ?search= parameters as the list endpoint
+        POST /api/messages/upload/: Send a file as a message (multipart/form-data).
+            - Required fields: receiver (user ID), file; optional: content (caption)
+        GET /api/messages/{id}/attachment/: Download the attachment of a message.
+            - Supports Range, If-Range and If-None-Match headers
     """
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
     pagination_class = MessagePagination
 
+    def initialize_request(self, request, *args, **kwargs):
+        """
+        Stream uploaded attachments to disk instead of Django's default handlers.
+
+        The handlers must be in place before anything reads the body, which
+        includes the CSRF check of session authentication.
+        """
+        request = super().initialize_request(request, *args, **kwargs)
+        if self.action == 'upload':
+            request._request.upload_handlers = [AttachmentUploadHandler(request._request)]
+        return request
+
     def get_queryset(self):
         """
         Get the queryset of messages for the current user.
 
         This method filters messages to only include those where the current user
         is either the sender or receiver. It also supports filtering by another user
-        when the 'user' query parameter is provided.
+        when the 'user' query parameter is provided, and by content when the
+        'search' query parameter is provided.
 
         Returns:
             QuerySet: Filtered queryset of Message objects ordered by timestamp (newest first).
         """
+        # توليد مخطط OpenAPI يستدعي هذه الدالة بدون مستخدم حقيقي
+        if getattr(self, 'swagger_fake_view', False):
+            return Message.objects.none()
+
         user = self.request.user
         other_user = self.request.query_params.get('user', None)
+        search_query = self.request.query_params.get('search', None)
 
         # Base queryset: all non-soft-deleted messages where the current user is sender or receiver
         queryset = Message.objects.filter(
@@ -120,8 +166,47 @@ class MessageViewSet(viewsets.ModelViewSet):
                 Q(receiver__username=other_user)
             )
 
+        if search_query:
+            queryset = queryset.filter(content__icontains=search_query)
+
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        """
+        List the messages of the current user, read from a replica when one is configured.
+
+        Rows are fetched with ``values_list()`` and serialized by ``message_rows``
+        instead of building model instances; the JSON is the same as
+        ``MessageSerializer`` produces.
+        """
+        with replica_reads(request.user):
+            rows = message_rows.values(self.filter_queryset(self.get_queryset()))
+            page = self.paginate_queryset(rows)
+            if page is not None:
+                return self.get_paginated_response(message_rows.serialize(page))
+            return Response(message_rows.serialize(rows))
+
+    def create(self, request, *args, **kwargs):
+        """
+        Create a new message, at most once per Idempotency-Key header.
+
+        A request repeating the key of an earlier one writes nothing and
+        returns the message created the first time with 200 status code.
+
+        Returns:
+            Response: The message with 201 status code, or 200 for a repeated key.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        key = idempotency.clean_key(request.headers.get('Idempotency-Key'))
+        message, replayed = idempotency.run_once(request.user, key, lambda: self.perform_create(serializer))
+        if replayed:
+            data = self.get_serializer(message).data if message is not None else {}
+            return Response(data, status=status.HTTP_200_OK)
+
+        inbox.publish_sync(inbox.MESSAGE, message)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     def perform_create(self, serializer):
         """
         Perform the creation of a new message.
@@ -133,6 +218,9 @@ class MessageViewSet(viewsets.ModelViewSet):
         Args:
             serializer: The serializer instance that will create the message.
 
+        Returns:
+            Message: The new message.
+
         Raises:
             ValidationError: If the specified receiver username doesn't exist.
         """
@@ -140,7 +228,7 @@ class MessageViewSet(viewsets.ModelViewSet):
 
         try:
             receiver = CustomUser.objects.get(id=receiver_username)
-            serializer.save(sender=self.request.user, receiver=receiver)
+            return serializer.save(sender=self.request.user, receiver=receiver)
         except CustomUser.DoesNotExist:
             raise serializers.ValidationError("Receiver not found")
 
@@ -172,6 +260,7 @@ class MessageViewSet(viewsets.ModelViewSet):
         # Perform soft delete
         message.deleted_at = timezone.now()
         message.save(update_fields=['deleted_at'])
+        inbox.publish_sync(inbox.MESSAGE_DELETED, message)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=True, methods=['post'])
@@ -203,14 +292,387 @@ class MessageViewSet(viewsets.ModelViewSet):
         # Update the message
         message.content = content
         message.save()
+        inbox.publish_sync(inbox.MESSAGE_UPDATED, message)
 
         # Return the updated message
         serializer = self.get_serializer(message)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['post'], parser_classes=[MultiPartParser])
+    def upload(self, request):
+        """
+        Custom action to send a file as a message.
+
+        The file is written to disk while it is received (see
+        ``chat.attachments``) and stored once per content. The real-time event
+        only describes the file; clients download it from the attachment
+        endpoint.
+
+        Args:
+            request: The HTTP request with 'receiver', 'file' and optional 'content' fields.
+
+        Returns:
+            Response: The new message with 201 status code, or error response.
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"error": "No file uploaded"}, status=status.HTTP_400_BAD_REQUEST)
+        if not upload.size:
+            return Response({"error": "The uploaded file is empty"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            receiver = CustomUser.objects.get(id=request.data.get('receiver'))
+        except (CustomUser.DoesNotExist, TypeError, ValueError):
+            return Response({"error": "Receiver not found"}, status=status.HTTP_400_BAD_REQUEST)
+
+        message = Message.objects.create(
+            sender=request.user,
+            receiver=receiver,
+            content=(request.data.get('content') or '').strip(),
+            attachment=store_upload(upload),
+            attachment_name=upload.name,
+        )
+        inbox.publish_sync(inbox.MESSAGE, message)
+        return Response(self.get_serializer(message).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get'])
+    def attachment(self, request, pk=None):
+        """
+        Custom action to download the attachment of a message.
+
+        Only the sender and the receiver can download it. Range requests are
+        answered with 206 Partial Content, so clients can resume downloads
+        and seek in media files.
+
+        Args:
+            request: The HTTP request object.
+            pk: The primary key of the message.
+
+        Returns:
+            HttpResponse: The file, part of it, or an error response.
+        """
+        message = self.get_object()
+        if message.attachment_id is None:
+            return Response({"error": "This message has no attachment"}, status=status.HTTP_404_NOT_FOUND)
+        return attachment_response(request._request, message)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Custom action to download the message history of the current user.
+
+        The file is streamed while it is read from the database, so memory use
+        stays constant however many messages are exported. Each record has the
+        same fields as the list endpoint.
+
+        Args:
+            request: The HTTP request object with optional 'type' and 'compress' query parameters.
+
+        Returns:
+            StreamingHttpResponse: NDJSON or CSV file, optionally gzip-compressed.
+        """
+        file_format = request.query_params.get('type', 'ndjson')
+        if file_format not in FORMATS:
+            return Response({"error": "The type query parameter must be ndjson or csv"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        compress = request.query_params.get('compress') == 'gzip'
+
+        queryset = self.get_queryset().order_by('timestamp', 'id')
+        stream = export_stream(export_records(queryset), file_format, compress)
+        if isinstance(request._request, ASGIRequest):
+            # Django buffers synchronous iterators under ASGI
+            stream = iterate_in_thread(stream)
+
+        content_type = 'application/gzip' if compress else FORMATS[file_format][0]
+        response = StreamingHttpResponse(stream, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{export_filename(file_format, compress)}"'
+        return response
+
+    @action(detail=False, methods=['get'])
+    def archived(self, request):
+        """
+        Custom action to list messages of a month moved to cold storage.
+
+        Archived months are no longer in the database; their messages are read
+        from the compressed archive file on every request, so this endpoint is
+        much slower than the regular list endpoint.
+
+        Args:
+            request: The HTTP request object with a 'month' query parameter (YYYY-MM).
+
+        Returns:
+            Response: Paginated messages in the same format as the list endpoint.
+        """
+        try:
+            month = parse_month(request.query_params.get('month', ''))
+        except ValueError:
+            return Response({"error": "The month query parameter must be in YYYY-MM format"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        archive = MessageArchive.objects.filter(month=month).first()
+        if archive is None:
+            return Response({"error": "No archive for this month"}, status=status.HTTP_404_NOT_FOUND)
+
+        # Optional filtering by the other participant, as in get_queryset
+        messages = []
+        other_user = request.query_params.get('user', None)
+        other_user_id = None
+        if other_user:
+            other_user_id = CustomUser.objects.filter(username=other_user).values_list('id', flat=True).first()
+        if not other_user or other_user_id is not None:
+            messages = load_archived_messages(archive, request.user.id, other_user_id)
+
+        page = self.paginate_queryset(messages)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+class RoomViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin,
+                  viewsets.GenericViewSet):
+    """
+    ViewSet for the group rooms of the current user.
+
+    A room message is stored once and delivered to the members with a single
+    channel-layer ``group_send`` (see ``chat.rooms``), so posting costs the
+    same in a room of 3 or 300 members.
+
+    API Endpoints:
+        GET /api/rooms/: List the rooms the current user belongs to.
+        POST /api/rooms/: Create a room; the current user becomes a member.
+            - Required fields: name; optional: members (list of user IDs)
+        GET /api/rooms/{id}/: Retrieve a room with the IDs of its members.
+        POST /api/rooms/{id}/add_member/: Add a user to the room (any member can).
+            - Required fields: user (user ID)
+        POST /api/rooms/{id}/remove_member/: Remove a user from the room.
+            - Required fields: user (user ID); members can remove themselves, the creator anyone
+        GET /api/rooms/{id}/messages/: List the messages of the room (paginated, newest first).
+        POST /api/rooms/{id}/messages/: Post a message to the room.
+            - Required fields: content (message text)
+    """
+    serializer_class = RoomSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = MessagePagination
+
+    def get_queryset(self):
+        """
+        Get the rooms the current user is a member of.
+        """
+        if getattr(self, 'swagger_fake_view', False):
+            return Room.objects.none()
+        return Room.objects.filter(memberships__user=self.request.user).prefetch_related('members')
+
+    def perform_create(self, serializer):
+        """
+        Create the room and add the current user and the requested members.
+        """
+        members = serializer.validated_data.pop('members', [])
+        room = serializer.save(created_by=self.request.user)
+        for user in [self.request.user, *members]:
+            rooms.add_member(room, user)
+
+    def get_member_user(self, request):
+        """
+        Return the user given in the 'user' field of the request, or None.
+        """
+        try:
+            return CustomUser.objects.get(id=request.data.get('user'))
+        except (CustomUser.DoesNotExist, TypeError, ValueError):
+            return None
+
+    @action(detail=True, methods=['post'])
+    def add_member(self, request, pk=None):
+        """
+        Custom action to add a user to the room.
+
+        Returns:
+            Response: The updated room, or error response.
+        """
+        room = self.get_object()
+        user = self.get_member_user(request)
+        if user is None:
+            return Response({"error": "User not found"}, status=status.HTTP_400_BAD_REQUEST)
+        rooms.add_member(room, user)
+        return Response(self.get_serializer(self.get_object()).data)
+
+    @action(detail=True, methods=['post'])
+    def remove_member(self, request, pk=None):
+        """
+        Custom action to remove a user from the room.
+
+        Members can leave a room; only its creator can remove other members.
+
+        Returns:
+            Response: Empty response with 204 status code on success, or error response.
+        """
+        room = self.get_object()
+        user = self.get_member_user(request)
+        if user is None:
+            return Response({"error": "User not found"}, status=status.HTTP_400_BAD_REQUEST)
+        if user != request.user and room.created_by_id != request.user.id:
+            return Response({"error": "Only the room creator can remove other members"},
+                            status=status.HTTP_403_FORBIDDEN)
+        if not rooms.remove_member(room, user):
+            return Response({"error": "User is not a member"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, methods=['get', 'post'])
+    def messages(self, request, pk=None):
+        """
+        Custom action to list the messages of the room or post a new one.
+
+        Returns:
+            Response: Paginated messages, or the new message with 201 status code.
+        """
+        room = self.get_object()
+        if request.method == 'POST':
+            serializer = RoomMessageSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            message = serializer.save(room=room, sender=request.user)
+            rooms.publish_sync(message)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+        queryset = room.messages.filter(deleted_at__isnull=True).order_by('-timestamp')
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(RoomMessageSerializer(page, many=True).data)
+
+
+class MessageRollupView(generics.ListAPIView):
+    """
+    Messages sent per user, conversation and hour or day, with their size.
+
+    Only the hourly rollups are read (see ``chat.rollups``), never the message
+    tables, so a report costs the same however many messages were sent.
+
+    API Endpoints:
+        GET /api/analytics/messages/: Totals of the messages sent by the current user,
+            newest period first (paginated); staff users get every user.
+            - Optional query parameters: period (hour or day, default day), since and
+              until (ISO 8601 date or datetime, default the last 7 days), peer or room
+              (ID of the conversation), user (staff only)
+    """
+    serializer_class = MessageRollupSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = MessagePagination
+
+    def get_id_param(self, name):
+        """
+        Return the integer query parameter ``name``, or None if it is absent.
+        """
+        value = self.request.query_params.get(name)
+        if value is None:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise serializers.ValidationError({name: "Must be an ID"})
+
+    def get_queryset(self):
+        """
+        Sum the rollups of the requested range per period, sender and conversation.
+        """
+        if getattr(self, 'swagger_fake_view', False):
+            return MessageRollup.objects.none()
+
+        params = self.request.query_params
+        period = params.get('period', 'day')
+        if period not in ('hour', 'day'):
+            raise serializers.ValidationError({'period': "Must be hour or day"})
+        try:
+            until = rollups.parse_time(params['until']) if 'until' in params else timezone.now()
+            since = rollups.parse_time(params['since']) if 'since' in params else until - timedelta(days=7)
+        except ValueError as exc:
+            raise serializers.ValidationError({'detail': str(exc)})
+
+        queryset = MessageRollup.objects.filter(hour__gte=rollups.hour_of(since), hour__lt=until, messages__gt=0)
+        user_id = self.get_id_param('user')
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(user=self.request.user)
+        elif user_id is not None:
+            queryset = queryset.filter(user_id=user_id)
+        for name in ('peer', 'room'):
+            value = self.get_id_param(name)
+            if value is not None:
+                queryset = queryset.filter(**{f'{name}_id': value})
+
+        start = TruncDay('hour', tzinfo=dt_timezone.utc) if period == 'day' else F('hour')
+        return (
+            queryset.annotate(period=start)
+            .values('period', 'user', 'peer', 'room')
+            .annotate(message_count=Sum('messages'), byte_count=Sum('bytes'))
+            .order_by('-period', 'user', 'peer', 'room')
+        )
+
+
+class ActivityReportView(APIView):
+    """
+    Hour-of-week activity heatmap and inter-message latency distributions.
+
+    The report is computed with NumPy by ``chat.activity`` and cached for
+    ``ACTIVITY_CACHE_TIMEOUT`` seconds per range.
+
+    API Endpoints:
+        GET /api/analytics/activity/: The report of a range, staff users only.
+            - Optional query parameters: since and until (ISO 8601 date or datetime,
+              default the 28 days before the current hour)
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        # Keeps NumPy out of management commands and WSGI workers that never compute a report
+        from . import activity
+
+        params = request.query_params
+        try:
+            until = rollups.parse_time(params['until']) if 'until' in params else rollups.hour_of(timezone.now())
+            since = rollups.parse_time(params['since']) if 'since' in params else until - timedelta(days=28)
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if since >= until:
+            return Response({"error": "since must be before until"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(activity.cached_report(since, until))
+
+
+async def event_stream(request):
+    """
+    Server-Sent Events fallback for clients whose proxies block WebSockets.
+
+    Streams the events an ``InboxConsumer`` would receive as
+    ``text/event-stream`` (see ``chat.sse``). Browsers authenticate with their
+    session; other clients may send a JWT in the Authorization header.
+
+    API Endpoints:
+        GET /api/stream/: The event stream of the current user.
+            - Resume with the Last-Event-ID header, or the last_event_id query
+              parameter for clients that cannot set headers
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    if not isinstance(request, ASGIRequest):
+        # Django would buffer the endless stream before sending it
+        return JsonResponse({"error": "Event streams are only served under ASGI"},
+                            status=status.HTTP_501_NOT_IMPLEMENTED)
+
+    user = await request.auser()
+    if not user.is_authenticated:
+        try:
+            authenticated = await sync_to_async(CachedJWTAuthentication().authenticate)(request)
+        except APIException as exc:
+            return JsonResponse({"error": str(exc.detail)}, status=status.HTTP_401_UNAUTHORIZED)
+        if authenticated is None:
+            return JsonResponse({"error": "Authentication credentials were not provided."},
+                                status=status.HTTP_401_UNAUTHORIZED)
+        user = authenticated[0]
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    response = StreamingHttpResponse(EventStream(user, last_event_id).events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Keeps nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @login_required
+@use_replicas
 def chat_room(request, room_name):
     """
     View function for rendering the chat room interface.
@@ -247,33 +709,8 @@ def chat_room(request, room_name):
     # Order messages by timestamp (oldest first for chat display)
     chats = chats.order_by('timestamp')
 
-    # Prepare data for the sidebar showing users and their last messages
-    user_last_messages = []
-
-    # Use a minimum datetime for users with no messages
-    min_datetime = timezone.now().replace(year=1, month=1, day=1)
-
-    # For each user, find the most recent non-soft-deleted message between them and the current user
-    for user in users:
-        last_message = Message.objects.filter(
-            (Q(sender=request.user) & Q(receiver=user)) |
-            (Q(receiver=request.user) & Q(sender=user)),
-            deleted_at__isnull=True  # Filter out soft-deleted messages
-        ).order_by('-timestamp').first()
-
-        # Add user and their last message to the list
-        user_last_messages.append({
-            'user': user,
-            'last_message': last_message,
-            'timestamp': last_message.timestamp if last_message else min_datetime
-        })
-
-    # Sort users by the timestamp of their last message (newest first)
-    user_last_messages = sorted(
-        user_last_messages,
-        key=lambda x: x['timestamp'],
-        reverse=True
-    )
+    # Sidebar of users and their last messages, cached per user (see chat/sidebar.py)
+    user_last_messages = get_sidebar(request.user)
 
     # Render the chat template with all necessary context data
     return render(request, 'chat.html', {
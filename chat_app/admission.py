@@ -0,0 +1,132 @@
+"""Admission control for WebSocket handshakes.
+
+``AdmissionMiddleware`` wraps the WebSocket stack in ``chat_app.asgi`` and
+decides, before authentication or any consumer code runs, whether this
+process should take one more socket. A handshake is refused when:
+
+- the process already holds ``WEBSOCKET_MAX_CONNECTIONS`` sockets,
+- the event loop is running more than ``WEBSOCKET_MAX_LOOP_LAG`` seconds
+  behind (as measured by ``chat_app.loopmonitor``), which means every
+  connected user is already waiting, or
+- handshakes arrive faster than ``WEBSOCKET_HANDSHAKE_RATE`` per second,
+  beyond a burst of ``WEBSOCKET_HANDSHAKE_BURST``.
+
+A refused socket is accepted, sent one ``{"retry_after": <seconds>}`` frame
+and closed straight away with close code 1013 ("Try Again Later");
+rejecting the handshake itself would only give the browser a bare HTTP
+403. The frame carries the delay because daphne drops close reasons.
+Setting a limit to None disables that check.
+
+Counters, per process, on the shared metrics registry:
+``websocket.admission.admitted``, ``websocket.admission.shed`` and
+``websocket.admission.shed.<reason>`` for ``connections``, ``loop_lag`` and
+``rate``, plus ``websocket.connections.active``.
+"""
+
+import json
+import time
+
+from django.conf import settings
+
+from chat_app import loopmonitor
+from chat_app.metrics import metrics
+
+# Close code asking the client to reconnect later (RFC 6455, section 7.4.1)
+TRY_AGAIN_LATER = 1013
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at ``rate`` tokens per second.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.tokens = None
+        self.updated = clock()
+
+    def take(self, rate, burst):
+        """
+        Take one token if available.
+
+        Returns:
+            bool: True if a token was taken.
+        """
+        now = self.clock()
+        if self.tokens is None:
+            self.tokens = float(burst)
+        else:
+            self.tokens = min(float(burst), self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware refusing WebSocket handshakes the process cannot serve.
+
+    One instance wraps the WebSocket application of the process, so its
+    limits are per process. HTTP requests pass through untouched.
+
+    Args:
+        app: The WebSocket application.
+        monitor (LoopMonitor): Source of the loop lag; defaults to the process-wide monitor.
+    """
+
+    def __init__(self, app, monitor=None):
+        self.app = app
+        self.active = 0
+        self.bucket = TokenBucket()
+        self.monitor = monitor or loopmonitor.monitor
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'websocket':
+            return await self.app(scope, receive, send)
+
+        reason = self.check()
+        if reason is not None:
+            metrics.incr('websocket.admission.shed')
+            metrics.incr(f'websocket.admission.shed.{reason}')
+            await self.refuse(receive, send)
+            return
+
+        metrics.incr('websocket.admission.admitted')
+        metrics.incr('websocket.connections.active')
+        self.active += 1
+        try:
+            return await self.app(scope, receive, send)
+        finally:
+            self.active -= 1
+            metrics.incr('websocket.connections.active', -1)
+
+    def check(self):
+        """
+        Return why the next handshake must be refused, or None to admit it.
+        """
+        max_connections = settings.WEBSOCKET_MAX_CONNECTIONS
+        if max_connections is not None and self.active >= max_connections:
+            return 'connections'
+
+        max_lag = settings.WEBSOCKET_MAX_LOOP_LAG
+        if max_lag is not None and self.monitor.lag > max_lag:
+            return 'loop_lag'
+
+        # Checked last, so refused handshakes do not use up the rate
+        rate = settings.WEBSOCKET_HANDSHAKE_RATE
+        if rate is not None and not self.bucket.take(rate, settings.WEBSOCKET_HANDSHAKE_BURST):
+            return 'rate'
+        return None
+
+    async def refuse(self, receive, send):
+        """
+        Complete the handshake and close it at once with a retry-after code.
+        """
+        message = await receive()
+        if message['type'] != 'websocket.connect':
+            return
+        await send({'type': 'websocket.accept'})
+        await send({'type': 'websocket.send', 'text': json.dumps({'retry_after': settings.WEBSOCKET_RETRY_AFTER})})
+        await send({'type': 'websocket.close', 'code': TRY_AGAIN_LATER})
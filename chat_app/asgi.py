@@ -13,19 +13,30 @@ from dotenv import load_dotenv # استيراد load_dotenv
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
-from chat import routing  
 
 load_dotenv() # تحميل المتغيرات من ملف .env
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_app.settings')
 
+# get_asgi_application() sets Django up; the routing imports models, so it
+# has to come after when the server imports this module directly.
+django_asgi_app = get_asgi_application()
+
+from chat import routing  # noqa: E402
+from chat_app.admission import AdmissionMiddleware  # noqa: E402
+from chat_app.loopmonitor import LoopMonitorMiddleware  # noqa: E402
+
 
 # Initialize the ASGI application
 
-application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
-        URLRouter(
-            routing.websocket_urlpatterns
+# The loop monitor measures event-loop lag for every protocol
+application = LoopMonitorMiddleware(ProtocolTypeRouter({
+    "http": django_asgi_app,
+    # Admission runs first, so refused handshakes cost no session lookup
+    "websocket": AdmissionMiddleware(
+        AuthMiddlewareStack(
+            URLRouter(
+                routing.websocket_urlpatterns
+            )
         )
     ),
-})
+}))
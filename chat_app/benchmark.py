@@ -0,0 +1,166 @@
+"""Helpers shared by the ``bench_*`` management commands.
+
+The benchmark commands never touch the configured database: they build a
+throwaway test database (the same way ``manage.py test`` does), seed it, run
+their measurements and drop it again.
+
+``measure_startup`` times the cold start of a worker in a fresh interpreter.
+"""
+
+import json
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+@contextmanager
+def scratch_database(verbosity=0):
+    """
+    Run the enclosed block against a freshly created test database.
+
+    The test environment is set up as well so that the Django test client can
+    be used (``testserver`` host, locmem e-mail backend, ``DEBUG = False``).
+    """
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=verbosity, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        teardown_test_environment()
+
+
+def measure(func, iterations, warmup=10):
+    """
+    Call ``func`` repeatedly and collect wall-clock timings.
+
+    Args:
+        func: Zero-argument callable to benchmark.
+        iterations (int): Number of timed calls.
+        warmup (int): Number of untimed calls made first.
+
+    Returns:
+        dict: ``total``, ``mean``, ``p50``, ``p95`` (seconds) and ``per_sec``.
+    """
+    for _ in range(warmup):
+        func()
+
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+
+    return summarize(samples)
+
+
+def summarize(samples):
+    """
+    Summarize a list of durations (in seconds).
+    """
+    samples = sorted(samples)
+    total = sum(samples)
+    return {
+        'count': len(samples),
+        'total': total,
+        'mean': total / len(samples),
+        'p50': statistics.median(samples),
+        'p95': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        'per_sec': len(samples) / total if total else float('inf'),
+    }
+
+
+def format_stats(label, stats):
+    """
+    Render one line of benchmark output.
+    """
+    return (
+        f"{label:<32} {stats['per_sec']:>10.1f}/s  "
+        f"mean {stats['mean'] * 1000:>8.3f} ms  "
+        f"p50 {stats['p50'] * 1000:>8.3f} ms  "
+        f"p95 {stats['p95'] * 1000:>8.3f} ms"
+    )
+
+
+# Run by measure_startup() in a fresh interpreter: import the ASGI application
+# and the URLconf, which is what a worker does before serving its first request.
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import chat_app.asgi
+from django.urls import get_resolver
+get_resolver().url_patterns
+print(json.dumps({'seconds': time.perf_counter() - start, 'modules': sorted(sys.modules)}))
+"""
+
+
+def measure_startup(importtime=False):
+    """
+    Import ``chat_app.asgi.application`` and the URLconf in a new Python process.
+
+    The process inherits the environment, so it uses the same settings module.
+
+    Args:
+        importtime (bool): Run with ``python -X importtime``, which slows the
+            imports down a little but reports the time spent in each module.
+
+    Returns:
+        dict: ``seconds`` spent importing, the ``modules`` that were loaded and,
+        with ``importtime``, the ``imports`` parsed by ``parse_importtime``.
+
+    Raises:
+        RuntimeError: If the application cannot be imported.
+    """
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', STARTUP_SCRIPT]
+    process = subprocess.run(command, cwd=settings.BASE_DIR, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f'Importing the application failed:\n{process.stderr[-2000:]}')
+
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    if importtime:
+        result['imports'] = parse_importtime(process.stderr)
+    return result
+
+
+def parse_importtime(output):
+    """
+    Parse the report written to stderr by ``python -X importtime``.
+
+    Returns:
+        list: One dict per imported module, in the order of the report, with
+        ``module``, ``self`` and ``cumulative`` (seconds) and ``depth``.
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        if not own.strip().isdigit():
+            continue  # The header line
+        imports.append({
+            'module': name.strip(),
+            'self': int(own) / 1e6,
+            'cumulative': int(cumulative) / 1e6,
+            'depth': (len(name) - len(name.lstrip()) - 1) // 2,
+        })
+    return imports
+
+
+def import_time_by_package(imports):
+    """
+    Sum the time spent importing the modules of each top-level package.
+
+    Returns:
+        list: ``(package, seconds)`` pairs, slowest first.
+    """
+    totals = defaultdict(float)
+    for entry in imports:
+        totals[entry['module'].split('.')[0]] += entry['self']
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,315 @@
+"""Local multi-worker cluster used to check that the chat scales out.
+
+``LocalCluster`` starts N daphne workers (through ``chat_app.server``) serving
+``chat_app.asgi:application`` on free local ports, behind a ``LoadBalancer``
+that hands TCP connections to the workers round-robin. The workers share the
+database and the channel layer of the settings, so the layer has to reach
+across processes (set ``REDIS_URL``, see the settings) and the database has
+to be one the workers can open (not an in-memory SQLite database).
+
+``WebSocketClient`` is a small asyncio client used by the ``bench_cluster``
+command to drive load through the balancer.
+"""
+
+import asyncio
+import base64
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+
+def free_port(host='127.0.0.1'):
+    """
+    Return a TCP port that is currently free on ``host``.
+    """
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, process=None, host='127.0.0.1', timeout=30):
+    """
+    Wait until something accepts connections on ``port``.
+
+    Raises:
+        RuntimeError: If ``process`` exits or the port is not open after ``timeout`` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f'Worker on port {port} exited with code {process.returncode}')
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'Nothing listening on port {port} after {timeout} s')
+
+
+async def pipe(reader, writer):
+    """
+    Copy bytes from ``reader`` to ``writer`` until end of stream.
+    """
+    try:
+        while data := await reader.read(64 * 1024):
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+    finally:
+        writer.close()
+
+
+class LoadBalancer:
+    """
+    Round-robin TCP proxy running on its own event loop thread.
+
+    ``assignments`` maps the port of each client connection to the index of
+    the backend it was handed to, so callers can tell which worker serves a
+    socket.
+    """
+
+    def __init__(self, backends, host='127.0.0.1'):
+        self.backends = list(backends)
+        self.host = host
+        self.port = None
+        self.assignments = {}
+        self._next = itertools.count()
+        self._connections = set()
+        self._loop = None
+        self._thread = None
+        self._stopped = None
+
+    def start(self):
+        """
+        Start listening on a free port, stored in ``port``.
+        """
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,), daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def stop(self):
+        """
+        Stop listening and drop every proxied connection.
+        """
+        self._loop.call_soon_threadsafe(self._stopped.set)
+        self._thread.join()
+
+    def _run(self, ready):
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self._serve(ready))
+        self._loop.close()
+
+    async def _serve(self, ready):
+        self._stopped = asyncio.Event()
+        server = await asyncio.start_server(self._handle, self.host, 0)
+        self.port = server.sockets[0].getsockname()[1]
+        ready.set()
+
+        await self._stopped.wait()
+        server.close()
+        for task in self._connections:
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        index = next(self._next) % len(self.backends)
+        self.assignments[writer.get_extra_info('peername')[1]] = index
+        try:
+            backend_reader, backend_writer = await asyncio.open_connection(self.host, self.backends[index])
+        except OSError:
+            writer.close()
+            self._connections.discard(task)
+            return
+        try:
+            await asyncio.gather(pipe(reader, backend_writer), pipe(backend_reader, writer))
+        except asyncio.CancelledError:
+            # Cancelled by stop(); the pipes have closed both sides
+            pass
+        finally:
+            self._connections.discard(task)
+
+
+class LocalCluster:
+    """
+    N local ASGI workers behind a ``LoadBalancer``.
+
+    Use as a context manager; ``port`` is the port of the balancer::
+
+        with LocalCluster(4) as cluster:
+            ...  # connect to ws://127.0.0.1:<cluster.port>/ws/inbox/
+
+    Args:
+        workers (int): Number of worker processes.
+        env (dict): Environment of the workers; defaults to this process's.
+        quiet (bool): Discard the output of the workers.
+    """
+
+    def __init__(self, workers, env=None, quiet=True):
+        self.workers = workers
+        self.env = env if env is not None else dict(os.environ)
+        self.quiet = quiet
+        self.processes = []
+        self.ports = []
+        self.balancer = None
+
+    @property
+    def port(self):
+        return self.balancer.port
+
+    def __enter__(self):
+        try:
+            for _ in range(self.workers):
+                port = free_port()
+                output = subprocess.DEVNULL if self.quiet else None
+                process = subprocess.Popen(
+                    [sys.executable, '-m', 'chat_app.server', '-b', '127.0.0.1', '-p', str(port),
+                     'chat_app.asgi:application'],
+                    env=self.env, stdout=output, stderr=output,
+                )
+                self.processes.append(process)
+                self.ports.append(port)
+            for process, port in zip(self.processes, self.ports):
+                wait_for_port(port, process)
+        except BaseException:
+            self.stop_workers()
+            raise
+
+        self.balancer = LoadBalancer(self.ports)
+        self.balancer.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.balancer.stop()
+        self.stop_workers()
+
+    def stop_workers(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        self.processes.clear()
+
+
+class WebSocketClient:
+    """
+    Minimal asyncio WebSocket client exchanging JSON text frames.
+
+    autobahn's asyncio client cannot be used next to daphne, which ties
+    autobahn to twisted for the whole process, so this speaks RFC 6455 over
+    asyncio streams: no extensions, client frames masked, pings answered.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.frames = asyncio.Queue()
+        self.local_port = writer.get_extra_info('sockname')[1]
+        self.close_code = None
+        self._reading = asyncio.create_task(self._read_frames())
+
+    @classmethod
+    async def connect(cls, port, path, cookie=None, host='127.0.0.1', timeout=10):
+        """
+        Open a WebSocket to ``ws://host:port/path``.
+
+        Args:
+            cookie (str): Value of the ``Cookie`` header, e.g. a session cookie.
+
+        Raises:
+            ConnectionError: If the server does not switch protocols.
+        """
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        key = base64.b64encode(os.urandom(16)).decode()
+        request = [
+            f'GET {path} HTTP/1.1',
+            f'Host: {host}:{port}',
+            'Upgrade: websocket',
+            'Connection: Upgrade',
+            f'Sec-WebSocket-Key: {key}',
+            'Sec-WebSocket-Version: 13',
+        ]
+        if cookie:
+            request.append(f'Cookie: {cookie}')
+        writer.write(('\r\n'.join(request) + '\r\n\r\n').encode())
+        response = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout)
+        status = response.split(b'\r\n', 1)[0]
+        if b' 101 ' not in status:
+            writer.close()
+            raise ConnectionError(f'WebSocket handshake failed: {status.decode(errors="replace")}')
+        return cls(reader, writer)
+
+    async def _read_frames(self):
+        message = b''
+        try:
+            while True:
+                first, second = await self.reader.readexactly(2)
+                length = second & 0x7F
+                if length == 126:
+                    length = int.from_bytes(await self.reader.readexactly(2), 'big')
+                elif length == 127:
+                    length = int.from_bytes(await self.reader.readexactly(8), 'big')
+                payload = await self.reader.readexactly(length)
+
+                opcode = first & 0x0F
+                if opcode == 0x8:
+                    self.close_code = int.from_bytes(payload[:2], 'big') if len(payload) >= 2 else 1005
+                    break
+                if opcode == 0x9:
+                    self._send_frame(0xA, payload)
+                    continue
+                if opcode in (0x0, 0x1, 0x2):
+                    message += payload
+                    # FIN bit: the last fragment of the message
+                    if first & 0x80:
+                        self.frames.put_nowait(json.loads(message))
+                        message = b''
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self.close_code = self.close_code or 1006
+        finally:
+            self.frames.put_nowait(None)
+
+    def _send_frame(self, opcode, payload):
+        mask = os.urandom(4)
+        length = len(payload)
+        if length < 126:
+            header = bytes([0x80 | opcode, 0x80 | length])
+        elif length < 1 << 16:
+            header = bytes([0x80 | opcode, 0x80 | 126]) + length.to_bytes(2, 'big')
+        else:
+            header = bytes([0x80 | opcode, 0x80 | 127]) + length.to_bytes(8, 'big')
+        masked = (
+            int.from_bytes(payload, 'big') ^ int.from_bytes((mask * (length // 4 + 1))[:length], 'big')
+        ).to_bytes(length, 'big')
+        self.writer.write(header + mask + masked)
+
+    def send_json(self, data):
+        self._send_frame(0x1, json.dumps(data).encode())
+
+    async def receive_json(self, timeout=None):
+        """
+        Return the next frame, or None once the socket is closed.
+
+        Raises:
+            asyncio.TimeoutError: If no frame arrives within ``timeout`` seconds.
+        """
+        return await asyncio.wait_for(self.frames.get(), timeout)
+
+    def close(self):
+        if self.close_code is None:
+            self._send_frame(0x8, (1000).to_bytes(2, 'big'))
+        self._reading.cancel()
+        self.writer.close()
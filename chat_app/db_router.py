@@ -0,0 +1,164 @@
+"""Database router sending the heavy chat reads to read replicas.
+
+Only code running inside ``replica_reads(user)`` (or a view decorated with
+``use_replicas``) reads from a replica; every other query, and every write,
+goes to ``default``. Inside that block a read goes to a random healthy
+replica from ``DATABASE_REPLICAS`` unless:
+
+- the user wrote something in the last ``REPLICA_STICKY_SECONDS`` seconds, so
+  they always see their own writes, or
+- every replica is lagging more than ``REPLICA_MAX_LAG_SECONDS`` behind.
+
+Sending, editing or deleting a message calls ``mark_write`` for its sender
+(see chat/signals.py). Writes are remembered in Django's cache framework;
+configure a shared cache backend when running more than one process so that
+stickiness holds across workers. Stickiness is looked up once, when the
+block is entered, so the reads inside it cost no cache round trip; a write
+made inside the block sends the rest of its reads to the primary.
+"""
+
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Whether the reads of the current context may go to a replica
+_replica_allowed = ContextVar('replica_allowed', default=False)
+
+# alias -> (checked_at, lag_seconds)
+_lag_checks = {}
+
+
+@contextmanager
+def replica_reads(user):
+    """
+    Allow the ORM reads in this block to be served by a replica.
+
+    Args:
+        user: The user the reads are made for, used for stickiness.
+    """
+    user_id = user.pk if user is not None and user.is_authenticated else None
+    allowed = bool(settings.DATABASE_REPLICAS) and not (user_id and recently_wrote(user_id))
+    token = _replica_allowed.set(allowed)
+    try:
+        yield
+    finally:
+        _replica_allowed.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """
+    Send the ORM reads in this block to the primary, even inside ``replica_reads()``.
+    """
+    token = _replica_allowed.set(False)
+    try:
+        yield
+    finally:
+        _replica_allowed.reset(token)
+
+
+def use_replicas(view_func):
+    """
+    Decorator running a function view inside ``replica_reads(request.user)``.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        with replica_reads(request.user):
+            return view_func(request, *args, **kwargs)
+    return wrapper
+
+
+def _sticky_key(user_id):
+    return f'replica:last_write:{user_id}'
+
+
+def mark_write(user_id):
+    """
+    Pin the reads of ``user_id`` to the primary for the stickiness window.
+
+    The rest of the current ``replica_reads()`` block reads from the primary too.
+    """
+    if not settings.DATABASE_REPLICAS:
+        return
+    _replica_allowed.set(False)
+    cache.set(_sticky_key(user_id), True, timeout=settings.REPLICA_STICKY_SECONDS)
+
+
+def recently_wrote(user_id):
+    """
+    Return True if ``user_id`` wrote within the stickiness window.
+    """
+    return bool(cache.get(_sticky_key(user_id)))
+
+
+def measure_lag(alias):
+    """
+    Return how many seconds the replica ``alias`` is behind the primary.
+
+    Only PostgreSQL streaming replicas report a lag; other databases are
+    assumed to be in sync. A replica that cannot be reached counts as
+    infinitely behind.
+    """
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0.0
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT CASE
+                    WHEN NOT pg_is_in_recovery() THEN 0
+                    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                END
+                """
+            )
+            return float(cursor.fetchone()[0])
+    except Exception:
+        return float('inf')
+
+
+def replica_lag(alias):
+    """
+    Return the lag of ``alias``, measured at most once per check interval.
+    """
+    now = time.monotonic()
+    checked = _lag_checks.get(alias)
+    if checked is None or now - checked[0] >= settings.REPLICA_LAG_CHECK_INTERVAL:
+        checked = _lag_checks[alias] = (now, measure_lag(alias))
+    return checked[1]
+
+
+def healthy_replicas():
+    """
+    Return the configured replicas that are not lagging too far behind.
+    """
+    return [
+        alias for alias in settings.DATABASE_REPLICAS
+        if replica_lag(alias) <= settings.REPLICA_MAX_LAG_SECONDS
+    ]
+
+
+class ReplicaRouter:
+    """
+    Route reads inside ``replica_reads()`` to replicas, everything else to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not _replica_allowed.get():
+            return DEFAULT_DB_ALIAS
+        replicas = healthy_replicas()
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        return True
@@ -0,0 +1,210 @@
+"""Event-loop lag monitor for the ASGI process.
+
+``LoopMonitor`` keeps a task on the event loop that sleeps
+``LOOP_MONITOR_INTERVAL`` seconds at a time and measures how late it wakes
+up. That lag is how long every other task on the loop has been waiting; it
+is kept in ``lag`` (read by ``chat_app.admission``) and recorded in the
+``asgi.loop.lag_ms`` histogram of the metrics registry.
+
+A watchdog thread notices when the loop stops ticking altogether. Once a
+stall passes ``LOOP_MONITOR_STALL_THRESHOLD`` seconds it captures the stack
+of the loop thread, which shows the code that is blocking it, together
+with the task it runs in. The capture is logged, counted in
+``asgi.loop.stalls`` and kept in ``stalls``.
+
+With ``LOOP_MONITOR_DEBUG`` the loop also runs in asyncio debug mode, and
+every synchronous database access attempted on the loop thread is logged
+with its stack and counted in ``asgi.loop.sync_db``. Django refuses such
+access with ``SynchronousOnlyOperation``, but consumers catch broad
+exceptions, so the attempt is easy to miss otherwise.
+
+``LoopMonitorMiddleware`` wraps the ASGI application and starts the
+monitor on the loop serving it.
+"""
+
+import asyncio
+import functools
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import connections
+
+from chat_app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in milliseconds, of the buckets of the lag histogram
+LAG_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class LoopMonitor:
+    """
+    Measure the lag of the running event loop and capture what blocks it.
+
+    Args:
+        interval (float): Seconds between lag samples; defaults to ``LOOP_MONITOR_INTERVAL``.
+        threshold (float): Stall length that triggers a stack capture;
+            defaults to ``LOOP_MONITOR_STALL_THRESHOLD``.
+    """
+
+    def __init__(self, interval=None, threshold=None):
+        self.interval = interval
+        self.threshold = threshold
+        self.lag = 0.0
+        self.stalls = deque(maxlen=20)
+        self._loop = None
+        self._thread_id = None
+        self._task = None
+        self._watchdog = None
+        self._last_tick = 0.0
+        self._captured = False
+
+    def ensure_started(self):
+        """
+        Start monitoring the running loop unless it is already monitored.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and not self._task.done():
+            return
+        if self.interval is None:
+            self.interval = settings.LOOP_MONITOR_INTERVAL
+        if self.threshold is None:
+            self.threshold = settings.LOOP_MONITOR_STALL_THRESHOLD
+
+        self.lag = 0.0
+        self._loop = loop
+        self._thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._task = loop.create_task(self._run())
+        if self._watchdog is None:
+            self._watchdog = threading.Thread(target=self._watch, name='loop-monitor', daemon=True)
+            self._watchdog.start()
+        if settings.LOOP_MONITOR_DEBUG:
+            self.enable_debug(loop)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - start - self.interval)
+            self._last_tick = time.monotonic()
+            self._captured = False
+            metrics.histogram('asgi.loop.lag_ms', self.lag * 1000, LAG_BUCKETS_MS)
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval / 2)
+            loop = self._loop
+            if loop is None or not loop.is_running() or self._task.done():
+                continue
+            stalled = time.monotonic() - self._last_tick - self.interval
+            if stalled > self.threshold and not self._captured:
+                self._captured = True
+                self.capture(stalled)
+
+    def capture(self, stalled):
+        """
+        Record the stack of the loop thread while it is blocked.
+
+        Args:
+            stalled (float): Seconds the loop has been blocked so far.
+
+        Returns:
+            dict: The recorded stall, or None if the loop thread is gone.
+        """
+        frame = sys._current_frames().get(self._thread_id)
+        if frame is None:
+            return None
+        task = asyncio.current_task(self._loop)
+        stall = {
+            'at': datetime.now(timezone.utc).isoformat(),
+            'stalled_ms': stalled * 1000,
+            'task': task.get_name() if task else None,
+            'coroutine': getattr(task.get_coro(), '__qualname__', None) if task else None,
+            'stack': ''.join(traceback.format_stack(frame)),
+        }
+        self.stalls.append(stall)
+        metrics.incr('asgi.loop.stalls')
+        logger.warning(
+            'Event loop blocked for at least %.0f ms in %s:\n%s',
+            stall['stalled_ms'], stall['coroutine'] or 'a callback', stall['stack'],
+        )
+        return stall
+
+    def on_loop_thread(self):
+        """
+        Return True if called from the thread running the monitored loop.
+        """
+        return (
+            self._loop is not None and self._loop.is_running()
+            and threading.get_ident() == self._thread_id
+        )
+
+    def enable_debug(self, loop):
+        """
+        Run ``loop`` in asyncio debug mode and report sync DB access on it.
+        """
+        loop.set_debug(True)
+        loop.slow_callback_duration = self.threshold
+        for connection in connections.all():
+            _watch_database_access(type(connection))
+        _debug_monitors.add(self)
+
+    def disable_debug(self):
+        """
+        Stop reporting sync DB access on the monitored loop.
+        """
+        _debug_monitors.discard(self)
+
+
+# Monitors whose loop thread must not touch the database
+_debug_monitors = set()
+
+
+def _watch_database_access(wrapper_class):
+    """
+    Wrap the cursor methods of ``wrapper_class`` to report use on a monitored loop thread.
+    """
+    for name in ('cursor', 'chunked_cursor'):
+        method = getattr(wrapper_class, name)
+        if not getattr(method, 'watched_by_loop_monitor', False):
+            setattr(wrapper_class, name, _watched(method))
+
+
+def _watched(method):
+    @functools.wraps(method)
+    def watched(connection, *args, **kwargs):
+        if any(monitor.on_loop_thread() for monitor in _debug_monitors):
+            metrics.incr('asgi.loop.sync_db')
+            logger.warning(
+                'Synchronous database access on the event loop thread:\n%s',
+                ''.join(traceback.format_stack()[:-1]),
+            )
+        return method(connection, *args, **kwargs)
+
+    watched.watched_by_loop_monitor = True
+    return watched
+
+
+monitor = LoopMonitor()
+
+
+class LoopMonitorMiddleware:
+    """
+    ASGI middleware starting ``monitor`` on the loop that serves the application.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if settings.LOOP_MONITOR_ENABLED:
+            monitor.ensure_started()
+        return await self.app(scope, receive, send)
@@ -0,0 +1,143 @@
+"""Process-local counters and timings for runtime metrics.
+
+Code records values on the shared ``metrics`` registry::
+
+    metrics.incr('chat.sidebar.hits')
+    with metrics.timer('chat.sidebar.rebuild'):
+        ...
+    metrics.histogram('asgi.loop.lag_ms', 12.5, buckets=(1, 10, 100))
+
+and ``MetricsView`` (``GET /metrics/``, staff only) returns a snapshot as
+JSON. Values are kept per process and reset when the process restarts.
+"""
+
+import bisect
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+
+class Metrics:
+    """
+    Thread-safe registry of named counters, timings and histograms.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+        self._timings = {}
+        self._histograms = {}
+
+    def incr(self, name, amount=1):
+        """
+        Add ``amount`` to the counter ``name``.
+        """
+        with self._lock:
+            self._counters[name] += amount
+
+    def observe(self, name, seconds):
+        """
+        Record one duration, in seconds, for the timing ``name``.
+        """
+        with self._lock:
+            timing = self._timings.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0})
+            timing['count'] += 1
+            timing['total'] += seconds
+            timing['max'] = max(timing['max'], seconds)
+
+    def histogram(self, name, value, buckets):
+        """
+        Count ``value`` in the histogram ``name``.
+
+        Args:
+            buckets: Sorted upper bounds of the buckets, fixed by the first
+                call for ``name``; larger values fall in an overflow bucket.
+        """
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = {
+                    'bounds': tuple(buckets), 'counts': [0] * (len(buckets) + 1), 'count': 0, 'sum': 0.0,
+                }
+            histogram['counts'][bisect.bisect_left(histogram['bounds'], value)] += 1
+            histogram['count'] += 1
+            histogram['sum'] += value
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Time the enclosed block and record it with ``observe``.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def counter(self, name):
+        """
+        Return the current value of the counter ``name``.
+        """
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self):
+        """
+        Return all counters, timings and histograms as a JSON-serializable dict.
+
+        Timings are reported in milliseconds with their count, mean and max.
+        Histogram buckets are keyed by their upper bound (``le``), the last
+        one by ``+Inf``; counts are per bucket, not cumulative.
+        """
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'timings': {
+                    name: {
+                        'count': timing['count'],
+                        'mean_ms': timing['total'] / timing['count'] * 1000,
+                        'max_ms': timing['max'] * 1000,
+                    }
+                    for name, timing in self._timings.items()
+                },
+                'histograms': {
+                    name: {
+                        'count': histogram['count'],
+                        'sum': histogram['sum'],
+                        'buckets': dict(zip(
+                            [str(bound) for bound in histogram['bounds']] + ['+Inf'], histogram['counts'],
+                        )),
+                    }
+                    for name, histogram in self._histograms.items()
+                },
+            }
+
+    def reset(self):
+        """
+        Forget every recorded value.
+        """
+        with self._lock:
+            self._counters.clear()
+            self._timings.clear()
+            self._histograms.clear()
+
+
+metrics = Metrics()
+
+
+class MetricsView(APIView):
+    """
+    Return the metrics of the process serving the request.
+
+    API Endpoints:
+        GET /metrics/: Counters and timings, staff users only.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(metrics.snapshot())
@@ -0,0 +1,106 @@
+"""HTTP middleware shared by the whole project."""
+
+import cProfile
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.middleware.gzip import GZipMiddleware
+
+from chat_app import profiling
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Gzip responses worth compressing.
+
+    Django's ``GZipMiddleware`` compresses every response of 200 bytes or more.
+    This subclass only compresses responses whose content type is listed in
+    ``COMPRESSION_CONTENT_TYPES`` and, for regular responses, whose body is at
+    least ``COMPRESSION_MIN_SIZE`` bytes; small bodies cost more CPU than they
+    save on the wire, and images or archives are already compressed.
+
+    Streaming responses, sync or async, are compressed chunk by chunk as they
+    are sent, since their size is not known up front. Responses that support
+    byte ranges, such as attachment downloads, are never compressed.
+    """
+
+    def process_response(self, request, response):
+        # Byte ranges refer to the uncompressed body
+        if response.has_header('Content-Encoding') or response.has_header('Accept-Ranges'):
+            return response
+
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type not in settings.COMPRESSION_CONTENT_TYPES:
+            return response
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+
+        return super().process_response(request, response)
+
+
+class ProfilingMiddleware:
+    """
+    Run requests chosen by ``chat_app.profiling`` under ``cProfile``.
+
+    A request is profiled when a staff user sends the ``PROFILING_HEADER``
+    header, or at random with probability ``PROFILING_SAMPLE_RATE``. The
+    response of a header-triggered request names the saved profile in an
+    ``X-Profile-Id`` header.
+
+    The middleware removes itself at startup unless ``PROFILING_ENABLED`` is
+    set, so it costs nothing when profiling is off; it must come after
+    ``AuthenticationMiddleware``, which provides the user. It runs sync or
+    async, like the rest of the chain, so enabling it does not push async
+    views onto a thread. An async request is only profiled while it runs on
+    the event loop, as consumer handlers are.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        requested = settings.PROFILING_HEADER in request.headers and request.user.is_staff
+        if not requested and not profiling.sampled():
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        response = profiler.runcall(self.get_response, request)
+        duration = time.perf_counter() - start
+        return self.save_profile(request, request.user, profiler, response, requested, duration)
+
+    async def __acall__(self, request):
+        requested = settings.PROFILING_HEADER in request.headers and (await request.auser()).is_staff
+        if not requested and not profiling.sampled():
+            return await self.get_response(request)
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        response = await profiling._ProfiledCoroutine(self.get_response(request), profiler)
+        duration = time.perf_counter() - start
+        return self.save_profile(request, await request.auser(), profiler, response, requested, duration)
+
+    def save_profile(self, request, user, profiler, response, requested, duration):
+        match = request.resolver_match
+        profile_id = profiling.write_profile(profiler, 'http', match.view_name if match else request.path, {
+            'method': request.method,
+            'path': request.get_full_path(),
+            'user_id': user.id,
+            'status': response.status_code,
+            'trigger': 'header' if requested else 'sample',
+            'duration_ms': duration * 1000,
+        })
+        if requested:
+            response['X-Profile-Id'] = profile_id
+        return response
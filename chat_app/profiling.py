@@ -0,0 +1,142 @@
+"""Opt-in profiling of HTTP requests and WebSocket handlers.
+
+Nothing is profiled unless ``PROFILING_ENABLED`` is set. Then a request or
+socket event is run under ``cProfile`` when:
+
+- a staff user sends the ``PROFILING_HEADER`` header (for sockets, on the
+  handshake request: every event of that socket is profiled), or
+- it is picked at random, with probability ``PROFILING_SAMPLE_RATE``.
+
+Each profile is written to ``PROFILING_DIR`` as a ``.prof`` file, readable
+with ``pstats`` or snakeviz, next to a ``.json`` file with what was being
+served (path, user, status, duration). HTTP requests are profiled by
+``chat_app.middleware.ProfilingMiddleware``, consumer handlers by the
+``profile_handler`` decorator.
+
+A coroutine handler is only profiled while it runs: the profiler is paused
+whenever it awaits, so other tasks sharing the event loop stay out of its
+profile. Work it hands to a thread through ``sync_to_async`` is not
+included.
+"""
+
+import cProfile
+import functools
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+from chat_app.metrics import metrics
+
+
+def sampled():
+    """
+    Return True for a random ``PROFILING_SAMPLE_RATE`` share of calls.
+    """
+    rate = settings.PROFILING_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+
+def write_profile(profiler, kind, name, metadata):
+    """
+    Save ``profiler`` and its ``metadata`` to ``PROFILING_DIR``.
+
+    Args:
+        profiler (cProfile.Profile): A finished profile.
+        kind (str): ``http`` or ``websocket``.
+        name (str): What was profiled, e.g. a URL name or a handler.
+        metadata (dict): JSON-serializable details stored with the profile.
+
+    Returns:
+        str: Id of the profile, the stem of both file names.
+    """
+    directory = settings.PROFILING_DIR
+    directory.mkdir(parents=True, exist_ok=True)
+    now = datetime.now(timezone.utc)
+    slug = ''.join(c if c.isalnum() else '-' for c in name).strip('-')[:60]
+    profile_id = f"{now:%Y%m%dT%H%M%S}-{kind}-{slug}-{uuid.uuid4().hex[:8]}"
+
+    profiler.dump_stats(directory / f'{profile_id}.prof')
+    metadata = {'id': profile_id, 'kind': kind, 'name': name, 'created_at': now.isoformat(), **metadata}
+    with open(directory / f'{profile_id}.json', 'w') as file:
+        json.dump(metadata, file, indent=2, default=str)
+    metrics.incr(f'profiling.{kind}.written')
+    return profile_id
+
+
+class _ProfiledCoroutine:
+    """
+    Await ``coroutine`` with ``profiler`` enabled only while it runs.
+    """
+
+    def __init__(self, coroutine, profiler):
+        self.coroutine = coroutine
+        self.profiler = profiler
+
+    def __await__(self):
+        value, error = None, None
+        while True:
+            self.profiler.enable()
+            try:
+                if error is not None:
+                    step = self.coroutine.throw(error)
+                else:
+                    step = self.coroutine.send(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.profiler.disable()
+            try:
+                value, error = (yield step), None
+            except BaseException as exc:
+                value, error = None, exc
+
+
+def _requested_by_staff(scope):
+    header = settings.PROFILING_HEADER.lower().encode()
+    user = scope.get('user')
+    return (
+        user is not None and user.is_staff
+        and any(name == header for name, _ in scope.get('headers', ()))
+    )
+
+
+def profile_handler(name):
+    """
+    Decorate an async consumer handler so that it can be profiled.
+
+    Args:
+        name (str): Name the profiles are saved under, e.g. ``ChatConsumer.receive``.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(consumer, *args, **kwargs):
+            if not settings.PROFILING_ENABLED:
+                return await handler(consumer, *args, **kwargs)
+
+            requested = _requested_by_staff(consumer.scope)
+            if not requested and not sampled():
+                return await handler(consumer, *args, **kwargs)
+
+            profiler = cProfile.Profile()
+            start = time.perf_counter()
+            error = None
+            try:
+                return await _ProfiledCoroutine(handler(consumer, *args, **kwargs), profiler)
+            except Exception as exc:
+                error = repr(exc)
+                raise
+            finally:
+                user = consumer.scope.get('user')
+                write_profile(profiler, 'websocket', name, {
+                    'path': consumer.scope.get('path'),
+                    'user_id': getattr(user, 'id', None),
+                    'trigger': 'header' if requested else 'sample',
+                    'duration_ms': (time.perf_counter() - start) * 1000,
+                    'error': error,
+                })
+        return wrapper
+    return decorator
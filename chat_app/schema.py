@@ -0,0 +1,163 @@
+"""Precomputed OpenAPI schema.
+
+drf_yasg builds the schema by introspecting every viewset and serializer,
+which takes a noticeable amount of CPU per request. Instead, the schema is
+generated once into ``OPENAPI_SCHEMA_FILE``, a JSON file committed with the
+code and named after the API version, by the ``openapi_schema`` management
+command. Each process reads it on the first schema request, or generates it
+then if the file is missing, and serves it from memory with an ``ETag``.
+
+``openapi_schema --check`` fails when the committed file no longer matches
+what the code generates, so a change to the API cannot ship with a stale
+schema; the test suite runs the same check.
+
+drf_yasg is only imported when a schema is generated or a documentation
+page is first rendered, which keeps it out of the start-up of a worker.
+"""
+
+import functools
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views import View
+from rest_framework import permissions
+from rest_framework.response import Response
+
+
+@functools.cache
+def schema_info():
+    """
+    Return the ``openapi.Info`` describing the API.
+    """
+    from drf_yasg import openapi
+
+    # إعداد توثيق Swagger/OpenAPI
+    return openapi.Info(
+        title="Chat API",
+        default_version='v1',
+        description="API توثيق لتطبيق الدردشة",
+        terms_of_service="https://www.google.com/policies/terms/",
+        contact=openapi.Contact(email="contact@chat.local"),
+        license=openapi.License(name="BSD License"),
+    )
+
+
+def generate_schema():
+    """
+    Introspect the API and return its schema as JSON.
+
+    Returns:
+        bytes: The schema, pretty-printed; identical code gives identical bytes.
+    """
+    from drf_yasg.app_settings import swagger_settings
+    from drf_yasg.codecs import OpenAPICodecJson
+
+    generator = swagger_settings.DEFAULT_GENERATOR_CLASS(schema_info())
+    schema = generator.get_schema(request=None, public=True)
+    return OpenAPICodecJson(validators=[], pretty=True).encode(schema) + b'\n'
+
+
+def read_schema_file():
+    """
+    Return the contents of ``OPENAPI_SCHEMA_FILE``, or None if it does not exist.
+    """
+    try:
+        return settings.OPENAPI_SCHEMA_FILE.read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+class CachedSchema:
+    """
+    The schema of this process, encoded once per format.
+    """
+
+    def __init__(self, content):
+        self.json = content
+        self.etag = f'"{hashlib.sha256(content).hexdigest()[:32]}"'
+        self._yaml = None
+
+    @property
+    def yaml(self):
+        if self._yaml is None:
+            from drf_yasg.codecs import yaml_sane_dump
+
+            data = json.loads(self.json)
+            self._yaml = yaml_sane_dump(data, binary=True)
+        return self._yaml
+
+
+_schema = None
+_lock = threading.Lock()
+
+
+def get_schema():
+    """
+    Return the ``CachedSchema`` of this process, loading it on first use.
+    """
+    global _schema
+    if _schema is None:
+        with _lock:
+            if _schema is None:
+                _schema = CachedSchema(read_schema_file() or generate_schema())
+    return _schema
+
+
+def reset_schema():
+    """
+    Forget the loaded schema; the next request loads it again.
+    """
+    global _schema
+    _schema = None
+
+
+class SchemaView(View):
+    """
+    Serve the precomputed schema as JSON or YAML.
+
+    API Endpoints:
+        GET /swagger.json, GET /swagger.yaml: The schema, with an ETag; a
+            matching If-None-Match is answered with 304 Not Modified.
+    """
+
+    def get(self, request, format='.json'):
+        schema = get_schema()
+        response = get_conditional_response(request, etag=schema.etag)
+        if response is None:
+            if format == '.yaml':
+                response = HttpResponse(schema.yaml, content_type='application/yaml; charset=utf-8')
+            else:
+                response = HttpResponse(schema.json, content_type='application/json')
+        response['ETag'] = schema.etag
+        # Clients may keep the schema but revalidate it, which costs a 304
+        patch_cache_control(response, public=True, no_cache=True)
+        return response
+
+
+@functools.cache
+def _ui_view(renderer):
+    from drf_yasg import openapi
+    from drf_yasg.views import get_schema_view
+
+    base_view = get_schema_view(schema_info(), public=True, permission_classes=(permissions.AllowAny,))
+
+    class SchemaUIView(base_view):
+        def get(self, request, version='', format=None):
+            return Response(openapi.Swagger(info=schema_info(), _prefix='/', paths=openapi.Paths({})))
+
+    return SchemaUIView.with_ui(renderer, cache_timeout=0)
+
+
+def schema_ui(request, renderer):
+    """
+    Swagger UI (``renderer='swagger'``) and ReDoc pages that load the schema from ``SchemaView``.
+
+    The pages only need the title and version of the API, so they are
+    rendered from ``schema_info()`` without introspecting the API; the
+    ``SPEC_URL`` settings point the pages at ``/swagger.json``.
+    """
+    return _ui_view(renderer)(request)
@@ -0,0 +1,70 @@
+"""Daphne server with WebSocket permessage-deflate compression.
+
+Daphne does not negotiate the permessage-deflate extension (RFC 7692), so
+chat frames go out uncompressed. Start the server through this module
+instead of the ``daphne`` script to compress them; it accepts the same
+arguments::
+
+    python -m chat_app.server -b 0.0.0.0 -p 8000 chat_app.asgi:application
+
+Compression is controlled by the ``WEBSOCKET_DEFLATE*`` settings.
+"""
+
+from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+from daphne.cli import CommandLineInterface as DaphneCommandLineInterface
+from daphne.server import Server as DaphneServer
+from django.conf import settings
+
+
+def accept_permessage_deflate(offers):
+    """
+    Pick the permessage-deflate offer of a client, if any.
+
+    The server window size and memory level come from the settings, which
+    bounds the zlib memory kept per connection.
+
+    Args:
+        offers (list): Extension offers parsed from the handshake.
+
+    Returns:
+        PerMessageDeflateOfferAccept: The accepted offer, or None to disable compression.
+    """
+    if not settings.WEBSOCKET_DEFLATE:
+        return None
+
+    for offer in offers:
+        if not isinstance(offer, PerMessageDeflateOffer):
+            continue
+        window_bits = settings.WEBSOCKET_DEFLATE_WINDOW_BITS
+        if offer.request_max_window_bits:
+            window_bits = min(window_bits, offer.request_max_window_bits)
+        return PerMessageDeflateOfferAccept(
+            offer,
+            window_bits=window_bits,
+            mem_level=settings.WEBSOCKET_DEFLATE_MEM_LEVEL,
+        )
+    return None
+
+
+class Server(DaphneServer):
+    """
+    Daphne server whose WebSocket factory accepts permessage-deflate.
+    """
+
+    @property
+    def ws_factory(self):
+        return self._ws_factory
+
+    @ws_factory.setter
+    def ws_factory(self, factory):
+        # Daphne creates the factory in run(); configure it as it is assigned.
+        factory.setProtocolOptions(perMessageCompressionAccept=accept_permessage_deflate)
+        self._ws_factory = factory
+
+
+class CommandLineInterface(DaphneCommandLineInterface):
+    server_class = Server
+
+
+if __name__ == '__main__':
+    CommandLineInterface.entrypoint()
@@ -47,6 +47,17 @@ ALLOWED_HOSTS = []
 GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
 GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET')
 
+# Google OAuth endpoints and HTTP client settings used by users.oauth
+GOOGLE_OAUTH_TOKEN_URL = 'https://oauth2.googleapis.com/token'
+GOOGLE_OAUTH_USERINFO_URL = 'https://www.googleapis.com/oauth2/v3/userinfo'
+GOOGLE_OAUTH_CERTS_URL = 'https://www.googleapis.com/oauth2/v1/certs'
+GOOGLE_OAUTH_TIMEOUT = 5  # Seconds per request to Google
+GOOGLE_OAUTH_POOL_SIZE = 10  # Keep-alive connections kept per host
+GOOGLE_OAUTH_CERTS_TTL = 300  # Fallback cert cache lifetime when Google sends no max-age
+GOOGLE_OAUTH_CERTS_REFRESH_INTERVAL = 60  # Least seconds between cert refetches forced by tokens with an unknown key id
+GOOGLE_OAUTH_MAX_CONCURRENCY = 20  # Requests to Google in flight at once per event loop (async views)
+GOOGLE_OAUTH_DB_WORKERS = 4  # Threads used by the async views for user lookups
+
 # Application definition
 
 
@@ -73,7 +84,7 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
@@ -91,14 +102,74 @@ REST_FRAMEWORK = {
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'chat_app.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',  # يمكن تجاوزه باستخدام @csrf_exempt
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'chat_app.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware', 
 ]
+
+# Event-loop lag monitor of the ASGI process (see chat_app/loopmonitor.py)
+LOOP_MONITOR_ENABLED = True
+LOOP_MONITOR_INTERVAL = 0.1  # Seconds between lag samples
+LOOP_MONITOR_STALL_THRESHOLD = 0.25  # Seconds the loop may be blocked before its stack is captured
+LOOP_MONITOR_DEBUG = os.environ.get('LOOP_MONITOR_DEBUG') == '1'  # Also flag sync DB access on the loop thread
+
+# OpenAPI schema, generated by the openapi_schema command (see chat_app/schema.py)
+OPENAPI_SCHEMA_FILE = BASE_DIR / 'chat_app' / 'openapi-v1.json'
+SWAGGER_SETTINGS = {
+    'SPEC_URL': ('schema-json', {'format': '.json'}),  # The UI loads the precomputed schema
+}
+REDOC_SETTINGS = {
+    'SPEC_URL': ('schema-json', {'format': '.json'}),
+}
+
+# Worker start-up, checked by the bench_startup command
+STARTUP_IMPORT_BUDGET_MS = 1500  # Median time allowed to import chat_app.asgi.application and the URLconf
+STARTUP_DEFERRED_MODULES = [  # Imported on first use only; bench_startup fails if start-up loads them
+    'google.auth',
+    'google.oauth2',
+    'httpx',
+    'drf_yasg.views',
+    'drf_yasg.codecs',
+]
+
+# On-demand profiling (see chat_app/profiling.py); off unless PROFILING_ENABLED is set
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED') == '1'
+PROFILING_HEADER = 'X-Profile'  # Staff requests and socket handshakes with this header are profiled
+PROFILING_SAMPLE_RATE = 0.0  # Share (0-1) of requests and socket events profiled at random
+PROFILING_DIR = BASE_DIR / 'profiles'  # Where .prof files and their .json metadata are written
+
+# Response compression (see chat_app/middleware.py)
+COMPRESSION_MIN_SIZE = 1024  # Responses smaller than this many bytes are sent uncompressed
+COMPRESSION_CONTENT_TYPES = [  # Only these content types are compressed
+    'application/json',
+    'application/x-ndjson',
+    'application/javascript',
+    'text/csv',
+    'text/css',
+    'text/html',
+    'text/javascript',
+    'text/plain',
+    'image/svg+xml',
+]
+
+# WebSocket permessage-deflate, used when serving through chat_app.server
+WEBSOCKET_DEFLATE = True
+WEBSOCKET_DEFLATE_WINDOW_BITS = 11  # 2 KB compression window; larger windows cost more memory per connection
+WEBSOCKET_DEFLATE_MEM_LEVEL = 4  # zlib memory level (1-9) for each connection's compressor
+
+# WebSocket admission control, per process (see chat_app/admission.py); None disables a check
+WEBSOCKET_MAX_CONNECTIONS = 10000  # Open sockets beyond which new handshakes are refused
+WEBSOCKET_HANDSHAKE_RATE = 200  # Handshakes per second accepted on average
+WEBSOCKET_HANDSHAKE_BURST = 500  # Handshakes accepted at once before the rate applies
+WEBSOCKET_MAX_LOOP_LAG = 0.5  # Seconds of event-loop lag beyond which new handshakes are refused
+WEBSOCKET_RETRY_AFTER = 5  # Seconds a refused client is asked to wait before reconnecting
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:8000",
     "http://127.0.0.1:8000",
@@ -127,25 +198,74 @@ TEMPLATES = [
 ]
 ASGI_APPLICATION = 'chat_app.asgi.application'
 
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-    },
-}
+# The in-memory layer only reaches sockets of the same process. Set REDIS_URL
+# (needs channels_redis) to run several workers, e.g. with bench_cluster.
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [REDIS_URL]},
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Cache used for the chat sidebar and replica stickiness. Use a shared backend
+# (Redis, Memcached) in production so that every worker sees the same entries.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+CHAT_SIDEBAR_CACHE_TTL = 300  # Seconds a cached chat sidebar is kept (see chat/sidebar.py)
+ROOM_MEMBERS_CACHE_TTL = 300  # Seconds the member ids of a room are cached (see chat/rooms.py)
+PENDING_DELIVERY_MAX = 200  # Most unacknowledged messages replayed when a user connects (see chat/delivery.py)
+PENDING_DELIVERY_TTL = 7 * 24 * 3600  # Seconds after which an unacknowledged message is no longer replayed
+SSE_REPLAY_MAX = 200  # Most messages of each kind replayed when an event stream resumes (see chat/sse.py)
+SSE_RESUME_WINDOW = 5  # Seconds an event id keeps listing the ids just sent, so lower ids published late are replayed
+SSE_KEEPALIVE_INTERVAL = 15  # Seconds of silence after which an event stream sends a comment to keep proxies open
+SSE_MAX_DURATION = 600  # Seconds after which an event stream is closed; the client resumes with Last-Event-ID
+SSE_RETRY_MS = 3000  # Reconnection delay sent to EventSource clients
+ACTIVITY_CHUNK_SIZE = 100000  # Messages read per query by the activity report (see chat/activity.py)
+ACTIVITY_CACHE_TIMEOUT = 3600  # Seconds an activity report is cached for the staff endpoint
+IDEMPOTENCY_KEY_TTL = 24 * 3600  # Seconds a client idempotency key is kept before purge_idempotency_keys removes it
+
+# Message history storage (see chat/partitions.py and chat/archive.py)
+MESSAGE_PARTITION_MONTHS_AHEAD = 3  # Monthly partitions created ahead of time by partition_messages
+MESSAGE_ARCHIVE_DIR = BASE_DIR / 'archive'  # Where archive_messages writes compressed NDJSON files
+MESSAGE_PURGE_RETENTION_DAYS = 30  # Days a soft-deleted message is kept before purge_deleted_messages removes it
+ATTACHMENT_DIR = BASE_DIR / 'attachments'  # Content-addressed storage of uploaded message attachments
+ATTACHMENT_MAX_SIZE = 25 * 1024 * 1024  # Largest accepted attachment, in bytes
+ATTACHMENT_CHUNK_SIZE = 64 * 1024  # Bytes read per chunk when streaming an attachment download
+
+MESSAGE_EXPORT_CHUNK_SIZE = 2000  # Rows fetched per database round trip when exporting messages
+
 
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'chatApp',
+        'NAME': os.environ.get('DATABASE_NAME', 'chatApp'),
         'USER': 'postgres',
         'PASSWORD': 'root',
         'HOST': 'localhost',
         'PORT': '5432',
     }
 }
+
+# Read replicas used by chat_app.db_router.ReplicaRouter. Add each replica to
+# DATABASES and list its alias here; with no replicas every query goes to default.
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ['chat_app.db_router.ReplicaRouter']
+REPLICA_STICKY_SECONDS = 5  # Reads of a user stay on the primary this long after they write
+REPLICA_MAX_LAG_SECONDS = 10  # Replicas further behind than this are skipped
+REPLICA_LAG_CHECK_INTERVAL = 1  # Seconds between replication lag checks per replica
 # WSGI_APPLICATION = 'chat_app.wsgi.application'
 
 # Password validation
@@ -219,3 +339,8 @@ SIMPLE_JWT = {
 
     'JTI_CLAIM': 'jti',
 }
+
+# Process-local cache used by users.authentication.CachedJWTAuthentication
+JWT_USER_CACHE_SIZE = 1024  # Maximum number of cached users per process
+JWT_USER_CACHE_TTL = 60  # Seconds before a cached user is reloaded from the database
+
@@ -16,31 +16,18 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include, re_path
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
 
-# إعداد توثيق Swagger/OpenAPI
-schema_view = get_schema_view(
-    openapi.Info(
-        title="Chat API",
-        default_version='v1',
-        description="API توثيق لتطبيق الدردشة",
-        terms_of_service="https://www.google.com/policies/terms/",
-        contact=openapi.Contact(email="contact@chat.local"),
-        license=openapi.License(name="BSD License"),
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
+from .metrics import MetricsView
+from .schema import SchemaView, schema_ui
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('users/', include('users.urls')),
     path('', include('chat.urls')),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 
-    # مسارات توثيق Swagger/OpenAPI
-    re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=0), name='schema-json'),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    # مسارات توثيق Swagger/OpenAPI (المخطط محسوب مسبقاً، انظر chat_app/schema.py)
+    re_path(r'^swagger(?P<format>\.json|\.yaml)$', SchemaView.as_view(), name='schema-json'),
+    path('swagger/', schema_ui, {'renderer': 'swagger'}, name='schema-swagger-ui'),
+    path('redoc/', schema_ui, {'renderer': 'redoc'}, name='schema-redoc'),
 ]
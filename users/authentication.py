@@ -0,0 +1,158 @@
+"""Authentication classes for the REST API.
+
+This module contains ``CachedJWTAuthentication``, a drop-in replacement for
+``rest_framework_simplejwt.authentication.JWTAuthentication`` that keeps a
+small process-local cache of ``CustomUser`` rows so that an authenticated API
+request does not have to load the user from the database every time.
+
+Entries are evicted when the user is saved or deleted (see ``users.signals``)
+and expire after ``JWT_USER_CACHE_TTL`` seconds, which bounds how long another
+process can serve a stale copy.
+"""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+class UserCache:
+    """
+    Thread-safe LRU cache with a per-entry time-to-live.
+
+    Attributes:
+        maxsize (int): Maximum number of entries kept before the least recently
+            used one is evicted.
+        ttl (float): Number of seconds an entry stays valid.
+        hits (int): Number of successful lookups.
+        misses (int): Number of lookups that found nothing or an expired entry.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the cached value for ``key`` or None if missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """
+        Store ``value`` under ``key``, evicting the oldest entries if full.
+        """
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """
+        Drop the entry for ``key`` if present.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Drop every entry and reset the hit/miss counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+user_cache = UserCache(
+    maxsize=getattr(settings, 'JWT_USER_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'JWT_USER_CACHE_TTL', 60),
+)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that resolves the token's user through ``user_cache``.
+
+    The first request for a user loads it through the stock simplejwt code
+    path (one query); later requests carrying a token for the same user are
+    answered from memory until the entry expires or the user is changed.
+    The active-user and revoked-token checks still run on every request.
+    """
+
+    def get_user(self, validated_token):
+        """
+        Return the user identified by ``validated_token``.
+
+        Args:
+            validated_token: A validated simplejwt token.
+
+        Returns:
+            CustomUser: A private copy of the cached user instance.
+
+        Raises:
+            InvalidToken: If the token has no user identification claim.
+            AuthenticationFailed: If the user is missing, inactive or changed
+                their password since the token was issued.
+        """
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        user = user_cache.get(str(user_id))
+        if user is None:
+            user = super().get_user(validated_token)
+            user_cache.set(str(user_id), user)
+        else:
+            self.check_user(user, validated_token)
+
+        # Each request gets its own instance so that a view mutating
+        # request.user cannot leak state into concurrent requests.
+        return copy.copy(user)
+
+    def check_user(self, user, validated_token):
+        """
+        Repeat simplejwt's per-request checks against a cached user.
+        """
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(
+                    _("The user's password has been changed."), code="password_changed"
+                )
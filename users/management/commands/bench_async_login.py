@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chat_app.benchmark import format_stats, scratch_database, summarize
+from users.models import CustomUser
+from users.testing import FakeGoogleOAuthServer
+
+
+class Command(BaseCommand):
+    help = ('Load test: message API latency while Google logins are in flight, '
+            'with the sync and the async login views')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=20, help='Number of concurrent logins')
+        parser.add_argument('--probes', type=int, default=50, help='Number of message API requests')
+        parser.add_argument('--latency', type=float, default=0.2,
+                            help='Simulated round-trip time of the OAuth server in seconds')
+
+    def handle(self, *args, **options):
+        with scratch_database(), FakeGoogleOAuthServer(latency=options['latency']) as server:
+            with override_settings(**server.settings()):
+                reader = CustomUser.objects.create_user(username='bench_reader', password='bench-pass')
+                access_token = str(AccessToken.for_user(reader))
+
+                for label, login_path in (
+                    ('no logins', None),
+                    ('GoogleLoginView', '/users/api/auth/google/'),
+                    ('AsyncGoogleLoginView', '/users/api/auth/google/async/'),
+                ):
+                    probes, elapsed = asyncio.run(
+                        self.run_phase(server, login_path, access_token, options['logins'], options['probes'])
+                    )
+                    self.stdout.write(format_stats(f'/api/messages/ ({label})', probes))
+                    if login_path:
+                        self.stdout.write(f"{'':<32} {options['logins']} logins done in {elapsed:.2f} s")
+
+    async def run_phase(self, server, login_path, access_token, num_logins, num_probes):
+        client = AsyncClient()
+        samples = []
+
+        # Access tokens make every login wait for a userinfo round trip.
+        tokens = [server.issue_access_token(f'bench{i}@example.com') for i in range(num_logins)]
+
+        async def login(token):
+            response = await client.post(login_path, {'token': token})
+            assert response.status_code == 200, response.content
+
+        async def probe():
+            for _ in range(num_probes):
+                start = time.perf_counter()
+                response = await client.get('/api/messages/', headers={'Authorization': f'Bearer {access_token}'})
+                samples.append(time.perf_counter() - start)
+                assert response.status_code == 200, response.status_code
+                await asyncio.sleep(0.005)
+
+        start = time.perf_counter()
+        logins = [login(token) for token in tokens] if login_path else []
+        await asyncio.gather(probe(), *logins)
+        return summarize(samples), time.perf_counter() - start
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+
+from chat_app.benchmark import format_stats, measure, scratch_database
+from users.oauth import reset_oauth_client
+from users.testing import FakeGoogleOAuthServer
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks Google login latency against a local stand-in OAuth server, cold and warm'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Number of timed logins per run')
+        parser.add_argument('--latency', type=float, default=0.02,
+                            help='Simulated round-trip time of the OAuth server in seconds')
+
+    def handle(self, *args, **options):
+        with scratch_database(), FakeGoogleOAuthServer(latency=options['latency']) as server:
+            with override_settings(**server.settings()):
+                client = Client()
+                id_token = server.issue_id_token('bench@example.com')
+                access_token = server.issue_access_token('bench@example.com')
+
+                def login(token):
+                    response = client.post('/users/api/auth/google/', {'token': token})
+                    assert response.status_code == 200, response.content
+
+                def cold_login():
+                    # A fresh client has no cached certs and no open connections.
+                    reset_oauth_client()
+                    login(id_token)
+
+                runs = (
+                    ('id token, cold caches', cold_login),
+                    ('id token, warm caches', lambda: login(id_token)),
+                    ('access token, warm pool', lambda: login(access_token)),
+                )
+                for label, func in runs:
+                    self.stdout.write(format_stats(label, measure(func, options['requests'])))
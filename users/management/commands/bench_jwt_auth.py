@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.test import Client
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from chat.models import Message
+from chat.views import MessageViewSet
+from chat_app.benchmark import format_stats, measure, scratch_database
+from users.authentication import CachedJWTAuthentication, user_cache
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks /api/messages/ requests/sec with stock and cached JWT authentication'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Number of timed requests per run')
+        parser.add_argument('--messages', type=int, default=50, help='Number of messages to seed')
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            token = self.seed(options['messages'])
+            client = Client(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+            def fetch():
+                response = client.get('/api/messages/')
+                assert response.status_code == 200, response.status_code
+
+            original = MessageViewSet.authentication_classes
+            try:
+                for label, auth_class in (
+                    ('JWTAuthentication', JWTAuthentication),
+                    ('CachedJWTAuthentication', CachedJWTAuthentication),
+                ):
+                    MessageViewSet.authentication_classes = [auth_class]
+                    user_cache.clear()
+                    stats = measure(fetch, options['requests'])
+                    self.stdout.write(format_stats(label, stats))
+            finally:
+                MessageViewSet.authentication_classes = original
+
+    def seed(self, num_messages):
+        sender = CustomUser.objects.create_user(username='bench_sender', password='bench-pass')
+        receiver = CustomUser.objects.create_user(username='bench_receiver', password='bench-pass')
+        Message.objects.bulk_create([
+            Message(sender=sender, receiver=receiver, content=f'Benchmark message {i}')
+            for i in range(num_messages)
+        ])
+        return str(RefreshToken.for_user(sender).access_token)
@@ -0,0 +1,153 @@
+"""Shared Google OAuth client.
+
+All outgoing calls to Google made by the users app go through the
+``GoogleOAuthClient`` returned by ``get_oauth_client()``:
+
+- HTTP requests share one ``requests.Session`` with a keep-alive connection
+  pool, and every request has a timeout.
+- Google's ID-token signing certificates are cached for as long as the
+  ``Cache-Control: max-age`` header of the certs response allows, and are
+  re-fetched early only when a token is signed with an unknown key id.
+
+``AsyncGoogleOAuthClient`` offers the same calls for the async login views:
+it uses one ``httpx.AsyncClient`` per event loop and bounds the number of
+requests in flight to Google.
+
+Endpoint URLs, timeout and pool size come from the ``GOOGLE_OAUTH_*``
+settings so that tests and benchmarks can point the client at a local
+stand-in server (see ``users.testing``).
+
+The clients live in ``users.oauth_clients``, which is imported on first use
+so that google-auth, requests and httpx stay out of processes that never
+talk to Google; importing this module is cheap.
+"""
+
+import asyncio
+import re
+import threading
+import weakref
+
+from django.conf import settings
+
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+_MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+
+class OAuthError(ValueError):
+    """
+    Raised when Google rejects a request or returns an unusable response.
+    """
+
+
+def cache_lifetime(headers, default):
+    """
+    Return how many seconds a response may be cached for.
+
+    Args:
+        headers: Response headers (case-insensitive mapping).
+        default (int): Lifetime used when the response sets no ``max-age``.
+
+    Returns:
+        int: Number of seconds, 0 if the response must not be cached.
+    """
+    cache_control = headers.get('Cache-Control', '').lower()
+    if 'no-store' in cache_control or 'no-cache' in cache_control:
+        return 0
+
+    match = _MAX_AGE_RE.search(cache_control)
+    if not match:
+        return default
+
+    age = int(headers.get('Age', 0) or 0)
+    return max(int(match.group(1)) - age, 0)
+
+
+_client = None
+_client_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+_closing = set()  # Tasks closing async clients, referenced until they finish
+
+
+def get_oauth_client():
+    """
+    Return the process-wide ``GoogleOAuthClient`` built from settings.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from .oauth_clients import GoogleOAuthClient
+
+                _client = GoogleOAuthClient(
+                    client_id=settings.GOOGLE_CLIENT_ID,
+                    client_secret=settings.GOOGLE_CLIENT_SECRET,
+                    token_url=settings.GOOGLE_OAUTH_TOKEN_URL,
+                    userinfo_url=settings.GOOGLE_OAUTH_USERINFO_URL,
+                    certs_url=settings.GOOGLE_OAUTH_CERTS_URL,
+                    timeout=settings.GOOGLE_OAUTH_TIMEOUT,
+                    pool_size=settings.GOOGLE_OAUTH_POOL_SIZE,
+                    certs_ttl=settings.GOOGLE_OAUTH_CERTS_TTL,
+                    certs_refresh_interval=settings.GOOGLE_OAUTH_CERTS_REFRESH_INTERVAL,
+                )
+    return _client
+
+
+def get_async_oauth_client():
+    """
+    Return the ``AsyncGoogleOAuthClient`` for the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        from .oauth_clients import AsyncGoogleOAuthClient
+
+        client = _async_clients[loop] = AsyncGoogleOAuthClient(
+            client_id=settings.GOOGLE_CLIENT_ID,
+            client_secret=settings.GOOGLE_CLIENT_SECRET,
+            token_url=settings.GOOGLE_OAUTH_TOKEN_URL,
+            userinfo_url=settings.GOOGLE_OAUTH_USERINFO_URL,
+            certs_url=settings.GOOGLE_OAUTH_CERTS_URL,
+            timeout=settings.GOOGLE_OAUTH_TIMEOUT,
+            pool_size=settings.GOOGLE_OAUTH_POOL_SIZE,
+            max_concurrency=settings.GOOGLE_OAUTH_MAX_CONCURRENCY,
+            certs_ttl=settings.GOOGLE_OAUTH_CERTS_TTL,
+            certs_refresh_interval=settings.GOOGLE_OAUTH_CERTS_REFRESH_INTERVAL,
+        )
+    return client
+
+
+def _close_async_client(loop, client):
+    """
+    Close ``client`` on ``loop``, the event loop that owns its connections.
+
+    A client whose loop is already closed cannot be closed any more; its
+    connections are released when it is garbage collected.
+    """
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+
+    if loop is running:
+        task = loop.create_task(client.aclose())
+        _closing.add(task)
+        task.add_done_callback(_closing.discard)
+    elif loop.is_running():
+        asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+    elif not loop.is_closed():
+        loop.run_until_complete(client.aclose())
+
+
+def reset_oauth_client():
+    """
+    Close the process-wide clients so the next call rebuilds them from settings.
+    """
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
+        for loop, client in list(_async_clients.items()):
+            _close_async_client(loop, client)
+        _async_clients.clear()
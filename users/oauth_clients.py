@@ -0,0 +1,347 @@
+"""Google OAuth clients.
+
+Kept apart from ``users.oauth`` because google-auth, requests and httpx add
+noticeably to the import time of a worker while most processes never log
+anyone in: ``users.oauth`` imports this module on the first call to
+``get_oauth_client()`` or ``get_async_oauth_client()``.
+"""
+
+import asyncio
+import json
+import threading
+import time
+
+import httpx
+import requests
+from google.auth import jwt
+from google.auth.transport import requests as google_requests
+from google.oauth2 import id_token
+from requests.adapters import HTTPAdapter
+
+from .oauth import GOOGLE_ISSUERS, OAuthError, cache_lifetime
+
+
+class CachingTransport(google_requests.Request):
+    """
+    google-auth transport that reuses a pooled session and caches cert responses.
+
+    Only GET requests to one of ``cacheable_urls`` are cached; everything else
+    is passed straight through to the shared session.
+    """
+
+    def __init__(self, session, cacheable_urls, default_ttl, timeout, clock=time.monotonic):
+        super().__init__(session=session)
+        self.cacheable_urls = set(cacheable_urls)
+        self.default_ttl = default_ttl
+        self.timeout = timeout
+        self._clock = clock
+        self._cache = {}
+
+    def __call__(self, url, method='GET', body=None, headers=None, timeout=None, **kwargs):
+        cacheable = method == 'GET' and url in self.cacheable_urls
+        if cacheable:
+            cached = self._cache.get(url)
+            if cached and cached[0] > self._clock():
+                return cached[1]
+
+        response = super().__call__(
+            url, method=method, body=body, headers=headers, timeout=timeout or self.timeout, **kwargs
+        )
+
+        if cacheable and response.status == 200:
+            lifetime = cache_lifetime(response.headers, self.default_ttl)
+            if lifetime > 0:
+                self._cache[url] = (self._clock() + lifetime, response)
+        return response
+
+    def cached_data(self, url):
+        """
+        Return the raw body of a cached, unexpired response for ``url`` or None.
+        """
+        cached = self._cache.get(url)
+        if cached and cached[0] > self._clock():
+            return cached[1].data
+        return None
+
+    def invalidate(self, url):
+        """
+        Forget the cached response for ``url``.
+        """
+        self._cache.pop(url, None)
+
+
+class GoogleOAuthClient:
+    """
+    Client for the Google OAuth endpoints used by the login views.
+
+    Attributes:
+        client_id (str): OAuth client id, also the expected ID-token audience.
+        client_secret (str): OAuth client secret used for code exchange.
+        token_url (str): Authorization-code exchange endpoint.
+        userinfo_url (str): OpenID Connect userinfo endpoint.
+        certs_url (str): ID-token signing certificates endpoint.
+        timeout (float): Timeout in seconds applied to every request.
+        certs_refresh_interval (float): Least number of seconds between two
+            cert refetches forced by tokens with an unknown key id.
+    """
+
+    def __init__(self, client_id, client_secret, token_url, userinfo_url, certs_url,
+                 timeout=5, pool_size=10, certs_ttl=300, certs_refresh_interval=60, clock=time.monotonic):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token_url = token_url
+        self.userinfo_url = userinfo_url
+        self.certs_url = certs_url
+        self.timeout = timeout
+        self.certs_refresh_interval = certs_refresh_interval
+        self._clock = clock
+        self._last_forced_refresh = None
+        self._refresh_lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.transport = CachingTransport(self.session, [certs_url], certs_ttl, timeout, clock=clock)
+
+    def verify_id_token(self, token):
+        """
+        Verify a Google ID token and return its claims.
+
+        Args:
+            token (str): The encoded ID token.
+
+        Returns:
+            dict: The verified token claims.
+
+        Raises:
+            ValueError: If the token is malformed, expired, signed with an
+                unknown key, issued for another audience or by another issuer.
+        """
+        kid = jwt.decode_header(token).get('kid')
+        if kid and not self._knows_key(kid) and self._may_force_refresh():
+            # Google rotates its signing keys; a token signed with a key we
+            # have not seen yet means the cached certs are out of date.
+            # Otherwise the token is rejected below without a refetch.
+            self.transport.invalidate(self.certs_url)
+
+        id_info = id_token.verify_token(
+            token, self.transport, audience=self.client_id, certs_url=self.certs_url
+        )
+        if id_info.get('iss') not in GOOGLE_ISSUERS:
+            raise ValueError('Invalid issuer.')
+        return id_info
+
+    def fetch_userinfo(self, access_token):
+        """
+        Fetch the OpenID Connect profile belonging to an access token.
+
+        Raises:
+            OAuthError: If Google does not return the profile.
+        """
+        response = self.session.get(
+            self.userinfo_url,
+            headers={'Authorization': f'Bearer {access_token}'},
+            timeout=self.timeout,
+        )
+        if not response.ok:
+            raise OAuthError(f"Failed to get user info: {response.status_code} - {response.text}")
+        return response.json()
+
+    def exchange_code(self, code, redirect_uri):
+        """
+        Exchange an authorization code for tokens.
+
+        Raises:
+            OAuthError: If Google rejects the code.
+        """
+        response = self.session.post(
+            self.token_url,
+            data={
+                'code': code,
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'redirect_uri': redirect_uri,
+                'grant_type': 'authorization_code',
+            },
+            timeout=self.timeout,
+        )
+        if not response.ok:
+            raise OAuthError(f"Failed to exchange code for token: {response.status_code} - {response.text}")
+        return response.json()
+
+    def close(self):
+        """
+        Close the pooled connections.
+        """
+        self.session.close()
+
+    def _may_force_refresh(self):
+        """
+        Return True if a refetch forced by an unknown key id is allowed now.
+
+        The key id comes from a header nobody has verified yet, so anyone
+        can send random ones; refetches are limited to one per
+        ``certs_refresh_interval`` seconds.
+        """
+        with self._refresh_lock:
+            now = self._clock()
+            if self._last_forced_refresh is not None and now - self._last_forced_refresh < self.certs_refresh_interval:
+                return False
+            self._last_forced_refresh = now
+            return True
+
+    def _knows_key(self, kid):
+        data = self.transport.cached_data(self.certs_url)
+        if data is None:
+            return True  # Nothing cached yet, the next fetch is fresh anyway.
+        certs = json.loads(data)
+        if 'keys' in certs:
+            return any(key.get('kid') == kid for key in certs['keys'])
+        return kid in certs
+
+
+class AsyncGoogleOAuthClient:
+    """
+    Asyncio counterpart of ``GoogleOAuthClient``.
+
+    Requests share one ``httpx.AsyncClient`` connection pool and at most
+    ``max_concurrency`` of them are in flight at once. Certificates are cached
+    the same way as in the sync client; concurrent refreshes are collapsed
+    into a single fetch. Google's x509 certs format (``/oauth2/v1/certs``) is
+    expected.
+
+    Tokens with an unknown key id force a refetch at most once per
+    ``certs_refresh_interval`` seconds, as in the sync client.
+
+    An instance is bound to the event loop it was created on; use
+    ``get_async_oauth_client()`` to get the one for the running loop.
+    """
+
+    def __init__(self, client_id, client_secret, token_url, userinfo_url, certs_url,
+                 timeout=5, pool_size=10, max_concurrency=20, certs_ttl=300, certs_refresh_interval=60,
+                 clock=time.monotonic):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token_url = token_url
+        self.userinfo_url = userinfo_url
+        self.certs_url = certs_url
+        self.certs_ttl = certs_ttl
+        self.certs_refresh_interval = certs_refresh_interval
+        self._last_forced_refresh = None
+
+        self.http = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._clock = clock
+        self._certs = None
+        self._certs_lock = asyncio.Lock()
+
+    async def request(self, method, url, **kwargs):
+        """
+        Send a request through the shared pool, waiting for a free slot first.
+        """
+        async with self._semaphore:
+            return await self.http.request(method, url, **kwargs)
+
+    async def get_certs(self, outdated=None):
+        """
+        Return the signing certs, fetching them if the cached copy is stale.
+
+        Args:
+            outdated (dict): A certs mapping the caller found to be out of
+                date; it is re-fetched even if its cache entry is still fresh.
+        """
+        if self._certs_fresh() and self._certs[1] is not outdated:
+            return self._certs[1]
+
+        async with self._certs_lock:
+            # Another coroutine may have refreshed the certs while we waited.
+            if self._certs_fresh() and self._certs[1] is not outdated:
+                return self._certs[1]
+
+            response = await self.request('GET', self.certs_url)
+            if response.status_code != 200:
+                raise OAuthError(f"Could not fetch certificates at {self.certs_url}")
+
+            certs = response.json()
+            self._certs = (self._clock() + cache_lifetime(response.headers, self.certs_ttl), certs)
+            return certs
+
+    async def verify_id_token(self, token):
+        """
+        Verify a Google ID token and return its claims.
+
+        Raises:
+            ValueError: If the token is malformed, expired, signed with an
+                unknown key, issued for another audience or by another issuer.
+        """
+        kid = jwt.decode_header(token).get('kid')
+        certs = await self.get_certs()
+        if kid and kid not in certs:
+            if self._may_force_refresh():
+                # Google rotated its keys since the certs were cached.
+                certs = await self.get_certs(outdated=certs)
+            else:
+                # Refetches are rate-limited, but one may be in progress
+                async with self._certs_lock:
+                    certs = self._certs[1]
+
+        id_info = jwt.decode(token, certs=certs, audience=self.client_id)
+        if id_info.get('iss') not in GOOGLE_ISSUERS:
+            raise ValueError('Invalid issuer.')
+        return id_info
+
+    async def fetch_userinfo(self, access_token):
+        """
+        Fetch the OpenID Connect profile belonging to an access token.
+
+        Raises:
+            OAuthError: If Google does not return the profile.
+        """
+        response = await self.request(
+            'GET', self.userinfo_url, headers={'Authorization': f'Bearer {access_token}'}
+        )
+        if response.status_code != 200:
+            raise OAuthError(f"Failed to get user info: {response.status_code} - {response.text}")
+        return response.json()
+
+    async def exchange_code(self, code, redirect_uri):
+        """
+        Exchange an authorization code for tokens.
+
+        Raises:
+            OAuthError: If Google rejects the code.
+        """
+        response = await self.request(
+            'POST',
+            self.token_url,
+            data={
+                'code': code,
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'redirect_uri': redirect_uri,
+                'grant_type': 'authorization_code',
+            },
+        )
+        if response.status_code != 200:
+            raise OAuthError(f"Failed to exchange code for token: {response.status_code} - {response.text}")
+        return response.json()
+
+    async def aclose(self):
+        """
+        Close the pooled connections.
+        """
+        await self.http.aclose()
+
+    def _may_force_refresh(self):
+        now = self._clock()
+        if self._last_forced_refresh is not None and now - self._last_forced_refresh < self.certs_refresh_interval:
+            return False
+        self._last_forced_refresh = now
+        return True
+
+    def _certs_fresh(self):
+        return self._certs is not None and self._certs[0] > self._clock()
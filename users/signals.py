@@ -0,0 +1,31 @@
+"""Signal handlers for the users app."""
+
+from django.core.signals import setting_changed
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import user_cache
+from .models import CustomUser
+from .oauth import reset_oauth_client
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """
+    Evict a user from the JWT user cache whenever the row changes.
+
+    This covers deactivation, password changes (``set_password`` followed by
+    ``save``) and deletion. Bulk ``QuerySet.update`` calls do not send signals;
+    those rely on the cache TTL.
+    """
+    user_cache.invalidate(str(instance.pk))
+
+
+@receiver(setting_changed)
+def reset_oauth_client_on_setting_change(sender, setting, **kwargs):
+    """
+    Rebuild the shared Google OAuth client when its settings are overridden.
+    """
+    if setting.startswith('GOOGLE_'):
+        reset_oauth_client()
@@ -0,0 +1,226 @@
+"""Local stand-in for Google's OAuth endpoints.
+
+``FakeGoogleOAuthServer`` serves the certs, token and userinfo endpoints on
+127.0.0.1 so that the Google login views can be tested and benchmarked
+without network access. It signs real RS256 ID tokens with a throwaway key
+and counts requests and TCP connections per endpoint.
+"""
+
+import datetime
+import json
+import secrets
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from google.auth import crypt, jwt
+
+
+def generate_signing_key(common_name='fake-google-oauth'):
+    """
+    Create an RSA key pair and a self-signed certificate for it.
+
+    Returns:
+        tuple: ``(private_key_pem, certificate_pem)`` as strings.
+    """
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    private_pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+    return private_pem, certificate.public_bytes(serialization.Encoding.PEM).decode()
+
+
+class FakeGoogleOAuthServer:
+    """
+    Threaded HTTP server imitating Google's OAuth endpoints.
+
+    Use it as a context manager, then point the ``GOOGLE_OAUTH_*`` settings at
+    ``server.settings()``.
+
+    Attributes:
+        client_id (str): Audience written into issued ID tokens.
+        latency (float): Seconds every response is delayed by.
+        certs_max_age (int): ``max-age`` sent with the certs response.
+        requests (Counter): Number of requests per path.
+        connections (int): Number of TCP connections accepted.
+    """
+
+    def __init__(self, client_id='test-client-id', latency=0.0, certs_max_age=3600):
+        self.client_id = client_id
+        self.latency = latency
+        self.certs_max_age = certs_max_age
+        self.requests = Counter()
+        self.connections = 0
+        self.keys = {}
+        self._signer = None
+        self._access_tokens = {}
+        self._codes = {}
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+        self.rotate_key()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def settings(self):
+        """
+        Return setting overrides pointing the OAuth client at this server.
+        """
+        return {
+            'GOOGLE_CLIENT_ID': self.client_id,
+            'GOOGLE_CLIENT_SECRET': 'test-client-secret',
+            'GOOGLE_OAUTH_TOKEN_URL': f'{self.base_url}/token',
+            'GOOGLE_OAUTH_USERINFO_URL': f'{self.base_url}/userinfo',
+            'GOOGLE_OAUTH_CERTS_URL': f'{self.base_url}/certs',
+        }
+
+    def start(self):
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    def rotate_key(self):
+        """
+        Start signing tokens with a new key, published alongside the old ones.
+        """
+        private_pem, certificate_pem = generate_signing_key()
+        key_id = secrets.token_hex(8)
+        self.keys[key_id] = certificate_pem
+        self._signer = crypt.RSASigner.from_string(private_pem, key_id)
+
+    def issue_id_token(self, email, sub=None, picture=None, key_id=None, **claims):
+        """
+        Return a signed ID token for ``email``.
+
+        ``key_id`` replaces the ``kid`` of the signing key in the header, as a
+        forged token would.
+        """
+        now = int(time.time())
+        payload = {
+            'iss': 'https://accounts.google.com',
+            'aud': self.client_id,
+            'sub': sub or f'sub-{email}',
+            'email': email,
+            'picture': picture,
+            'iat': now,
+            'exp': now + 3600,
+        }
+        payload.update(claims)
+        return jwt.encode(self._signer, payload, key_id=key_id).decode()
+
+    def issue_access_token(self, email, sub=None, picture=None):
+        """
+        Return an opaque access token the userinfo endpoint resolves to ``email``.
+        """
+        token = secrets.token_urlsafe(24)
+        with self._lock:
+            self._access_tokens[token] = {'sub': sub or f'sub-{email}', 'email': email, 'picture': picture}
+        return token
+
+    def issue_code(self, email, sub=None, picture=None):
+        """
+        Return an authorization code the token endpoint exchanges for ``email``.
+        """
+        code = secrets.token_urlsafe(24)
+        access_token = self.issue_access_token(email, sub, picture)
+        with self._lock:
+            self._codes[code] = access_token
+        return code
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                self.dispatch()
+
+            def do_POST(self):
+                self.dispatch()
+
+            def dispatch(self):
+                path = urlparse(self.path).path
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                with server._lock:
+                    server.requests[path] += 1
+                if server.latency:
+                    time.sleep(server.latency)
+
+                if path == '/certs':
+                    self.reply(200, dict(server.keys), {'Cache-Control': f'public, max-age={server.certs_max_age}'})
+                elif path == '/userinfo':
+                    token = self.headers.get('Authorization', '').removeprefix('Bearer ')
+                    userinfo = server._access_tokens.get(token)
+                    if userinfo is None:
+                        self.reply(401, {'error': 'invalid_token'})
+                    else:
+                        self.reply(200, userinfo)
+                elif path == '/token':
+                    code = parse_qs(body.decode()).get('code', [''])[0]
+                    with server._lock:
+                        access_token = server._codes.pop(code, None)
+                    if access_token is None:
+                        self.reply(400, {'error': 'invalid_grant'})
+                    else:
+                        self.reply(200, {'access_token': access_token, 'token_type': 'Bearer', 'expires_in': 3600})
+                else:
+                    self.reply(404, {'error': 'not_found'})
+
+            def reply(self, status, payload, headers=None):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
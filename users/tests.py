@@ -120,3 +120,313 @@ class UserViewsTest(TestCase):
         self.assertFalse('_auth_user_id' in self.client.session)  # تأكد إنه خرج
 
 
+
+
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from users.authentication import CachedJWTAuthentication, UserCache, user_cache
+from users.models import CustomUser
+
+
+class UserCacheTest(TestCase):
+    """Test cases for the LRU/TTL cache behind CachedJWTAuthentication"""
+
+    def test_lru_eviction(self):
+        """The least recently used entry is dropped when the cache is full"""
+        cache = UserCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_ttl_expiry(self):
+        """Entries expire after the configured TTL"""
+        now = [100.0]
+        cache = UserCache(maxsize=10, ttl=5, clock=lambda: now[0])
+        cache.set('a', 1)
+        now[0] += 4
+        self.assertEqual(cache.get('a'), 1)
+        now[0] += 2
+        self.assertIsNone(cache.get('a'))
+
+
+class CachedJWTAuthenticationTest(TestCase):
+    """Test cases for CachedJWTAuthentication"""
+
+    def setUp(self):
+        user_cache.clear()
+        self.user = CustomUser.objects.create_user(username='jwtuser', password='testpass123')
+        self.token = AccessToken.for_user(self.user)
+        self.auth = CachedJWTAuthentication()
+
+    def test_second_lookup_hits_cache(self):
+        """Only the first lookup for a user queries the database"""
+        with self.assertNumQueries(1):
+            self.auth.get_user(self.token)
+        with self.assertNumQueries(0):
+            user = self.auth.get_user(self.token)
+        self.assertEqual(user.pk, self.user.pk)
+
+    def test_returns_private_copy(self):
+        """Each lookup returns a separate instance"""
+        first = self.auth.get_user(self.token)
+        second = self.auth.get_user(self.token)
+        self.assertIsNot(first, second)
+
+    def test_deactivation_invalidates_cache(self):
+        """Saving the user evicts it so deactivation takes effect immediately"""
+        self.auth.get_user(self.token)
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.get_user(self.token)
+
+    def test_password_change_invalidates_cache(self):
+        """Changing the password reloads the user on the next request"""
+        self.auth.get_user(self.token)
+        self.user.set_password('another-pass-456')
+        self.user.save()
+        with self.assertNumQueries(1):
+            user = self.auth.get_user(self.token)
+        self.assertTrue(user.check_password('another-pass-456'))
+
+    def test_messages_api_with_bearer_token(self):
+        """The messages API accepts a bearer token through the cached class"""
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.assertEqual(client.get('/api/messages/').status_code, 200)
+        self.assertEqual(client.get('/api/messages/').status_code, 200)
+        self.assertEqual(user_cache.hits, 1)
+
+
+from django.test import override_settings
+from users.oauth import cache_lifetime, get_async_oauth_client, get_oauth_client, reset_oauth_client
+from users.oauth_clients import AsyncGoogleOAuthClient
+from users.testing import FakeGoogleOAuthServer
+
+
+class FakeGoogleOAuthServerMixin:
+    """Starts a local stand-in OAuth server and points the settings at it"""
+
+    server_latency = 0.0
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeGoogleOAuthServer(latency=cls.server_latency)
+        cls.server.start()
+        cls.settings_override = override_settings(**cls.server.settings())
+        cls.settings_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        cls.server.stop()
+        super().tearDownClass()
+
+
+class GoogleOAuthClientTest(FakeGoogleOAuthServerMixin, TestCase):
+    """Test cases for the shared Google OAuth client against a local stand-in server"""
+
+    def setUp(self):
+        self.server.requests.clear()
+        self.server.certs_max_age = 3600
+        # A fresh client, so no test inherits another's certs or refetch cooldown
+        reset_oauth_client()
+        self.addCleanup(reset_oauth_client)
+
+    def test_cache_lifetime_honours_headers(self):
+        """max-age, Age and no-store are respected"""
+        self.assertEqual(cache_lifetime({'Cache-Control': 'public, max-age=100'}, 5), 100)
+        self.assertEqual(cache_lifetime({'Cache-Control': 'max-age=100', 'Age': '40'}, 5), 60)
+        self.assertEqual(cache_lifetime({'Cache-Control': 'no-store'}, 5), 0)
+        self.assertEqual(cache_lifetime({}, 5), 5)
+
+    def test_certs_fetched_once(self):
+        """Verifying several ID tokens fetches the signing certs only once"""
+        client = get_oauth_client()
+        for _ in range(3):
+            id_info = client.verify_id_token(self.server.issue_id_token('a@example.com'))
+        self.assertEqual(id_info['email'], 'a@example.com')
+        self.assertEqual(self.server.requests['/certs'], 1)
+
+    def test_certs_not_cached_without_max_age(self):
+        """A max-age of zero forces a fetch per verification"""
+        self.server.certs_max_age = 0
+        client = get_oauth_client()
+        client.verify_id_token(self.server.issue_id_token('a@example.com'))
+        client.verify_id_token(self.server.issue_id_token('a@example.com'))
+        self.assertEqual(self.server.requests['/certs'], 2)
+
+    def test_unknown_key_refetches_certs(self):
+        """A token signed with a rotated key refreshes the cached certs"""
+        client = get_oauth_client()
+        client.verify_id_token(self.server.issue_id_token('a@example.com'))
+        self.server.rotate_key()
+        id_info = client.verify_id_token(self.server.issue_id_token('b@example.com'))
+        self.assertEqual(id_info['email'], 'b@example.com')
+        self.assertEqual(self.server.requests['/certs'], 2)
+
+    def test_unknown_key_refetches_are_rate_limited(self):
+        """Tokens with made-up key ids cannot force a certs fetch per request"""
+        client = get_oauth_client()
+        client.verify_id_token(self.server.issue_id_token('a@example.com'))
+        for key_id in ('forged-1', 'forged-2', 'forged-3'):
+            with self.assertRaises(ValueError):
+                client.verify_id_token(self.server.issue_id_token('a@example.com', key_id=key_id))
+        self.assertEqual(self.server.requests['/certs'], 2)
+
+        # Genuine tokens still verify from the cached certs
+        client.verify_id_token(self.server.issue_id_token('b@example.com'))
+        self.assertEqual(self.server.requests['/certs'], 2)
+
+    async def test_async_unknown_key_refetches_are_rate_limited(self):
+        """The async client refetches for an unknown key id at most once per interval"""
+        now = [0.0]
+        settings = self.server.settings()
+        client = AsyncGoogleOAuthClient(
+            client_id=settings['GOOGLE_CLIENT_ID'], client_secret=settings['GOOGLE_CLIENT_SECRET'],
+            token_url=settings['GOOGLE_OAUTH_TOKEN_URL'], userinfo_url=settings['GOOGLE_OAUTH_USERINFO_URL'],
+            certs_url=settings['GOOGLE_OAUTH_CERTS_URL'], certs_refresh_interval=60, clock=lambda: now[0],
+        )
+        try:
+            await client.verify_id_token(self.server.issue_id_token('a@example.com'))
+            for key_id in ('forged-1', 'forged-2', 'forged-3'):
+                with self.assertRaises(ValueError):
+                    await client.verify_id_token(self.server.issue_id_token('a@example.com', key_id=key_id))
+            self.assertEqual(self.server.requests['/certs'], 2)
+
+            # Once the interval has passed, a rotated key is picked up
+            now[0] = 61
+            self.server.rotate_key()
+            id_info = await client.verify_id_token(self.server.issue_id_token('b@example.com'))
+            self.assertEqual(id_info['email'], 'b@example.com')
+            self.assertEqual(self.server.requests['/certs'], 3)
+        finally:
+            await client.aclose()
+
+    async def test_reset_closes_async_client_of_running_loop(self):
+        """Resetting from the loop that owns an async client closes its pool"""
+        client = get_async_oauth_client()
+        reset_oauth_client()
+        await asyncio.sleep(0)
+        self.assertTrue(client.http.is_closed)
+        self.assertIsNot(get_async_oauth_client(), client)
+
+    def test_reset_closes_async_client_of_idle_loop(self):
+        """Async clients of loops that are not running are closed on their loop"""
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        async def create():
+            return get_async_oauth_client()
+
+        client = loop.run_until_complete(create())
+        reset_oauth_client()
+        self.assertTrue(client.http.is_closed)
+
+    def test_wrong_audience_rejected(self):
+        """Tokens issued for another client are rejected"""
+        with self.assertRaises(ValueError):
+            get_oauth_client().verify_id_token(self.server.issue_id_token('a@example.com', aud='other-client'))
+
+    def test_connections_are_reused(self):
+        """Consecutive userinfo calls share one keep-alive connection"""
+        client = get_oauth_client()
+        client.fetch_userinfo(self.server.issue_access_token('a@example.com'))
+        connections = self.server.connections
+        for _ in range(3):
+            client.fetch_userinfo(self.server.issue_access_token('a@example.com'))
+        self.assertEqual(self.server.connections, connections)
+
+    def test_google_login_with_id_token(self):
+        """GoogleLoginView returns JWT tokens for a valid ID token"""
+        token = self.server.issue_id_token('idtoken@example.com')
+        response = APIClient().post('/users/api/auth/google/', {'token': token})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['user']['email'], 'idtoken@example.com')
+        self.assertEqual(self.server.requests['/userinfo'], 0)
+
+    def test_google_login_with_access_token(self):
+        """GoogleLoginView falls back to the userinfo endpoint for access tokens"""
+        token = self.server.issue_access_token('access@example.com')
+        response = APIClient().post('/users/api/auth/google/', {'token': token})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(CustomUser.objects.filter(email='access@example.com').exists())
+
+    def test_google_login_invalid_token(self):
+        """GoogleLoginView rejects a token Google does not recognise"""
+        response = APIClient().post('/users/api/auth/google/', {'token': 'not-a-token'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_google_callback(self):
+        """GoogleCallbackView exchanges the code and redirects to the chat page"""
+        code = self.server.issue_code('callback@example.com')
+        response = self.client.get('/users/api/auth/google/callback/', {'code': code})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(CustomUser.objects.filter(email='callback@example.com').exists())
+
+    def test_google_callback_invalid_code(self):
+        """GoogleCallbackView reports a rejected code as a bad request"""
+        response = self.client.get('/users/api/auth/google/callback/', {'code': 'bogus'})
+        self.assertEqual(response.status_code, 400)
+
+
+import asyncio
+from django.test import TransactionTestCase
+
+
+class AsyncGoogleViewsTest(FakeGoogleOAuthServerMixin, TransactionTestCase):
+    """Test cases for the async Google login views"""
+
+    server_latency = 0.3
+
+    def setUp(self):
+        self.server.requests.clear()
+
+    async def test_async_login_with_id_token(self):
+        """AsyncGoogleLoginView returns JWT tokens and creates the user"""
+        token = self.server.issue_id_token('async@example.com')
+        response = await self.async_client.post('/users/api/auth/google/async/', {'token': token})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['user']['email'], 'async@example.com')
+
+    async def test_async_login_with_access_token(self):
+        """AsyncGoogleLoginView falls back to the userinfo endpoint"""
+        token = self.server.issue_access_token('async-access@example.com')
+        response = await self.async_client.post(
+            '/users/api/auth/google/async/', {'token': token}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.requests['/userinfo'], 1)
+
+    async def test_async_login_invalid_token(self):
+        """AsyncGoogleLoginView rejects unknown tokens"""
+        response = await self.async_client.post('/users/api/auth/google/async/', {'token': 'bogus'})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_async_callback(self):
+        """AsyncGoogleCallbackView logs the user in and redirects to the chat page"""
+        code = self.server.issue_code('async-callback@example.com')
+        response = await self.async_client.get('/users/api/auth/google/async/callback/', {'code': code})
+        self.assertEqual(response.status_code, 302)
+        session = await self.async_client.asession()
+        self.assertIsNotNone(await session.aget('_auth_user_id'))
+
+    async def test_async_login_does_not_block_message_api(self):
+        """The message API answers while a login is waiting on Google"""
+        user = await CustomUser.objects.acreate(username='reader')
+        token = AccessToken.for_user(user)
+
+        login = asyncio.ensure_future(self.async_client.post(
+            '/users/api/auth/google/async/', {'token': self.server.issue_id_token('slow@example.com')}
+        ))
+        await asyncio.sleep(0.05)
+        response = await self.async_client.get('/api/messages/', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(login.done())
+        self.assertEqual((await login).status_code, 200)
@@ -13,6 +13,9 @@ urlpatterns = [
     path('api/auth/google/', views.GoogleLoginView.as_view(), name='google_login'),
     # تسجيل الدخول باستخدام حساب جوجل
     path('api/auth/google/callback/', views.GoogleCallbackView.as_view(), name='google_callback'),
+    # نسخ غير متزامنة لا تحجز خيط العامل أثناء انتظار Google (تحت ASGI)
+    path('api/auth/google/async/', views.AsyncGoogleLoginView.as_view(), name='google_login_async'),
+    path('api/auth/google/async/callback/', views.AsyncGoogleCallbackView.as_view(), name='google_callback_async'),
 
 
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
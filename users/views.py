@@ -1,24 +1,76 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
 from chat.models import Message
+from channels.db import database_sync_to_async
+from django.conf import settings
 from django.shortcuts import render
-import requests
+from django.urls import reverse
+from django.views import View
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from django.conf import settings
-from django.http import HttpResponseRedirect
-
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
+from django.http import HttpResponseRedirect, JsonResponse
 
 from .models import CustomUser
+from .oauth import OAuthError, get_async_oauth_client, get_oauth_client
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.permissions import AllowAny
-from django.contrib.auth import login
+from django.contrib.auth import alogin, login
 # Import csrf_exempt and method_decorator if they are not already imported elsewhere
 # (Assuming they might be needed for GoogleCallbackView as well)
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 
+# Executor for the database work of the async Google views, kept apart from
+# the thread that runs Django's sync views so that logins never queue there.
+oauth_db_executor = ThreadPoolExecutor(
+    max_workers=settings.GOOGLE_OAUTH_DB_WORKERS,
+    thread_name_prefix='oauth-db',
+)
+
+
+def get_or_create_google_user(email, google_id, avatar):
+    """
+    Return the local user for a Google account, creating it on first login.
+
+    Args:
+        email (str): The verified Google e-mail address.
+        google_id (str): The Google account id (``sub`` claim).
+        avatar (str): URL of the profile picture, if any.
+
+    Returns:
+        CustomUser: The matching user.
+    """
+    user, _ = CustomUser.objects.get_or_create(
+        email=email,
+        defaults={
+            'username': email,
+            'google_id': google_id,
+            'avatar': avatar,
+        }
+    )
+    return user
+
+
+def jwt_login_payload(user):
+    """
+    Build the token response returned to API clients after a login.
+
+    Returns:
+        dict: refresh token, access token and basic user information.
+    """
+    refresh = RefreshToken.for_user(user)
+    return {
+        'refresh': str(refresh),
+        'access': str(refresh.access_token),
+        'user': {
+            'id': user.id,
+            'username': user.username,
+            'email': user.email
+        }
+    }
+
 
 @method_decorator(csrf_exempt, name='dispatch')
 class GoogleLoginView(APIView):
@@ -39,14 +91,9 @@ class GoogleLoginView(APIView):
         try:
             print(f"Received token: {token[:10]}...")
             # محاولة التحقق من ID token أولاً
+            oauth_client = get_oauth_client()
             try:
-                id_info = id_token.verify_oauth2_token(
-                    token,
-                    google_requests.Request(),
-                    settings.GOOGLE_CLIENT_ID
-                )
-                if id_info['iss'] not in ['accounts.google.com', 'https://accounts.google.com']:
-                    raise ValueError('Invalid issuer.')
+                id_info = oauth_client.verify_id_token(token)
 
                 email = id_info['email']
                 google_id = id_info['sub']
@@ -56,45 +103,24 @@ class GoogleLoginView(APIView):
             except Exception as e:
                 print(f"ID token verification failed: {str(e)}")
                 # إذا فشل التحقق من ID token، حاول استخدام access token
-                headers = {'Authorization': f'Bearer {token}'}
-                userinfo_response = requests.get('https://www.googleapis.com/oauth2/v3/userinfo', headers=headers)
-
-                if not userinfo_response.ok:
-                    error_msg = f"Failed to get user info: {userinfo_response.status_code} - {userinfo_response.text}"
-                    print(error_msg)
-                    raise ValueError(error_msg)
-
-                userinfo = userinfo_response.json()
+                try:
+                    userinfo = oauth_client.fetch_userinfo(token)
+                except OAuthError as userinfo_error:
+                    print(str(userinfo_error))
+                    raise
                 email = userinfo['email']
                 google_id = userinfo['sub']
                 avatar = userinfo.get('picture')
                 print(f"Got user info using access token for: {email}")
 
             # إنشاء أو استرجاع المستخدم
-            user, _ = CustomUser.objects.get_or_create(
-                email=email,
-                defaults={
-                    'username': email,
-                    'google_id': google_id,
-                    'avatar': avatar,
-                }
-            )
+            user = get_or_create_google_user(email, google_id, avatar)
             print(f"User authenticated: {user.username} (ID: {user.id})")
 
             # تسجيل الدخول للمستخدم
             
             # إنشاء رموز JWT
-            refresh = RefreshToken.for_user(user)
-
-            return Response({
-                'refresh': str(refresh),
-                'access': str(refresh.access_token),
-                'user': {
-                    'id': user.id,
-                    'username': user.username,
-                    'email': user.email
-                }
-            })
+            return Response(jwt_login_payload(user))
             # The following code was unreachable because it came after 'return Response'
             # other_users = CustomUser.objects.exclude(id=user.id).first()
             # chat_username = other_users.username if other_users else user.username
@@ -137,41 +163,24 @@ class GoogleCallbackView(APIView):
 
             print(f"Received authorization code: {code[:10]}...")
 
-            # Exchange authorization code for access token
-            token_url = 'https://oauth2.googleapis.com/token'
-            data = {
-                'code': code,
-                'client_id': settings.GOOGLE_CLIENT_ID,
-                'client_secret': settings.GOOGLE_CLIENT_SECRET,
-                'redirect_uri': 'http://localhost:8000/users/api/auth/google/callback/',
-                'grant_type': 'authorization_code'
-            }
+            oauth_client = get_oauth_client()
 
+            # Exchange authorization code for access token
             print("Exchanging code for token...")
-            response = requests.post(token_url, data=data)
-            if not response.ok:
-                error_msg = f"Failed to exchange code for token: {response.status_code} - {response.text}"
-                print(error_msg)
-                return Response({'error': error_msg}, status=status.HTTP_400_BAD_REQUEST)
-
-            token_data = response.json()
+            token_data = oauth_client.exchange_code(
+                code, 'http://localhost:8000/users/api/auth/google/callback/'
+            )
             access_token = token_data.get('access_token')
             print(f"Received access token: {access_token[:10]}...")
 
             # Get user info using access token
-            userinfo_url = 'https://www.googleapis.com/oauth2/v3/userinfo'
-            headers = {'Authorization': f'Bearer {access_token}'}
             print("Getting user info...")
-            print(access_token)
-            userinfo_response = requests.get(userinfo_url, headers=headers)
-
-            if not userinfo_response.ok:
-                error_msg = f"Failed to get user info: {userinfo_response.status_code} - {userinfo_response.text}"
-                print(error_msg)
-                return Response({'error': error_msg}, status=status.HTTP_400_BAD_REQUEST)
-
-            userinfo = userinfo_response.json()
+            userinfo = oauth_client.fetch_userinfo(access_token)
             print(f"Received user info for: {userinfo.get('email')}")
+        except OAuthError as e:
+            error_msg = str(e)
+            print(error_msg)
+            return Response({'error': error_msg}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             error_msg = f"Error in OAuth callback: {str(e)}"
             print(error_msg)
@@ -180,14 +189,7 @@ class GoogleCallbackView(APIView):
         try:
             # Get or create user
             print(f"Creating or getting user with email: {userinfo['email']}")
-            user, _ = CustomUser.objects.get_or_create(
-                email=userinfo['email'],
-                defaults={
-                    'username': userinfo['email'],
-                    'google_id': userinfo['sub'],
-                    'avatar': userinfo.get('picture'),
-                }
-            )
+            user = get_or_create_google_user(userinfo['email'], userinfo['sub'], userinfo.get('picture'))
             print(f"User authenticated: {user.username} (ID: {user.id})")
 
             # تسجيل الدخول للمستخدم باستخدام الجلسة
@@ -211,6 +213,117 @@ class GoogleCallbackView(APIView):
             print(error_msg)
             return Response({'error': error_msg}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+
+def parse_request_data(request):
+    """
+    Return the JSON or form body of a plain Django request as a dict.
+    """
+    if request.content_type == 'application/json':
+        return json.loads(request.body or b'{}')
+    return request.POST
+
+
+def google_login_payload(userinfo):
+    """
+    Get or create the user for verified Google claims and issue JWT tokens.
+    """
+    user = get_or_create_google_user(userinfo['email'], userinfo['sub'], userinfo.get('picture'))
+    return jwt_login_payload(user)
+
+
+def google_callback_user(userinfo):
+    """
+    Resolve the user for a Google callback and pick someone to chat with.
+
+    Returns:
+        tuple: ``(user, chat_username)``.
+    """
+    user = get_or_create_google_user(userinfo['email'], userinfo['sub'], userinfo.get('picture'))
+    other_users = CustomUser.objects.exclude(id=user.id).first()
+    return user, other_users.username if other_users else user.username
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncGoogleLoginView(View):
+    """
+    Non-blocking version of GoogleLoginView for ASGI deployments.
+
+    Google is called through the shared ``AsyncGoogleOAuthClient`` and the
+    user lookup runs on ``oauth_db_executor``, so a slow Google response only
+    delays this login and never holds the thread that serves sync views.
+
+    Endpoints:
+        POST /users/api/auth/google/async/: Authenticate with Google OAuth token
+            - Required fields: token (Google ID token or access token)
+            - Returns: refresh token, access token, and user information
+    """
+
+    async def post(self, request):
+        try:
+            token = parse_request_data(request).get('token')
+            if not token:
+                raise ValueError('No token provided')
+
+            oauth_client = get_async_oauth_client()
+            try:
+                id_info = await oauth_client.verify_id_token(token)
+            except Exception as e:
+                print(f"ID token verification failed: {str(e)}")
+                # إذا فشل التحقق من ID token، حاول استخدام access token
+                id_info = await oauth_client.fetch_userinfo(token)
+
+            payload = await database_sync_to_async(
+                google_login_payload, thread_sensitive=False, executor=oauth_db_executor
+            )(id_info)
+            return JsonResponse(payload)
+        except Exception as e:
+            error_msg = f"Error in Google login: {str(e)}"
+            print(error_msg)
+            return JsonResponse({'error': error_msg}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncGoogleCallbackView(View):
+    """
+    Non-blocking version of GoogleCallbackView for ASGI deployments.
+
+    Endpoints:
+        GET /users/api/auth/google/async/callback/: Handle Google OAuth callback
+            - Required query parameters: code (authorization code from Google)
+            - Redirects to: /chat/{username}/ after successful authentication
+    """
+
+    async def get(self, request):
+        code = request.GET.get('code')
+        if not code:
+            return JsonResponse({'error': 'No authorization code provided'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            oauth_client = get_async_oauth_client()
+            redirect_uri = request.build_absolute_uri(reverse('google_callback_async'))
+            token_data = await oauth_client.exchange_code(code, redirect_uri)
+            userinfo = await oauth_client.fetch_userinfo(token_data.get('access_token'))
+        except OAuthError as e:
+            print(str(e))
+            return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            error_msg = f"Error in OAuth callback: {str(e)}"
+            print(error_msg)
+            return JsonResponse({'error': error_msg}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        try:
+            user, chat_username = await database_sync_to_async(
+                google_callback_user, thread_sensitive=False, executor=oauth_db_executor
+            )(userinfo)
+
+            # تسجيل الدخول للمستخدم باستخدام الجلسة
+            await alogin(request, user)
+            return HttpResponseRedirect(f'/chat/{chat_username}/')
+        except Exception as e:
+            error_msg = f"Error in user creation or login: {str(e)}"
+            print(error_msg)
+            return JsonResponse({'error': error_msg}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 from django.contrib.auth.decorators import login_required
 
 @login_required
@@ -271,16 +384,6 @@ class GoogleUserTokenView(APIView):
                                status=status.HTTP_400_BAD_REQUEST)
 
             # Generate tokens
-            refresh = RefreshToken.for_user(user)
-
-            return Response({
-                'refresh': str(refresh),
-                'access': str(refresh.access_token),
-                'user': {
-                    'id': user.id,
-                    'username': user.username,
-                    'email': user.email
-                }
-            })
+            return Response(jwt_login_payload(user))
         except CustomUser.DoesNotExist:
             return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)